@@ -0,0 +1,83 @@
+# benchmarks/bench_category_filter.py
+"""
+按类别过滤的检索延迟: 全库检索 vs where={"category": ...} 下推到向量库
+
+合成向量均匀分到 --categories 个类别 (每条记录的 metadata 带 category)，对每个规模和后端测量
+不过滤、以及只在一个类别里检索的单条查询 p50/p95，并检查过滤结果是否都属于该类别。
+mmap 后端只读取该类别的行参与计算，库越大、类别越多，过滤检索相对全库检索越快。
+
+用法:
+    python benchmarks/bench_category_filter.py --sizes 10000 100000 1000000 --categories 20
+    python benchmarks/bench_category_filter.py --sizes 100000 --backends mmap-float16
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_vector_store import BACKENDS, make_vectors, open_collection
+
+
+def build(backend, path, vectors, categories):
+    client, collection = open_collection(backend, path)
+    step = client.get_max_batch_size()
+    for i in range(0, len(vectors), step):
+        part = vectors[i:i + step]
+        collection.upsert(ids=[str(j) for j in range(i, i + len(part))], embeddings=part,
+                          metadatas=[{"category": f"C{j % categories}"} for j in range(i, i + len(part))])
+    return collection
+
+
+def latency(collection, queries, k, where):
+    """返回 (p50 毫秒, p95 毫秒, 结果里不满足过滤条件的条数)"""
+    collection.query(query_embeddings=[queries[0]], n_results=k, where=where)
+    times, wrong = [], 0
+    for q in queries:
+        t0 = time.perf_counter()
+        result = collection.query(query_embeddings=[q], n_results=k, where=where)
+        times.append(time.perf_counter() - t0)
+        if where:
+            wrong += sum(m["category"] != where["category"] for m in result["metadatas"][0])
+    ms = np.asarray(times) * 1000
+    return float(np.percentile(ms, 50)), float(np.percentile(ms, 95)), wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全库检索 vs 按类别过滤检索")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    where = {"category": "C3"}
+    print(f"每个类别约占 {1 / args.categories:.1%}，过滤条件 {where}")
+    print(f"{'行数':>9} {'后端':<13} {'全库p50':>8} {'全库p95':>8} {'过滤p50':>8} {'过滤p95':>8} {'加速':>6} {'越界':>5}")
+    for n in args.sizes:
+        vectors = make_vectors(n, args.dim, clusters=200, seed=args.seed)
+        rng = np.random.default_rng(args.seed + 1)
+        queries = vectors[rng.integers(0, n, args.queries)]
+        for backend in args.backends:
+            path = tempfile.mkdtemp(prefix="kb_filter_")
+            try:
+                collection = build(backend, path, vectors, args.categories)
+                full50, full95, _ = latency(collection, queries, args.k, None)
+                cat50, cat95, wrong = latency(collection, queries, args.k, where)
+                print(f"{n:>9} {backend:<13} {full50:>8.2f} {full95:>8.2f} {cat50:>8.2f} {cat95:>8.2f} "
+                      f"{full50 / max(cat50, 1e-9):>5.1f}x {wrong:>5}")
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
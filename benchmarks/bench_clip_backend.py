@@ -0,0 +1,115 @@
+# benchmarks/bench_clip_backend.py
+"""
+CLIP 推理后端对比: torch (fp32) / int8 / onnx / onnx-int8
+
+对 visual_collection 里已入库的图片重新向量化，报告每个后端的:
+  - 吞吐 (img/s，经 get_clip_embeddings_batch，不含模型加载)
+  - 进程峰值内存 (peak RSS，含模型加载)
+  - 与库中 fp32 向量的余弦相似度 (均值 / 最小值)
+每个后端在独立子进程里运行，峰值内存互不干扰；测试时关闭向量缓存。
+
+用法:
+    python benchmarks/bench_clip_backend.py --limit 128 --backends torch int8 onnx onnx-int8 --threads 4
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_stored(limit):
+    """从 visual_collection 取出文件仍然存在的图片路径及其 fp32 向量"""
+    from core.db_handler import DatabaseHandler
+    db = DatabaseHandler()
+    stored = db.visual_collection.get(include=["embeddings", "metadatas"])
+    paths, vectors = [], []
+    for meta, vec in zip(stored["metadatas"], stored["embeddings"]):
+        if meta and os.path.exists(meta.get("path", "")):
+            paths.append(meta["path"])
+            vectors.append(vec)
+        if limit and len(paths) >= limit:
+            break
+    return paths, np.asarray(vectors, dtype=np.float32)
+
+
+def run_child(backend, paths_file, out_file, batch_size):
+    """子进程: 用指定后端向量化，结果写进 out_file (npz)"""
+    from core.ai_handler import AIHandler
+    with open(paths_file, "r", encoding="utf-8") as f:
+        paths = json.load(f)
+
+    ai = AIHandler(clip_backend=backend)
+    ai.cache = None
+    # 预热: 加载模型 (onnx 首次运行时会先导出)，排除首次推理的初始化开销
+    ai.get_clip_embeddings_batch(paths[:batch_size], batch_size=batch_size)
+
+    t0 = time.perf_counter()
+    vectors = ai.get_clip_embeddings_batch(paths, batch_size=batch_size)
+    elapsed = time.perf_counter() - t0
+    # Linux 上 ru_maxrss 的单位是 KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    np.savez(out_file, vectors=vectors, elapsed=elapsed, peak_mb=peak_mb)
+
+
+def cosine(a, b):
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIP 推理后端对比")
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx", "onnx-int8"])
+    parser.add_argument("--limit", type=int, default=128, help="参与测试的已入库图片数")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="推理线程数 (CLIP_NUM_THREADS)，0 表示框架默认")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--paths-file", help=argparse.SUPPRESS)
+    parser.add_argument("--out-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    if args.child:
+        run_child(args.child, args.paths_file, args.out_file, args.batch_size)
+        return
+
+    paths, stored = load_stored(args.limit)
+    if not paths:
+        print("[错误] visual_collection 中没有可用的图片，请先入库一些图片")
+        return
+    print(f"图片数: {len(paths)}  batch={args.batch_size}  threads={args.threads or '默认'}")
+
+    env = dict(os.environ, CLIP_NUM_THREADS=str(args.threads))
+    with tempfile.TemporaryDirectory() as tmp:
+        paths_file = os.path.join(tmp, "paths.json")
+        with open(paths_file, "w", encoding="utf-8") as f:
+            json.dump(paths, f)
+
+        print(f"{'后端':<10} {'img/s':>8} {'峰值内存':>10} {'余弦均值':>10} {'余弦最小':>10}")
+        for backend in args.backends:
+            out_file = os.path.join(tmp, f"{backend}.npz")
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", backend,
+                 "--paths-file", paths_file, "--out-file", out_file, "--batch-size", str(args.batch_size)],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            )
+            if proc.returncode != 0 or not os.path.exists(out_file):
+                print(f"{backend:<10} 运行失败: {proc.stderr.strip().splitlines()[-1] if proc.stderr else proc.returncode}")
+                continue
+            result = np.load(out_file)
+            sims = cosine(result["vectors"], stored)
+            print(f"{backend:<10} {len(paths) / float(result['elapsed']):8.1f} "
+                  f"{float(result['peak_mb']):8.0f}MB {sims.mean():10.4f} {sims.min():10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/bench_clip_batch.py
+"""
+CLIP 图片向量化吞吐对比: 逐张 get_clip_embedding vs 批量 get_clip_embeddings_batch
+
+用法:
+    python benchmarks/bench_clip_batch.py ./images --batch-size 32 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from core.ai_handler import AIHandler
+
+IMG_EXTS = ['.jpg', '.jpeg', '.png', '.bmp', '.webp']
+
+
+def collect_images(folder, limit):
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        for file in sorted(files):
+            if os.path.splitext(file)[1].lower() in IMG_EXTS:
+                paths.append(os.path.join(root, file))
+    if limit and len(paths) < limit:
+        # 图片不够时循环复用，保证样本量
+        paths = (paths * (limit // max(len(paths), 1) + 1))[:limit]
+    return paths[:limit] if limit else paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIP 批量推理吞吐对比")
+    parser.add_argument("folder", help="图片文件夹")
+    parser.add_argument("--limit", type=int, default=128, help="参与测试的图片数")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    paths = collect_images(args.folder, args.limit)
+    if not paths:
+        print("[错误] 文件夹中没有图片")
+        return
+
+    ai = AIHandler()
+    # 关闭向量缓存，否则第二条路径会直接命中第一条路径写入的缓存
+    ai.cache = None
+    # 预热一次，排除首次推理的初始化开销
+    ai.get_clip_embedding(paths[0])
+
+    t0 = time.perf_counter()
+    single = np.array([ai.get_clip_embedding(p) for p in paths], dtype=np.float32)
+    t_single = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch = ai.get_clip_embeddings_batch(paths, batch_size=args.batch_size, num_workers=args.workers)
+    t_batch = time.perf_counter() - t0
+
+    # 两条路径的结果应当一致
+    max_diff = float(np.abs(single - batch).max())
+
+    print(f"图片数: {len(paths)}")
+    print(f"逐张:  {t_single:.2f}s  {len(paths) / t_single:.1f} img/s")
+    print(f"批量:  {t_batch:.2f}s  {len(paths) / t_batch:.1f} img/s  (batch={args.batch_size}, workers={args.workers})")
+    print(f"加速比: {t_single / t_batch:.2f}x  最大数值误差: {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# benchmarks/bench_image_analyze.py
+"""
+图片入库的远程请求数与耗时: 分别请求描述 + 分类 (旧) vs 一次结构化请求 + 描述向量合并请求 (新)
+
+在临时目录中生成合成图片，Gemini 换成本地替身 (--latency 模拟每次请求的网络往返)，CLIP 换成随机投影，
+两种方式各跑一遍 batch_ingest 的图片流水线，统计 generate / embed 请求次数和每张图片的平均耗时。
+
+用法:
+    python benchmarks/bench_image_analyze.py --images 200 --latency 0.2 --workers 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import make_random_image
+
+TOPICS = "Model_Architecture,Performance_Plot,Table,Qualitative_Visualization,Algorithm_Math"
+
+
+def run(folder, structured, args):
+    """在独立的库目录里跑一遍图片流水线，返回 (耗时, generate 请求数, embed 请求数)"""
+    from benchmarks.stubs import install_stubs
+    from core.ai_handler import AIHandler
+    from core.db_handler import DatabaseHandler
+    from core.pipeline import IngestPipeline, new_task
+
+    src = os.path.abspath(f"inbox_{structured}")
+    shutil.copytree(folder, src)
+    ai = AIHandler()
+    ai.cache = None
+    provider, model = install_stubs(ai, latency=args.latency)
+    db = DatabaseHandler(path=os.path.abspath(f"kb_{structured}"))
+    tasks = [new_task("image", os.path.join(src, f)) for f in sorted(os.listdir(src))]
+
+    pipeline = IngestPipeline(ai, db, "", TOPICS, io_workers=args.workers, dedup=False, structured=structured)
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        stats = pipeline.run(tasks)
+        elapsed = time.perf_counter() - t0
+    if stats["image"] != len(tasks):
+        print(f"[警告] 只入库了 {stats['image']}/{len(tasks)} 张")
+    return elapsed, model.calls, provider.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片入库: 分别请求 vs 结构化单次请求")
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="替身模拟的单次请求延迟 (秒)")
+    parser.add_argument("--workers", type=int, default=8, help="I/O 线程数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="kb_analyze_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        folder = os.path.abspath("corpus")
+        os.makedirs(folder)
+        for i in range(args.images):
+            make_random_image(os.path.join(folder, f"figure_{i:04d}.png"), size=(800, 600), seed=i)
+
+        print(f"{args.images} 张图片，模拟延迟 {args.latency * 1000:.0f}ms，I/O 线程 {args.workers}")
+        print(f"{'方式':<12} {'耗时(s)':>8} {'每张(ms)':>9} {'generate':>9} {'embed':>7} {'请求/张':>8}")
+        results = {}
+        for name, structured in (("分别请求", False), ("结构化", True)):
+            elapsed, generate, embed = run(folder, structured, args)
+            results[name] = (elapsed, generate + embed)
+            print(f"{name:<12} {elapsed:>8.2f} {elapsed / args.images * 1000:>9.1f} {generate:>9} {embed:>7} "
+                  f"{(generate + embed) / args.images:>8.2f}")
+        (t_old, n_old), (t_new, n_new) = results["分别请求"], results["结构化"]
+        print(f"耗时减少 {1 - t_new / t_old:.0%}，请求数减少 {1 - n_new / n_old:.0%}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/bench_image_search.py
+"""
+search_image 端到端延迟: 串行双路 (旧) vs 并发双路 + 融合 (新)
+
+  - 串行: Gemini 描述向量 -> 查描述库 -> CLIP 文本向量 -> 查视觉库，依次执行
+  - 并发: main.search_images，两路同时进行后按图片路径融合
+测试时关闭向量缓存，保证每次都真实请求 Gemini、真实跑 CLIP。
+需要已经入库的图片和可用的 GEMINI_API_KEY。
+
+用法:
+    python benchmarks/bench_image_search.py "模型架构图" "loss 曲线" --repeat 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def sequential(ai, db, query, n_results):
+    desc = db.search_image_desc(ai.get_gemini_embedding(query), n_results=n_results)
+    clip = db.search_image_clip(ai.get_clip_text_embedding(query), n_results=n_results)
+    return desc, clip
+
+
+def summarize(name, times):
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    print(f"{name:<12} p50 {statistics.median(times) * 1000:8.1f}ms   p95 {p95 * 1000:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片双路检索: 串行 vs 并发融合")
+    parser.add_argument("queries", nargs="+", help="测试用的描述")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--n", type=int, default=10, help="每一路召回数")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    import main as cli
+    ai, db = cli.init_handlers("search_image")
+    ai.cache = None
+
+    # 预热: 加载 CLIP、建立连接
+    sequential(ai, db, args.queries[0], args.n)
+
+    serial_times, concurrent_times = [], []
+    for _ in range(args.repeat):
+        for query in args.queries:
+            t0 = time.perf_counter()
+            sequential(ai, db, query, args.n)
+            serial_times.append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            cli.search_images(ai, db, query, n_results=args.n)
+            concurrent_times.append(time.perf_counter() - t0)
+
+    summarize("串行", serial_times)
+    summarize("并发+融合", concurrent_times)
+    print(f"加速比 (p50): {statistics.median(serial_times) / statistics.median(concurrent_times):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_ingest_write.py
+"""
+入库写库吞吐: 逐文件 upsert (旧) vs 缓冲批量写库 + 入库日志 (新)
+
+在临时目录中新建本地 Chroma 库，用随机向量模拟论文切片 (768 维) 与图片 (CLIP 512 维 + 描述 768 维)，
+不调用 Gemini，也不加载 CLIP。
+  - 逐文件: 每篇论文一次 upsert，每张图片两次 upsert，与改动前的 DatabaseHandler 相同
+  - 批量:   db.begin_batch() 之后走 add_paper_chunks / add_image，每个文件先记入日志再进缓冲
+
+用法:
+    python benchmarks/bench_ingest_write.py --papers 200 --images 500 --batch-rows 2000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.db_handler import DatabaseHandler
+
+
+def make_corpus(papers, chunks_per_paper, images, seed=0):
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for i in range(papers):
+        chunks = [{"text": f"paper {i} chunk {j} attention transformer policy gradient", "page": j + 1,
+                   "source": f"paper_{i}.pdf", "chunk_id": f"p{i}_c{j}"}
+                  for j in range(chunks_per_paper)]
+        corpus.append(("paper", f"paper_{i}.pdf", chunks, rng.standard_normal((chunks_per_paper, 768)).tolist()))
+    for i in range(images):
+        corpus.append(("image", f"fig_{i}.png", rng.standard_normal(512).tolist(),
+                       (f"figure {i}: model architecture diagram", rng.standard_normal(768).tolist())))
+    return corpus
+
+
+def write_per_file(db, corpus):
+    """改动前的写法: 直接对 collection 逐文件 upsert"""
+    for kind, name, a, b in corpus:
+        if kind == "paper":
+            db.paper_collection.upsert(
+                ids=[f"{name}_{c['chunk_id']}" for c in a],
+                embeddings=b,
+                metadatas=[{"source": name, "page": c["page"]} for c in a],
+                documents=[c["text"] for c in a],
+            )
+        else:
+            desc, desc_vec = b
+            db.visual_collection.upsert(ids=[f"img_clip_{name}"], embeddings=[a], metadatas=[{"path": name}])
+            db.image_desc_collection.upsert(ids=[f"img_desc_{name}"], embeddings=[desc_vec], documents=[desc],
+                                            metadatas=[{"path": name, "desc": desc}])
+
+
+def write_batched(db, corpus, batch_rows):
+    db.begin_batch(max_rows=batch_rows)
+    for kind, name, a, b in corpus:
+        txn = db.journal.begin(kind, name, name)
+        if kind == "paper":
+            db.add_paper_chunks(a, b, moved_path=name, txn=txn)
+        else:
+            desc, desc_vec = b
+            db.add_image(name, a, desc, desc_vec, txn=txn)
+    db.end_batch()
+    db.journal.reset()
+
+
+def timed(label, fn, corpus, rows, **kwargs):
+    path = tempfile.mkdtemp(prefix="bench_ingest_")
+    try:
+        db = DatabaseHandler(path=path)
+        # 写库时的逐条打印不计入耗时
+        devnull = open(os.devnull, "w")
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            t0 = time.perf_counter()
+            fn(db, corpus, **kwargs)
+            elapsed = time.perf_counter() - t0
+        finally:
+            sys.stdout = stdout
+            devnull.close()
+        total = db.paper_collection.count() + db.visual_collection.count() + db.image_desc_collection.count()
+        assert total == rows, f"{label}: 写入 {total} 行，预期 {rows} 行"
+        print(f"{label:<14} {elapsed:7.2f}s   {rows / elapsed:9.0f} 行/s   {len(corpus) / elapsed:7.1f} 文件/s")
+        return elapsed
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入库写库吞吐: 逐文件 vs 缓冲批量")
+    parser.add_argument("--papers", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=20, help="每篇论文的切片数")
+    parser.add_argument("--images", type=int, default=500)
+    parser.add_argument("--batch-rows", type=int, default=2000, help="缓冲攒够多少行写一次库")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.papers, args.chunks, args.images)
+    rows = args.papers * args.chunks + args.images * 2
+    print(f"论文 {args.papers} 篇 x {args.chunks} 切片，图片 {args.images} 张，共 {rows} 行")
+
+    t_old = timed("逐文件", write_per_file, corpus, rows)
+    t_new = timed("批量+日志", write_batched, corpus, rows, batch_rows=args.batch_rows)
+    print(f"加速比: {t_old / t_new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
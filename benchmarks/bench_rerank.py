@@ -0,0 +1,87 @@
+# benchmarks/bench_rerank.py
+"""
+list_papers 重排: 本地文件级聚合 vs Gemini 重排
+
+对每个主题先做一次初筛 (与 list_papers 相同)，然后分别:
+  - 本地重排: rank_files，max / mean / topk 三种池化
+  - LLM 重排: 旧版的 chat_with_gemini 请求
+比较两者的耗时，以及前 k 名的重合度 (overlap@k = 交集 / k) 和第一名是否一致。
+需要已经入库的论文和可用的 GEMINI_API_KEY。
+
+用法:
+    python benchmarks/bench_rerank.py "强化学习" "图像分类" "时空预测" --k 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.config import LIST_PAPERS_CANDIDATES, SEARCH_MODE
+from core.rerank import POOLINGS, rank_files, llm_rerank, parse_llm_ranking
+
+
+def overlap_at_k(a, b, k):
+    if not a or not b:
+        return 0.0
+    return len(set(a[:k]) & set(b[:k])) / min(k, len(a), len(b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地重排 vs LLM 重排")
+    parser.add_argument("topics", nargs="+", help="测试用的主题")
+    parser.add_argument("--mode", default=SEARCH_MODE, choices=["vector", "hybrid", "lexical"])
+    parser.add_argument("--candidates", type=int, default=LIST_PAPERS_CANDIDATES)
+    parser.add_argument("--k", type=int, default=5, help="比较前 k 名")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    import main as cli
+    ai, db = cli.init_handlers("list_papers")
+
+    local_ms = {p: [] for p in POOLINGS}
+    overlap = {p: [] for p in POOLINGS}
+    top1 = {p: 0 for p in POOLINGS}
+    llm_ms = []
+
+    for topic in args.topics:
+        results = cli.search_papers(ai, db, topic, n_results=args.candidates, mode=args.mode)
+        if not results['ids'][0]:
+            print(f"[跳过] {topic}: 库里没有候选")
+            continue
+
+        ranked = {}
+        for pooling in POOLINGS:
+            t0 = time.perf_counter()
+            ranked[pooling] = rank_files(results, pooling=pooling)
+            local_ms[pooling].append((time.perf_counter() - t0) * 1000)
+
+        files = ranked["topk"]
+        t0 = time.perf_counter()
+        text = llm_rerank(ai, topic, files)
+        llm_ms.append((time.perf_counter() - t0) * 1000)
+        llm_order = parse_llm_ranking(text, [f["filename"] for f in files])
+
+        print(f"\n主题: {topic}  (候选 {len(results['ids'][0])} 段 / {len(files)} 篇)")
+        print(f"  LLM   : {llm_order[:args.k]}")
+        for pooling in POOLINGS:
+            names = [f["filename"] for f in ranked[pooling]]
+            overlap[pooling].append(overlap_at_k(names, llm_order, args.k))
+            top1[pooling] += bool(llm_order) and names[0] == llm_order[0]
+            print(f"  {pooling:<6}: {names[:args.k]}")
+
+    if not llm_ms:
+        return
+    n = len(llm_ms)
+    print(f"\n{'方式':<8}{'p50 延迟':>12}{f'overlap@{args.k}':>14}{'top1 一致':>12}")
+    print(f"{'LLM':<8}{statistics.median(llm_ms):>10.1f}ms{'-':>14}{'-':>12}")
+    for pooling in POOLINGS:
+        print(f"{pooling:<8}{statistics.median(local_ms[pooling]):>10.2f}ms"
+              f"{statistics.mean(overlap[pooling]):>14.2f}{top1[pooling] / n:>12.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/bench_server.py
+"""
+冷启动 CLI vs 常驻服务的单次命令延迟对比
+
+两种方式执行同一条命令各 N 次:
+  - 冷启动: python main.py --local <命令>，每次都重新加载模型、连接数据库
+  - 常驻:   先启动 python main.py serve，再用 python main.py <命令> 作为瘦客户端转发
+另外再测一轮常驻服务下的并发请求。
+
+用法:
+    python benchmarks/bench_server.py --repeat 5 -- search_image "模型架构图"
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.server import server_alive
+
+
+def timed_run(argv, env):
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "main.py"] + argv, cwd=ROOT, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr)
+    return time.perf_counter() - t0
+
+
+def summarize(name, times):
+    print(f"{name:<12} p50 {statistics.median(times):6.2f}s   min {min(times):6.2f}s   max {max(times):6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷启动 CLI vs 常驻服务延迟对比")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4, help="并发测试的客户端数")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("argv", nargs=argparse.REMAINDER, help="要执行的命令，例如 search_paper \"问题\"")
+    args = parser.parse_args()
+    argv = [a for a in args.argv if a != "--"] or ["search_image", "model architecture"]
+
+    env = dict(os.environ, KB_SERVER_PORT=str(args.port))
+
+    # 1. 冷启动
+    cold = [timed_run(["--local"] + argv, env) for _ in range(args.repeat)]
+
+    # 2. 常驻服务
+    server = subprocess.Popen([sys.executable, "main.py", "serve", "--port", str(args.port)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 600
+        while not server_alive(port=args.port):
+            if server.poll() is not None or time.time() > deadline:
+                raise RuntimeError("常驻服务启动失败")
+            time.sleep(0.5)
+
+        timed_run(argv, env)  # 预热一次
+        warm = [timed_run(argv, env) for _ in range(args.repeat)]
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            concurrent = list(pool.map(lambda _: timed_run(argv, env), range(args.concurrency * args.repeat)))
+        wall = time.perf_counter() - t0
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"命令: {' '.join(argv)}")
+    summarize("冷启动 CLI", cold)
+    summarize("常驻服务", warm)
+    summarize(f"并发 x{args.concurrency}", concurrent)
+    print(f"并发吞吐: {len(concurrent) / wall:.2f} 请求/秒")
+    print(f"加速比 (p50): {statistics.median(cold) / statistics.median(warm):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
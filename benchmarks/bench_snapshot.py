@@ -0,0 +1,145 @@
+# benchmarks/bench_snapshot.py
+"""
+快照导出 / 导入: 新机器从快照建库 vs 直接拷贝库目录
+
+在临时目录中用合成数据建一个知识库 (论文切片、图片描述、视觉向量三个库，带文档和元数据)，
+导出为快照后导入到一个空库，测量:
+  - 导出 / 导入耗时与导入吞吐 (行/秒)
+  - 快照大小与原库目录大小
+  - 导入子进程的峰值内存 (只与块大小有关，不随库的大小增长)
+  - 导入后的条数与向量误差 (float16 存储带来的最大余弦偏差)
+
+用法:
+    python benchmarks/bench_snapshot.py --papers 50000 --images 10000
+    python benchmarks/bench_snapshot.py --papers 200000 --chunk-rows 2000 --backend mmap
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import random_text
+
+
+def dir_mb(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs) / 1e6
+
+
+def build_library(db, papers, images, seed):
+    """按入库时的元数据格式直接写入合成记录，不经过 Gemini / CLIP"""
+    rng = random.Random(seed)
+    vec_rng = np.random.default_rng(seed)
+    step = 5000
+    for start in range(0, papers, step):
+        n = min(step, papers - start)
+        db.write_now([{
+            "collection": db.paper_collection.name,
+            "ids": [f"doc{i // 20}_p{i % 20}_{i}" for i in range(start, start + n)],
+            "embeddings": vec_rng.standard_normal((n, 768)).astype(np.float32),
+            "metadatas": [{"source": f"paper_{i // 20}.pdf", "page": i % 20, "path": f"papers/X/paper_{i // 20}.pdf",
+                           "category": f"C{(i // 20) % 5}", "doc_id": f"doc{i // 20}"} for i in range(start, start + n)],
+            "documents": [random_text(rng, 120) for _ in range(n)],
+        }])
+    for start in range(0, images, step):
+        n = min(step, images - start)
+        ids = range(start, start + n)
+        db.write_now([
+            {
+                "collection": db.visual_collection.name,
+                "ids": [f"img_clip_img{i}" for i in ids],
+                "embeddings": vec_rng.standard_normal((n, 512)).astype(np.float32),
+                "metadatas": [{"path": f"images/X/{i}.png", "category": "Table", "phash": f"{i:016x}"} for i in ids],
+            },
+            {
+                "collection": db.image_desc_collection.name,
+                "ids": [f"img_desc_img{i}" for i in ids],
+                "embeddings": vec_rng.standard_normal((n, 768)).astype(np.float32),
+                "metadatas": [{"path": f"images/X/{i}.png", "desc": "figure", "category": "Table"} for i in ids],
+                "documents": [random_text(rng, 40) for _ in ids],
+            },
+        ])
+
+
+def import_in_subprocess(target, snapshot, backend):
+    """在新进程里导入，返回 (耗时, 峰值内存 MB)；峰值内存只反映导入本身"""
+    code = (
+        "import sys, time, resource; sys.path.insert(0, sys.argv[1]);"
+        "from core.db_handler import DatabaseHandler; from core.snapshot import import_snapshot;"
+        "db = DatabaseHandler(path=sys.argv[2], backend=sys.argv[4]);"
+        "t0 = time.perf_counter(); import_snapshot(db, sys.argv[3]); elapsed = time.perf_counter() - t0;"
+        "print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)"
+    )
+    out = subprocess.run([sys.executable, "-c", code, ROOT, target, snapshot, backend],
+                         capture_output=True, text=True, check=True)
+    elapsed, peak = out.stdout.strip().splitlines()[-1].split()
+    return float(elapsed), float(peak)
+
+
+def max_cosine_error(source, target, collection, sample=200):
+    ids = source.logical[collection].get(limit=sample)['ids']
+    a = source.logical[collection].get(ids=ids, include=["embeddings"])
+    b = target.logical[collection].get(ids=ids, include=["embeddings"])
+    va = dict(zip(a['ids'], np.asarray(a['embeddings'], dtype=np.float32)))
+    vb = dict(zip(b['ids'], np.asarray(b['embeddings'], dtype=np.float32)))
+    errors = [1 - float(va[i] @ vb[i] / (np.linalg.norm(va[i]) * np.linalg.norm(vb[i]))) for i in ids]
+    return max(errors) if errors else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="快照导出 / 导入耗时与内存")
+    parser.add_argument("--papers", type=int, default=20000, help="论文切片数")
+    parser.add_argument("--images", type=int, default=5000, help="图片数")
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    parser.add_argument("--backend", choices=["chroma", "mmap"], default="chroma")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from core.db_handler import DatabaseHandler
+    from core.snapshot import export_snapshot
+
+    workdir = tempfile.mkdtemp(prefix="kb_snapshot_")
+    try:
+        source_path = os.path.join(workdir, "source")
+        target_path = os.path.join(workdir, "target")
+        snapshot = os.path.join(workdir, "kb.snap")
+        with contextlib.redirect_stdout(io.StringIO()):
+            source = DatabaseHandler(path=source_path, backend=args.backend)
+            build_library(source, args.papers, args.images, args.seed)
+
+        t0 = time.perf_counter()
+        counts = export_snapshot(source, snapshot, chunk_rows=args.chunk_rows, dtype=args.dtype)
+        export_s = time.perf_counter() - t0
+        rows = sum(counts.values())
+
+        import_s, peak_mb = import_in_subprocess(target_path, snapshot, args.backend)
+        with contextlib.redirect_stdout(io.StringIO()):
+            target = DatabaseHandler(path=target_path, backend=args.backend)
+
+        print(f"后端 {args.backend}，共 {rows} 条 ({', '.join(f'{k} {v}' for k, v in counts.items())})，"
+              f"块大小 {args.chunk_rows}，向量 {args.dtype}")
+        print(f"原库目录   {dir_mb(source_path):>9.1f} MB")
+        print(f"快照文件   {os.path.getsize(snapshot) / 1e6:>9.1f} MB")
+        print(f"导出耗时   {export_s:>9.1f} s")
+        print(f"导入耗时   {import_s:>9.1f} s ({rows / import_s:.0f} 行/秒)，导入进程峰值内存 {peak_mb:.0f} MB")
+        for name, collection in target.logical.items():
+            ok = "一致" if collection.count() == counts.get(name, 0) else "不一致"
+            print(f"  {name:<14} 导入 {collection.count():>8} 条 ({ok})，"
+                  f"最大余弦误差 {max_cosine_error(source, target, name):.2e}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
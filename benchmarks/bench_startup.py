@@ -0,0 +1,71 @@
+# benchmarks/bench_startup.py
+"""
+各子命令的冷启动耗时: 从 Python 进程启动到 init_handlers 返回 (即真正开始干活之前)
+
+每个子命令在独立的子进程中测量多次取中位数。加上 --max-seconds 后，
+任何子命令超出阈值都会以非零状态码退出，可以放进 CI 防止启动时间回退。
+
+用法:
+    python benchmarks/bench_startup.py --repeat 3
+    python benchmarks/bench_startup.py --max-seconds 2 search_paper list_papers
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 子进程里执行的测量代码: 包含解释器启动后的全部导入与模型加载
+SNIPPET = """
+import time
+t0 = time.perf_counter()
+import main
+main.init_handlers({command!r})
+print(time.perf_counter() - t0)
+"""
+
+
+def measure(command, repeat):
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(command=command)],
+            cwd=ROOT, capture_output=True, text=True
+        )
+        if out.returncode != 0:
+            raise RuntimeError(f"{command} 启动失败:\n{out.stderr}")
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def main():
+    import main as cli
+
+    parser = argparse.ArgumentParser(description="子命令冷启动耗时")
+    parser.add_argument("commands", nargs="*", help="要测量的子命令，默认全部")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-seconds", type=float, default=None, help="超过该耗时视为回退")
+    args = parser.parse_args()
+
+    commands = args.commands or list(cli.COMMAND_CAPABILITIES)
+    failed = []
+    print(f"{'子命令':<14}{'预加载':<16}{'启动耗时':>10}")
+    for command in commands:
+        seconds = measure(command, args.repeat)
+        caps = ",".join(cli.COMMAND_CAPABILITIES.get(command, ())) or "-"
+        flag = ""
+        if args.max_seconds is not None and seconds > args.max_seconds:
+            failed.append(command)
+            flag = "  <- 超出阈值"
+        print(f"{command:<14}{caps:<16}{seconds:>9.2f}s{flag}")
+
+    if failed:
+        print(f"\n[错误] 启动耗时超出 {args.max_seconds}s: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# benchmarks/bench_suite.py
+"""
+可复现的端到端基准: 合成语料 + 离线替身，不联网、默认不下载任何模型权重
+
+流程 (全部在一个临时工作目录中进行，不影响项目自己的知识库):
+  1. 生成 --papers 篇合成 PDF 和 --images 张合成图片
+  2. Gemini 向量 / 生成换成本地确定性替身 (--latency 模拟每次请求的网络往返)，
+     CLIP 默认换成固定随机投影 (--clip tiny 使用 HuggingFace 上的微型随机 CLIP，--clip real 使用配置的模型)
+  3. batch_ingest 整个文件夹，记录 文件/秒
+  4. search_paper / search_image / list_papers 各跑 --repeat 轮，记录 p50/p95/p99 延迟
+  5. 记录进程峰值内存，结果写成 JSON；传入 --baseline 时与之前的结果逐项对比
+
+用法:
+    python benchmarks/bench_suite.py --papers 50 --images 200 --latency 0.05 --out results/$(git rev-parse --short HEAD).json
+    python benchmarks/bench_suite.py --baseline results/old.json --out results/new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import make_random_pdf, make_random_image, random_text
+
+TINY_CLIP = "hf-internal-testing/tiny-random-clip"
+QUERY_COMMANDS = ("search_paper", "search_image", "list_papers")
+
+
+def peak_rss_mb():
+    """进程至今的峰值内存 (Linux 上 ru_maxrss 单位是 KB，macOS 上是字节)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def percentiles(times):
+    ms = np.asarray(times) * 1000
+    return {
+        "n": len(times),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def make_corpus(folder, papers, pages, images, image_size, seed):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(papers):
+        make_random_pdf(os.path.join(folder, f"paper_{i:04d}.pdf"), pages, seed=seed + i)
+    for i in range(images):
+        make_random_image(os.path.join(folder, f"figure_{i:04d}.png"), size=image_size, seed=seed + i)
+
+
+def build_handlers(args):
+    """离线的 AIHandler + 临时目录里的 DatabaseHandler"""
+    from benchmarks.stubs import install_stubs
+    from core.ai_handler import AIHandler
+    from core.db_handler import DatabaseHandler
+
+    ai = AIHandler()
+    # 测的是真实计算量，不让向量缓存把重复的工作吃掉
+    ai.cache = None
+    install_stubs(ai, latency=args.latency, clip=args.clip == "stub")
+    if args.clip == "tiny":
+        from transformers import CLIPProcessor
+        from core.clip_backend import TorchClipBackend
+        ai._clip_processor = CLIPProcessor.from_pretrained(TINY_CLIP)
+        ai._clip_backend = TorchClipBackend(TINY_CLIP)
+        ai.clip_model_id = TINY_CLIP
+    return ai, DatabaseHandler()
+
+
+def run_quiet(cli, parser, argv, ai, db):
+    """执行一条子命令，丢弃打印输出，返回耗时 (秒)"""
+    args = parser.parse_args(argv)
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        cli.run_command(args, ai, db)
+        return time.perf_counter() - t0
+
+
+def run_suite(args):
+    import main as cli
+    parser = cli.build_parser()
+
+    inbox = os.path.abspath("inbox")
+    t0 = time.perf_counter()
+    make_corpus(inbox, args.papers, args.pages, args.images, (args.image_size, args.image_size * 3 // 4), args.seed)
+    corpus_seconds = time.perf_counter() - t0
+    corpus_mb = sum(os.path.getsize(os.path.join(inbox, f)) for f in os.listdir(inbox)) / 1024 / 1024
+    print(f"合成语料: {args.papers} 篇 PDF x {args.pages} 页, {args.images} 张图片, "
+          f"{corpus_mb:.1f} MB ({corpus_seconds:.1f}s)")
+
+    ai, db = build_handlers(args)
+    files = args.papers + args.images
+
+    # 1. 入库吞吐
+    elapsed = run_quiet(cli, parser, ["batch_ingest", inbox, "--workers", str(args.workers),
+                                      "--cpu-workers", str(args.cpu_workers)], ai, db)
+    ingest = {
+        "files": files,
+        "seconds": round(elapsed, 3),
+        "files_per_sec": round(files / elapsed, 3),
+        "paper_chunks": db.paper_collection.count(),
+        "images_indexed": db.visual_collection.count(),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(f"batch_ingest: {files} 个文件 {elapsed:.2f}s  {ingest['files_per_sec']:.1f} 文件/秒  "
+          f"(切片 {ingest['paper_chunks']}, 图片 {ingest['images_indexed']})")
+
+    # 2. 查询延迟 (先各跑一次预热)
+    rng = random.Random(args.seed)
+    queries = [random_text(rng, 6) for _ in range(args.queries)]
+    latency = {}
+    for command in QUERY_COMMANDS:
+        run_quiet(cli, parser, [command, queries[0]], ai, db)
+        times = [run_quiet(cli, parser, [command, q], ai, db)
+                 for _ in range(args.repeat) for q in queries]
+        latency[command] = percentiles(times)
+        s = latency[command]
+        print(f"{command:<13} p50 {s['p50_ms']:8.1f}ms  p95 {s['p95_ms']:8.1f}ms  p99 {s['p99_ms']:8.1f}ms  (n={s['n']})")
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "keep")},
+        },
+        "ingest": ingest,
+        "queries": latency,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def compare(result, baseline):
+    """与之前的结果逐项对比，打印变化百分比 (吞吐越高越好，延迟和内存越低越好)"""
+    rows = [("batch_ingest 文件/秒", baseline["ingest"]["files_per_sec"], result["ingest"]["files_per_sec"])]
+    for command in QUERY_COMMANDS:
+        if command in baseline.get("queries", {}):
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                rows.append((f"{command} {key}", baseline["queries"][command][key], result["queries"][command][key]))
+    rows.append(("峰值内存 MB", baseline["peak_rss_mb"], result["peak_rss_mb"]))
+
+    print(f"\n对比基线 {baseline['meta'].get('commit')} -> {result['meta'].get('commit')}")
+    for name, old, new in rows:
+        change = (new - old) / old * 100 if old else float("nan")
+        print(f"  {name:<24} {old:10.2f} -> {new:10.2f}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成语料 + 离线替身的端到端基准")
+    parser.add_argument("--papers", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10, help="每篇 PDF 的页数")
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--image-size", type=int, default=1600, help="合成图片宽度 (高度为 3/4)")
+    parser.add_argument("--latency", type=float, default=0.05, help="替身模拟的单次请求延迟 (秒)")
+    parser.add_argument("--clip", choices=["stub", "tiny", "real"], default="stub",
+                        help="stub: 随机投影替身; tiny: 微型随机 CLIP (需下载); real: 配置的 CLIP_BACKEND")
+    parser.add_argument("--queries", type=int, default=10, help="每个检索命令的不同查询数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=8, help="batch_ingest 的 I/O 线程数")
+    parser.add_argument("--cpu-workers", type=int, default=2, help="batch_ingest 的 CPU 线程数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="结果 JSON 的保存路径")
+    parser.add_argument("--baseline", help="之前保存的结果 JSON，用于对比")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    args = parser.parse_args()
+
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    # 配置里的库路径都是相对路径，切到临时目录后导入，知识库、缓存、分类文件夹都落在这里
+    workdir = tempfile.mkdtemp(prefix="kb_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        result = run_suite(args)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"工作目录: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"峰值内存: {result['peak_rss_mb']:.0f} MB")
+    if out:
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {out}")
+    else:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# benchmarks/stubs.py
+"""
+离线替身: 让 AIHandler 不联网、不下载 CLIP 权重也能完整跑通入库和检索
+
+  - 文本向量: core.embedding_provider.StubEmbeddingProvider (代替 genai.embed_content)
+  - 生成: StubGenerativeModel (代替 GenerativeModel.generate_content)
+  - CLIP: StubClipProcessor + StubClipBackend (固定随机投影，不依赖 torch)
+所有输出只由输入内容决定，同样的语料每次得到同样的结果；latency 模拟每次请求的网络往返。
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from benchmarks.synthetic import WORDS
+from core.clip_backend import ClipBackend
+from core.embedding_provider import StubEmbeddingProvider
+
+
+def _seed(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+    return int.from_bytes(h.digest()[:8], "little")
+
+
+class _StubStream(list):
+    """流式响应的替身: 可迭代的文本片段，带 usage_metadata"""
+    usage_metadata = None
+
+
+class StubGenerativeModel:
+    """
+    generate_content 的本地替身
+    - 要求 JSON 结构化输出时 (图片分析)，按 schema 返回描述、候选类别之一和 OCR 文字
+    - 提示词里带 [A,B,C] 候选类别时 (分类)，按内容哈希选一个类别
+    - 其余情况 (看图说话 / 问答) 返回由内容哈希决定的一段文本，stream=True 时分段返回
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        texts = [p for p in parts if isinstance(p, str)]
+        blobs = [p["data"] for p in parts if isinstance(p, dict) and "data" in p]
+        rng = random.Random(_seed(*texts, *blobs))
+
+        prompt = texts[0] if texts else ""
+        config = kwargs.get("generation_config") or {}
+        if config.get("response_mime_type") == "application/json":
+            schema = config["response_schema"]["properties"]
+            return SimpleNamespace(text=json.dumps({
+                "description": " ".join(rng.choice(WORDS) for _ in range(40)),
+                "category": rng.choice(schema["category"]["enum"]),
+                "ocr_text": " ".join(rng.choice(WORDS) for _ in range(5)),
+            }, ensure_ascii=False))
+        options = re.search(r"\[([^\[\]]+)\]", prompt)
+        if options:
+            choices = [c.strip() for c in options.group(1).split(",") if c.strip()]
+            return SimpleNamespace(text=rng.choice(choices))
+        text = " ".join(rng.choice(WORDS) for _ in range(40))
+        if kwargs.get("stream"):
+            # 按 8 个词一段返回，首段之后的片段不再额外等待
+            words = text.split(" ")
+            return _StubStream(SimpleNamespace(text=" ".join(words[i:i + 8]) + " ") for i in range(0, len(words), 8))
+        return SimpleNamespace(text=text)
+
+
+class StubClipProcessor:
+    """CLIPProcessor 的替身: 图片缩到 size x size，文本按词哈希成 id 序列，输出 numpy 数组"""
+
+    def __init__(self, size=32, max_length=77):
+        self.size = size
+        self.max_length = max_length
+
+    def __call__(self, images=None, text=None, return_tensors=None, padding=None, **kwargs):
+        if images is not None:
+            image = images.convert("RGB").resize((self.size, self.size))
+            pixels = np.asarray(image, dtype=np.float32).transpose(2, 0, 1) / 255.0
+            return {"pixel_values": pixels[None]}
+
+        rows = [[_seed(w) % 49408 for w in re.findall(r"\w+", t.lower())][:self.max_length] or [0] for t in text]
+        length = max(len(r) for r in rows)
+        ids = np.zeros((len(rows), length), dtype=np.int64)
+        mask = np.zeros((len(rows), length), dtype=np.int64)
+        for i, r in enumerate(rows):
+            ids[i, :len(r)] = r
+            mask[i, :len(r)] = 1
+        return {"input_ids": ids, "attention_mask": mask}
+
+
+class StubClipBackend(ClipBackend):
+    """
+    CLIP 推理的替身: 图片像素和文本词袋各经过一个固定随机投影得到 dim 维向量
+    计算量很小，入库和检索的耗时基本都落在项目自身的代码上
+    """
+    model_id = "stub/clip"
+
+    def __init__(self, dim=512, size=32, vocab=49408, seed=0):
+        rng = np.random.default_rng(seed)
+        self.dim = dim
+        self.image_proj = rng.standard_normal((3 * size * size, dim)).astype(np.float32)
+        self.token_proj = rng.standard_normal((vocab, dim)).astype(np.float32)
+
+    def stack(self, pixels):
+        return np.concatenate(pixels)
+
+    def encode_images(self, pixel_values):
+        flat = np.asarray(pixel_values, dtype=np.float32).reshape(len(pixel_values), -1)
+        return flat @ self.image_proj
+
+    def encode_texts(self, inputs):
+        ids, mask = inputs["input_ids"], inputs["attention_mask"]
+        return (self.token_proj[ids] * mask[..., None]).sum(axis=1).astype(np.float32)
+
+
+def install_stubs(ai, latency=0.0, clip=True):
+    """
+    把 AIHandler 的 Gemini (向量 + 生成) 换成本地替身；clip 为 True 时 CLIP 也换成替身
+    返回 (文本向量替身, 生成替身)，便于统计调用次数
+    """
+    provider = StubEmbeddingProvider(latency=latency)
+    ai.embedder.provider = provider
+    model = StubGenerativeModel(latency=latency)
+    ai._gemini_flash = model
+    if clip:
+        ai._clip_processor = StubClipProcessor()
+        ai._clip_backend = StubClipBackend()
+        ai.clip_model_id = StubClipBackend.model_id
+    return provider, model
@@ -0,0 +1,81 @@
+# benchmarks/synthetic.py
+"""合成测试数据: 不依赖任何第三方库生成多页 PDF"""
+import random
+
+# 合成文本用的词表，混合几个研究方向，方便检索测试有区分度
+WORDS = (
+    "reinforcement learning policy gradient actor critic reward value function "
+    "transformer attention encoder decoder multimodal clip contrastive image text "
+    "spatio temporal graph traffic forecasting trajectory benchmark dataset ablation"
+).split()
+
+
+def random_text(rng, num_words):
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(path, pages, words_per_line=12):
+    """
+    写一个最简单的文本 PDF (Helvetica 字体，每页一个内容流)
+    :param pages: 每页的文本列表
+    """
+    n = len(pages)
+    font_id = 3 + 2 * n
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(n))
+    objs = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {n} >>",
+    ]
+    for i, text in enumerate(pages):
+        objs.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        words = text.split()
+        lines = [" ".join(words[j:j + words_per_line]) for j in range(0, len(words), words_per_line)]
+        stream = "BT /F1 10 Tf 50 750 Td 12 TL " + " ".join(f"({_escape(l)}) '" for l in lines) + " ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objs.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = "%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out.encode("latin-1")))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(out.encode("latin-1"))
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    with open(path, "wb") as f:
+        f.write(out.encode("latin-1"))
+
+
+def make_random_pdf(path, num_pages, words_per_page=400, seed=0):
+    rng = random.Random(seed)
+    make_pdf(path, [random_text(rng, words_per_page) for _ in range(num_pages)])
+
+
+def make_random_image(path, size=(1600, 1200), seed=0):
+    """
+    写一张类似论文插图的合成图片: 白底上随机的色块、折线和文字行
+    需要 Pillow (项目本身的依赖)
+    """
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    w, h = size
+    image = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(3, 8)):
+        x0, y0 = rng.randrange(w // 2), rng.randrange(h // 2)
+        x1, y1 = x0 + rng.randrange(w // 8, w // 2), y0 + rng.randrange(h // 8, h // 2)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle([x0, y0, x1, y1], outline=color, width=4)
+    points = [(x, h - rng.randrange(h // 4, h)) for x in range(0, w, max(1, w // 40))]
+    draw.line(points, fill=(rng.randrange(256), 0, rng.randrange(256)), width=3)
+    for i in range(rng.randint(2, 6)):
+        draw.text((20, 20 + 24 * i), random_text(rng, 8), fill=(0, 0, 0))
+    image.save(path)
@@ -5,91 +5,444 @@ os.environ['HTTP_PROXY']  = 'http://127.0.0.1:7890'
 os.environ['HTTPS_PROXY'] = 'http://127.0.0.1:7890'
 os.environ['HF_HOME'] = r"./model"
 
-import google.generativeai as genai
-from transformers import CLIPProcessor, CLIPModel
-from PIL import Image
-import torch
-import PIL.Image
-from .config import GEMINI_API_KEY, MODEL_PATH_CLIP
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from .config import (
+    MODEL_PATH_CLIP, CLIP_BATCH_SIZE, CLIP_PREFETCH_WORKERS, CLIP_BACKEND,
+    EMBEDDING_PROVIDER, EMBEDDING_CACHE_ENABLED,
+)
+from .embedding_provider import BatchEmbedder, EmbedCoalescer, GeminiEmbeddingProvider, create_provider, get_genai
+from .embedding_cache import EmbeddingCache, sha256_text, sha256_file
+from .clip_backend import create_clip_backend, clip_model_id
+from .image_loader import ImageLoader
+from .metrics import METRICS
+
+# torch / transformers / google.generativeai 导入很慢，全部推迟到第一次用到时
+
+# 缓存里区分同一模型的不同用途
+TASK_TEXT = "semantic_similarity"
+TASK_CLIP_IMAGE = "clip_image"
+TASK_CLIP_TEXT = "clip_text"
+
+# 所有向量都以连续的 float32 数组传递，直到写进向量库；失败时返回空数组
+EMPTY_VECTOR = np.zeros(0, dtype=np.float32)
+EMPTY_VECTOR.flags.writeable = False
+
+IMAGE_ANALYSIS_PROMPT = (
+    "请分析这张图片，按给定的 JSON 结构返回:\n"
+    "- description: 详细的中文描述，包括主体、颜色、动作、文字信息及整体氛围，一段话，不要分段\n"
+    "- category: 从 [{topics}] 中选择最合适的一项，原样返回类别名\n"
+    "- ocr_text: 图片中能识别出的全部文字 (原文，没有文字时为空字符串)"
+)
+
+
+def stream_stop_reason(chunk):
+    """
+    取不到文本的流式片段的原因: 提示词被拦截 (prompt_feedback.block_reason)，
+    或候选因安全策略 / 长度等原因提前结束 (finish_reason)；正常结束 (STOP) 返回 None
+    """
+    block = getattr(getattr(chunk, "prompt_feedback", None), "block_reason", None)
+    if block:
+        return f"提示词被拦截 ({getattr(block, 'name', block)})"
+    for candidate in getattr(chunk, "candidates", None) or []:
+        finish = getattr(candidate, "finish_reason", None)
+        name = getattr(finish, "name", finish)
+        if finish and name not in ("STOP", "FINISH_REASON_UNSPECIFIED"):
+            return f"生成提前结束 ({name})"
+    return None
+
+
+def image_analysis_schema(topics):
+    """结构化输出的 JSON Schema，category 限定为候选类别之一"""
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "description": {"type": "STRING"},
+            "category": {"type": "STRING", "enum": topics},
+            "ocr_text": {"type": "STRING"},
+        },
+        "required": ["description", "category", "ocr_text"],
+    }
+
+
+def parse_image_analysis(text, topics):
+    """校验结构化输出，返回 {"description", "category", "ocr_text"}；不合法时抛出 ValueError"""
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise ValueError(f"结构化输出不是合法 JSON: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("结构化输出不是 JSON 对象")
+    description = data.get("description")
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError("结构化输出缺少 description")
+    category = data.get("category")
+    if category not in topics:
+        raise ValueError(f"结构化输出的类别不在候选中: {category!r}")
+    ocr_text = data.get("ocr_text") or ""
+    if not isinstance(ocr_text, str):
+        raise ValueError("结构化输出的 ocr_text 不是字符串")
+    return {"description": description.strip(), "category": category, "ocr_text": ocr_text.strip()}
 
 class AIHandler:
-    def __init__(self):
-        print("正在初始化 AI 模型...")
-        
-        # 1. 配置 Gemini
-        print("正在加载 Gemini 模型...")
-        if not GEMINI_API_KEY or "AIza" not in GEMINI_API_KEY:
-            raise ValueError("请先在 core/config.py 中填入正确的 GEMINI_API_KEY")
-        
-        genai.configure(api_key=GEMINI_API_KEY)
-        self.gemini_flash = genai.GenerativeModel('gemini-2.5-flash') 
-        print("Gemini 模型就绪")
-        
-        # 2. 配置本地 CLIP
-        print("正在加载 CLIP 模型...")
-        try:
-            self.clip_model = CLIPModel.from_pretrained(MODEL_PATH_CLIP)
-            self.clip_processor = CLIPProcessor.from_pretrained(MODEL_PATH_CLIP)
-            print("CLIP 模型就绪")
-        except Exception as e:
-            print(f"CLIP 模型加载失败: {e}")
-            print("请检查 MODEL_PATH_CLIP 路径是否正确，或者网络是否能连接 HuggingFace")
+    def __init__(self, embedding_provider=None, clip_backend=CLIP_BACKEND, clip_model_path=MODEL_PATH_CLIP):
+        """
+        构造本身不加载任何模型: Gemini 和 CLIP 都在第一次使用时才初始化，
+        这样只用到 Gemini 的命令 (search_paper / list_papers) 不必等待 CLIP 加载。
+        :param embedding_provider: 文本向量化后端，为空时按 EMBEDDING_PROVIDER 配置创建
+        :param clip_backend: CLIP 推理后端名 (torch / int8 / onnx / onnx-int8)
+        :param clip_model_path: CLIP 模型 (HuggingFace id 或本地路径)
+        """
+        self.embedder = BatchEmbedder(embedding_provider or create_provider(EMBEDDING_PROVIDER))
+        # 入库时各线程零散的单条文本合并成一次请求
+        self.coalescer = EmbedCoalescer(self.embedder)
+        self.cache = EmbeddingCache() if EMBEDDING_CACHE_ENABLED else None
+        # 图片只解码一次: CLIP 用缩小后的图片，Gemini 用缓存的 JPEG 载荷
+        self.image_loader = ImageLoader()
+        self._gemini_flash = None
+        self.clip_backend_name = clip_backend
+        self.clip_model_path = clip_model_path
+        # 缓存按后端区分，命中缓存时不必加载模型
+        self.clip_model_id = clip_model_id(clip_backend, clip_model_path)
+        self._clip_backend = None
+        self._clip_processor = None
+        self._load_lock = threading.Lock()
+
+    def preload(self, capabilities):
+        """
+        提前加载指定能力，让配置错误在命令开始前就暴露出来
+        :param capabilities: 'gemini' / 'clip' 的组合
+        """
+        if "gemini" in capabilities:
+            self.gemini_flash
+        if "clip" in capabilities:
+            self.clip_backend
+
+    @property
+    def text_model(self):
+        """当前的文本向量模型"""
+        return self.embedder.provider.model_id
+
+    def use_models(self, text=None, clip=None):
+        """
+        切换向量模型 (与库里记录的模型保持一致，见 EmbeddingRegistry)
+        CLIP 换模型后卸载已加载的模型，下次用到时按新路径加载；stub 向量后端只有一个模型，不切换
+        """
+        if text and text != self.text_model and isinstance(self.embedder.provider, GeminiEmbeddingProvider):
+            self.embedder.provider = GeminiEmbeddingProvider(text)
+        if clip and clip != self.clip_model_path:
+            with self._load_lock:
+                self.clip_model_path = clip
+                self.clip_model_id = clip_model_id(self.clip_backend_name, clip)
+                self._clip_backend = None
+                self._clip_processor = None
+
+    @property
+    def gemini_flash(self):
+        if self._gemini_flash is None:
+            with self._load_lock:
+                if self._gemini_flash is None:
+                    print("正在加载 Gemini 模型...")
+                    self._gemini_flash = get_genai().GenerativeModel('gemini-2.5-flash')
+                    print("Gemini 模型就绪")
+        return self._gemini_flash
 
-    def get_gemini_embedding(self, text):
-        """Gemini: 把文字变成 768维 向量"""
+    def _load_clip(self):
+        with self._load_lock:
+            if self._clip_backend is not None:
+                return
+            print(f"正在加载 CLIP 模型 (后端: {self.clip_backend_name})...")
+            try:
+                from transformers import CLIPProcessor
+                self._clip_processor = CLIPProcessor.from_pretrained(self.clip_model_path)
+                self._clip_backend = create_clip_backend(self.clip_backend_name, self.clip_model_path)
+                print("CLIP 模型就绪")
+            except Exception as e:
+                print(f"CLIP 模型加载失败: {e}")
+                print("请检查 MODEL_PATH_CLIP 路径是否正确，或者网络是否能连接 HuggingFace")
+                raise
+
+    @property
+    def clip_backend(self):
+        if self._clip_backend is None:
+            self._load_clip()
+        return self._clip_backend
+
+    @property
+    def clip_processor(self):
+        if self._clip_backend is None:
+            self._load_clip()
+        return self._clip_processor
+
+    def get_gemini_embedding(self, text, coalesce=False):
+        """
+        Gemini: 把文字变成 768维 float32 向量，失败时返回空数组
+        :param coalesce: 与其他线程同时到达的文本合并请求 (多等最多 EMBED_COALESCE_SECONDS)，用于批量入库
+        """
         try:
-            result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=text,
-                task_type="semantic_similarity"
-            )
-            return result['embedding']
+            return self.get_text_embeddings_batch([text], coalesce=coalesce)[0]
         except Exception as e:
             print(f"Gemini Embedding 失败: {e}")
-            return []
+            return EMPTY_VECTOR
+
+    @METRICS.traced("embed.text")
+    def get_text_embeddings_batch(self, texts, coalesce=False):
+        """
+        批量文本向量化: 多段文本合并成少量请求，自带限流、重试和自适应并发，返回 (N, dim) float32 矩阵
+        已缓存的文本不再请求；失败时抛出异常，由调用方决定跳过还是中止
+        :param coalesce: 未命中的文本交给合并器，与其他线程的零散文本一起请求
+        """
+        texts = list(texts)
+        embedder = self.coalescer if coalesce else self.embedder
+        if self.cache is None:
+            return np.asarray(embedder.embed(texts, TASK_TEXT), dtype=np.float32)
+
+        model = self.embedder.provider.model_id
+        digests = [sha256_text(t) for t in texts]
+        found = self.cache.get_many(model, TASK_TEXT, digests)
+        METRICS.incr("cache.text.hit", sum(1 for d in digests if d in found))
 
+        # 只请求未命中的文本，同一批里重复的文本也只请求一次
+        missing = {}
+        for d, t in zip(digests, texts):
+            if d not in found:
+                missing.setdefault(d, t)
+        if missing:
+            METRICS.incr("cache.text.miss", len(missing))
+            vectors = np.asarray(embedder.embed(list(missing.values()), TASK_TEXT), dtype=np.float32)
+            fresh = list(zip(missing.keys(), vectors))
+            self.cache.put_many(model, TASK_TEXT, fresh)
+            found.update(fresh)
+        if not digests:
+            return np.zeros((0, self.embedder.provider.dim), dtype=np.float32)
+        return np.stack([found[d] for d in digests])
+
+    @METRICS.traced("clip.image")
     def get_clip_embedding(self, image_path):
-        """CLIP: 把图片变成 512维 向量"""
+        """CLIP: 把图片变成 512维 float32 向量，失败时返回空数组"""
         try:
-            image = Image.open(image_path)
+            digest = sha256_file(image_path) if self.cache is not None else None
+            if digest:
+                cached = self.cache.get(self.clip_model_id, TASK_CLIP_IMAGE, digest)
+                if cached is not None:
+                    METRICS.incr("cache.clip_image.hit")
+                    return cached
+                METRICS.incr("cache.clip_image.miss")
+
+            image, _ = self.image_loader.prepare(image_path, digest)
             inputs = self.clip_processor(images=image, return_tensors="pt")
-            with torch.no_grad():
-                image_features = self.clip_model.get_image_features(**inputs)
-            # 归一化并转列表
-            return image_features.detach().numpy().flatten().tolist()
+            with METRICS.span("clip.infer"):
+                vec = self.clip_backend.encode_images(inputs["pixel_values"])[0]
+            if digest:
+                self.cache.put(self.clip_model_id, TASK_CLIP_IMAGE, digest, vec)
+            return vec
         except Exception as e:
             print(f"CLIP 图片向量化失败: {e}")
-            return []
+            return EMPTY_VECTOR
+
+    def _load_clip_pixels(self, image_path, digest=None):
+        """后台线程: 解码并预处理单张图片，返回 pixel_values (1, 3, H, W)，顺带生成 Gemini 载荷"""
+        image, _ = self.image_loader.prepare(image_path, digest)
+        inputs = self.clip_processor(images=image, return_tensors="pt")
+        return inputs["pixel_values"]
+
+    @METRICS.traced("clip.image_batch")
+    def get_clip_embeddings_batch(self, image_paths, batch_size=CLIP_BATCH_SIZE, num_workers=CLIP_PREFETCH_WORKERS):
+        """
+        CLIP: 批量把图片变成 (N, 512) float32 矩阵
+        解码和预处理在后台线程中预取，主线程只做按批前向推理。
+        :param batch_size: 每次前向推理的图片数
+        :param num_workers: 后台解码线程数
+        读取或处理失败的图片，对应行全为 0。
+        """
+        dim = self.clip_backend.dim
+        result = np.zeros((len(image_paths), dim), dtype=np.float32)
+        if not image_paths:
+            return result
+
+        # 先查缓存，只对未命中的图片做推理
+        digests = [None] * len(image_paths)
+        todo = list(range(len(image_paths)))
+        if self.cache is not None:
+            with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+                digests = list(pool.map(self._safe_file_digest, image_paths))
+            found = self.cache.get_many(self.clip_model_id, TASK_CLIP_IMAGE, [d for d in digests if d])
+            todo = []
+            for i, d in enumerate(digests):
+                if d in found:
+                    result[i] = found[d]
+                else:
+                    todo.append(i)
+            METRICS.incr("cache.clip_image.hit", len(image_paths) - len(todo))
+            METRICS.incr("cache.clip_image.miss", len(todo))
+            if not todo:
+                return result
+
+        batch_size = max(1, int(batch_size))
+        # 预取窗口: 最多领先推理两个批次，避免一次性解码整个文件夹
+        window = batch_size * 2
+
+        def run_batch(indices, pixels):
+            try:
+                with METRICS.span("clip.infer"):
+                    result[indices] = self.clip_backend.encode_images(self.clip_backend.stack(pixels))
+                METRICS.incr("clip.images", len(indices))
+            except Exception as e:
+                print(f"CLIP 批量推理失败 ({len(indices)} 张): {e}")
+
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+            pending = deque()
+            next_idx = 0
+            batch_indices, batch_pixels = [], []
+
+            while pending or next_idx < len(todo):
+                # 1. 补满预取窗口
+                while next_idx < len(todo) and len(pending) < window:
+                    idx = todo[next_idx]
+                    path = image_paths[idx]
+                    pending.append((idx, path, pool.submit(self._load_clip_pixels, path, digests[idx])))
+                    next_idx += 1
+
+                # 2. 按提交顺序取回预处理结果
+                idx, path, future = pending.popleft()
+                try:
+                    batch_pixels.append(future.result())
+                    batch_indices.append(idx)
+                except Exception as e:
+                    print(f"CLIP 图片预处理失败 {os.path.basename(path)}: {e}")
+                    continue
+
+                # 3. 凑满一批就推理
+                if len(batch_indices) == batch_size:
+                    run_batch(batch_indices, batch_pixels)
+                    batch_indices, batch_pixels = [], []
 
+            if batch_indices:
+                run_batch(batch_indices, batch_pixels)
+
+        if self.cache is not None:
+            self.cache.put_many(self.clip_model_id, TASK_CLIP_IMAGE, [
+                (digests[i], result[i]) for i in todo if digests[i] and result[i].any()
+            ])
+        return result
+
+    @staticmethod
+    def _safe_file_digest(path):
+        try:
+            return sha256_file(path)
+        except OSError:
+            return None
+
+    @METRICS.traced("clip.text")
     def get_clip_text_embedding(self, text):
-        """CLIP: 把文本变成 512维 向量 (用于视觉搜索)"""
+        """CLIP: 把文本变成 512维 float32 向量 (用于视觉搜索)，失败时返回空数组"""
         try:
             # 截断过长的文本，因为 CLIP 对长度敏感
-            inputs = self.clip_processor(text=[text[:77]], return_tensors="pt", padding=True)
-            with torch.no_grad():
-                text_features = self.clip_model.get_text_features(**inputs)
-            return text_features.detach().numpy().flatten().tolist()
+            text = text[:77]
+            digest = sha256_text(text) if self.cache is not None else None
+            if digest:
+                cached = self.cache.get(self.clip_model_id, TASK_CLIP_TEXT, digest)
+                if cached is not None:
+                    METRICS.incr("cache.clip_text.hit")
+                    return cached
+                METRICS.incr("cache.clip_text.miss")
+
+            inputs = self.clip_processor(text=[text], return_tensors="pt", padding=True)
+            vec = self.clip_backend.encode_texts(inputs)[0]
+            if digest:
+                self.cache.put(self.clip_model_id, TASK_CLIP_TEXT, digest, vec)
+            return vec
         except Exception as e:
             print(f"CLIP 文本向量化失败: {e}")
-            return []
+            return EMPTY_VECTOR
 
-    def get_image_description(self, image_path):
-        """让 Gemini 看图说话"""
-        image = PIL.Image.open(image_path)
+    def image_payload(self, image_path, digest=None):
+        """上传给 Gemini 的图片载荷 (缩小并重新编码，优先读磁盘缓存)"""
+        return self.image_loader.payload(image_path, digest)
+
+    @staticmethod
+    def _blob(payload):
+        return {"mime_type": payload["mime_type"], "data": payload["data"]}
+
+    def _generate(self, stage, prompt, payload=None, generation_config=None):
+        """所有 generate_content 调用的入口，统一记录耗时、调用次数和发送字节数"""
+        contents = [prompt, self._blob(payload)] if payload else prompt
+        kwargs = {"generation_config": generation_config} if generation_config else {}
+        METRICS.incr("gemini.generate.calls")
+        METRICS.incr("gemini.bytes_sent", len(prompt.encode("utf-8")) + (len(payload["data"]) if payload else 0))
+        with METRICS.span(stage):
+            return self.gemini_flash.generate_content(contents, **kwargs)
+
+    def get_image_description(self, image_path, payload=None):
+        """
+        让 Gemini 看图说话
+        :param payload: 事先准备好的图片载荷，为空时按路径加载
+        """
+        payload = payload or self.image_payload(image_path)
         prompt = "请详细描述这张图片的内容，包括主体、颜色、动作、文字信息(OCR)及整体氛围。不要分段，直接输出一段中文描述。"
-        response = self.gemini_flash.generate_content([prompt, image])
-        return response.text
+        return self._generate("gemini.describe", prompt, payload).text
+
+    def analyze_image(self, image_path, topics, payload=None):
+        """
+        一次结构化请求同时得到描述、类别和 OCR 文字 (JSON 输出，类别限定在 topics 内)
+        :param topics: 候选类别名列表
+        :return: {"description", "category", "ocr_text"}；输出不合法时抛出 ValueError
+        """
+        payload = payload or self.image_payload(image_path)
+        prompt = IMAGE_ANALYSIS_PROMPT.format(topics=",".join(topics))
+        config = {"response_mime_type": "application/json", "response_schema": image_analysis_schema(topics)}
+        response = self._generate("gemini.analyze_image", prompt, payload, generation_config=config)
+        return parse_image_analysis(response.text, topics)
 
     def chat_with_gemini(self, prompt):
         """普通对话"""
-        response = self.gemini_flash.generate_content(prompt)
-        return response.text
+        return self._generate("gemini.generate", prompt).text
+
+    def stream_gemini(self, prompt, stats=None):
+        """
+        流式对话: 边生成边产出文本片段
+        :param stats: 传入字典时填入 first_token_s (首个片段的延迟)、total_s，
+            以及 API 返回的 prompt_tokens / output_tokens (取得到时)；
+            有片段被拦截或生成提前结束时填入 stop_reason，已经产出的文本不受影响
+        """
+        METRICS.incr("gemini.generate.calls")
+        METRICS.incr("gemini.bytes_sent", len(prompt.encode("utf-8")))
+        t0 = time.perf_counter()
+        first = None
+        with METRICS.span("gemini.stream"):
+            response = self.gemini_flash.generate_content(prompt, stream=True)
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # 被安全策略拦截或没有内容的片段，.text 会抛 ValueError
+                    reason = stream_stop_reason(chunk)
+                    if reason and stats is not None:
+                        stats["stop_reason"] = reason
+                    continue
+                if not text:
+                    continue
+                if first is None:
+                    first = time.perf_counter() - t0
+                    METRICS.observe("gemini.first_token", first)
+                yield text
+        if stats is not None:
+            stats["first_token_s"] = first
+            stats["total_s"] = time.perf_counter() - t0
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                stats["prompt_tokens"] = getattr(usage, "prompt_token_count", None)
+                stats["output_tokens"] = getattr(usage, "candidates_token_count", None)
     
     def chat_with_image(self, image_path, user_question):
         """图片问答"""
         try:
-            img = PIL.Image.open(image_path)
-            response = self.gemini_flash.generate_content([user_question, img])
-            return response.text
+            payload = self.image_payload(image_path)
+            return self._generate("gemini.ask_image", user_question, payload).text
         except Exception as e:
             return f"图片问答出错: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,84 @@
+# core/batch_writer.py
+import time
+
+import numpy as np
+
+from .config import WRITE_BATCH_ROWS, WRITE_FLUSH_SECONDS
+
+
+def merge_writes(writes):
+    """
+    把多份写入计划按 collection 合并成一份，同一 id 只保留最后一次
+    (Chroma 一次 upsert 里不允许出现重复 id)
+    """
+    merged = {}
+    for w in writes:
+        rows = merged.setdefault(w["collection"], {})
+        documents = w.get("documents")
+        for i, row_id in enumerate(w["ids"]):
+            rows[row_id] = (w["embeddings"][i], documents[i] if documents else None, w["metadatas"][i])
+
+    result = []
+    for collection, rows in merged.items():
+        ids = list(rows)
+        documents = [rows[i][1] for i in ids]
+        result.append({
+            "collection": collection,
+            "ids": ids,
+            "embeddings": np.stack([rows[i][0] for i in ids]).astype(np.float32, copy=False),
+            "documents": documents if any(d is not None for d in documents) else None,
+            "metadatas": [rows[i][2] for i in ids],
+        })
+    return result
+
+
+class BatchWriter:
+    """
+    写库缓冲: 逐个文件提交的写入先攒在内存里，按行数或时间一次性 upsert 到各个 collection
+    每个文件的写入都已先记入日志 (stage)，批量写库成功后再统一 commit。
+    on_commit 回调 (更新入库清单) 与 on_flush (保存清单) 在写库之后、commit 之前执行:
+    任何一步中断，下次启动时重放的都是幂等的 upsert 和清单记录。
+    只在单个线程 (入库流水线的写库线程) 中使用。
+    """
+
+    def __init__(self, db, max_rows=WRITE_BATCH_ROWS, max_delay=WRITE_FLUSH_SECONDS, on_flush=None):
+        self.db = db
+        self.on_flush = on_flush
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay
+        self.pending = []
+        self.rows = 0
+        self.first_at = None
+        self.flushes = 0
+
+    def add(self, writes, txn=None, on_commit=None):
+        self.pending.append((writes, txn, on_commit))
+        self.rows += sum(len(w["ids"]) for w in writes)
+        if self.first_at is None:
+            self.first_at = time.monotonic()
+        if self.rows >= self.max_rows:
+            self.flush()
+
+    def due(self):
+        return self.first_at is not None and time.monotonic() - self.first_at >= self.max_delay
+
+    def maybe_flush(self):
+        if self.due():
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        self.rows, self.first_at = 0, None
+
+        self.db.write_now(merge_writes([w for writes, _, _ in pending for w in writes]))
+        for _, _, on_commit in pending:
+            if on_commit:
+                on_commit()
+        if self.on_flush:
+            self.on_flush()
+        self.db.journal.commit([txn for _, txn, _ in pending if txn])
+        # 已写库的向量不必留在日志里
+        self.db.journal.reset()
+        self.flushes += 1
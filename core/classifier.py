@@ -0,0 +1,151 @@
+# core/classifier.py
+import re
+import threading
+
+import numpy as np
+
+from .config import (
+    CLASSIFY_IMAGE_MIN_CONFIDENCE, CLASSIFY_PAPER_MIN_CONFIDENCE, CLASSIFY_PAPER_TEMPERATURE,
+    CLASSIFY_MIN_SAMPLES, CLASSIFY_MAX_SAMPLES,
+)
+
+CLASSIFIER_MODES = ("llm", "local")
+
+# 零样本 CLIP 的提示词模板，每个类别取几个模板的平均向量
+IMAGE_PROMPT_TEMPLATES = ("a figure of {}", "a picture showing {}", "{}")
+
+# CLIP 的 logit 缩放系数 (训练时学到的温度，ViT-B/32 约为 100)
+CLIP_LOGIT_SCALE = 100.0
+
+
+def parse_topics(topics):
+    """'A,B, C' -> ['A', 'B', 'C']"""
+    return [t.strip() for t in topics.split(",") if t.strip()]
+
+
+def _normalize_name(text):
+    return re.sub(r"[\s_\-]+", "", text).lower()
+
+
+def match_topic(answer, topics):
+    """
+    把 LLM 的自由文本回答对应到类别列表里的一项: 先整体比较 (忽略大小写、空格和下划线)，
+    再找回答中出现的类别名；都对不上时返回清理后的原文
+    """
+    cleaned = answer.strip().replace("'", "").replace('"', "").replace(".", "")
+    names = parse_topics(topics)
+    key = _normalize_name(cleaned)
+    for name in names:
+        if _normalize_name(name) == key:
+            return name
+    found = [name for name in names if _normalize_name(name) in key]
+    if len(found) == 1:
+        return found[0]
+    return cleaned
+
+
+def _softmax(logits):
+    logits = logits - logits.max()
+    e = np.exp(logits)
+    return e / e.sum()
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+
+class LocalClassifier:
+    """
+    不调用 LLM 的本地分类，置信度不够时返回 None，由调用方退回 LLM 分类
+    - 图片: CLIP 零样本分类，图片向量与每个类别的提示词向量比较
+    - 论文: 最近质心分类，质心是论文库里已经带该类别标签的切片向量的平均
+    提示词向量和质心都按类别列表缓存 (同时按模型 / collection 区分，重新向量化切换后不会用到旧向量)；
+    论文库条数明显变化后质心重新计算。
+    """
+
+    def __init__(self, ai, db, image_threshold=CLASSIFY_IMAGE_MIN_CONFIDENCE,
+                 paper_threshold=CLASSIFY_PAPER_MIN_CONFIDENCE, temperature=CLASSIFY_PAPER_TEMPERATURE,
+                 min_samples=CLASSIFY_MIN_SAMPLES, max_samples=CLASSIFY_MAX_SAMPLES):
+        self.ai = ai
+        self.db = db
+        self.image_threshold = image_threshold
+        self.paper_threshold = paper_threshold
+        self.temperature = temperature
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.prompts = {}       # (CLIP 模型, 类别列表) -> (类别名, 提示词矩阵)
+        self.centroids = {}     # (论文库 collection, 类别列表) -> (论文库条数, 类别名, 质心矩阵)
+
+    # 图片
+
+    def _prompt_matrix(self, topics):
+        key = (self.ai.clip_model_id, topics)
+        with self.lock:
+            if key not in self.prompts:
+                names = parse_topics(topics)
+                rows = []
+                for name in names:
+                    label = name.replace("_", " ").lower()
+                    vecs = [self.ai.get_clip_text_embedding(t.format(label)) for t in IMAGE_PROMPT_TEMPLATES]
+                    if any(len(v) == 0 for v in vecs):
+                        raise RuntimeError(f"CLIP 提示词向量化失败: {name}")
+                    rows.append(_unit(np.mean([_unit(v) for v in vecs], axis=0)))
+                self.prompts[key] = (names, np.stack(rows))
+            return self.prompts[key]
+
+    def classify_image(self, clip_vec, topics):
+        """返回 (类别, 置信度)；置信度低于阈值时类别为 None"""
+        names, prompts = self._prompt_matrix(topics)
+        probs = _softmax(CLIP_LOGIT_SCALE * (prompts @ _unit(clip_vec)))
+        best = int(np.argmax(probs))
+        confidence = float(probs[best])
+        return (names[best] if confidence >= self.image_threshold else None), confidence
+
+    # 论文
+
+    def _centroid_matrix(self, topics):
+        """每个类别的质心；有类别的已标注切片不足 min_samples 时返回 None (无法可靠判断)"""
+        collection = self.db.paper_collection
+        total = collection.count()
+        key = (collection.name, topics)
+        with self.lock:
+            cached = self.centroids.get(key)
+            # 入库过程中论文库一直在增长，增长超过 10% 才重新计算
+            if cached is not None and abs(total - cached[0]) <= cached[0] * 0.1:
+                return cached[1], cached[2]
+            names, rows = parse_topics(topics), []
+            for name in names:
+                got = collection.get(where={"category": name}, include=["embeddings"], limit=self.max_samples)
+                found = got.get('embeddings')
+                vectors = np.asarray(found if found is not None and len(found) else np.zeros((0, 1)), dtype=np.float32)
+                if len(vectors) < self.min_samples:
+                    rows = None
+                    break
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                rows.append(_unit(vectors.mean(axis=0)))
+            matrix = np.stack(rows) if rows else None
+            self.centroids[key] = (total, names, matrix)
+            return names, matrix
+
+    def classify_paper(self, embeddings, topics):
+        """返回 (类别, 置信度)；没有足够的标注数据或置信度低于阈值时类别为 None"""
+        names, centroids = self._centroid_matrix(topics)
+        if centroids is None or len(embeddings) == 0:
+            return None, 0.0
+        doc = np.asarray(embeddings, dtype=np.float32)
+        doc = doc / np.maximum(np.linalg.norm(doc, axis=1, keepdims=True), 1e-12)
+        probs = _softmax((centroids @ _unit(doc.mean(axis=0))) / self.temperature)
+        best = int(np.argmax(probs))
+        confidence = float(probs[best])
+        return (names[best] if confidence >= self.paper_threshold else None), confidence
+
+
+def create_classifier(mode, ai, db):
+    """按配置名创建分类器: llm 返回 None (每次都问 LLM)，local 返回 LocalClassifier"""
+    if mode == "llm":
+        return None
+    if mode == "local":
+        return LocalClassifier(ai, db)
+    raise ValueError(f"未知的分类模式: {mode}")
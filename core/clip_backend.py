@@ -0,0 +1,199 @@
+# core/clip_backend.py
+import os
+import threading
+
+import numpy as np
+
+from .config import MODEL_PATH_CLIP, CLIP_NUM_THREADS, CLIP_ONNX_DIR
+
+# 可选的 CLIP 推理后端:
+#   torch      fp32 eager PyTorch (与已入库向量完全一致)
+#   int8       PyTorch 动态 int8 量化 (Linear 层)，无需额外依赖
+#   onnx       导出为 ONNX，用 onnxruntime 推理
+#   onnx-int8  导出后再做 onnxruntime 动态 int8 量化
+CLIP_BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+
+_threads_lock = threading.Lock()
+_threads_set = False
+
+
+def clip_model_id(name, model_path=MODEL_PATH_CLIP):
+    """
+    向量缓存里使用的模型标识: fp32 沿用原来的模型路径，已有缓存继续有效；
+    加速后端的向量与 fp32 有微小差异，单独缓存
+    """
+    if name not in CLIP_BACKENDS:
+        raise ValueError(f"未知的 CLIP_BACKEND: {name}")
+    return model_path if name == "torch" else f"{model_path}@{name}"
+
+
+def _set_torch_threads(num_threads):
+    """torch 的线程数是进程级设置，只设一次；0 表示沿用 torch 默认值 (物理核数)"""
+    global _threads_set
+    if num_threads <= 0:
+        return
+    import torch
+    with _threads_lock:
+        if not _threads_set:
+            torch.set_num_threads(num_threads)
+            _threads_set = True
+
+
+class ClipBackend:
+    """CLIP 推理后端接口: 输入 CLIPProcessor 的输出，返回 (N, dim) float32 矩阵"""
+    model_id = ""
+    dim = 0
+
+    def stack(self, pixels):
+        """把逐张预处理得到的 pixel_values 拼成一批"""
+        import torch
+        return torch.cat(pixels)
+
+    def encode_images(self, pixel_values):
+        raise NotImplementedError
+
+    def encode_texts(self, inputs):
+        raise NotImplementedError
+
+
+class TorchClipBackend(ClipBackend):
+    """
+    PyTorch 推理
+    :param quantize: 为 True 时对 Linear 层做动态 int8 量化，CPU 上通常快 1.5~2 倍
+    """
+
+    def __init__(self, model_path=MODEL_PATH_CLIP, quantize=False, num_threads=CLIP_NUM_THREADS):
+        import torch
+        from transformers import CLIPModel
+        _set_torch_threads(num_threads)
+        model = CLIPModel.from_pretrained(model_path).eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.model_id = clip_model_id("int8" if quantize else "torch", model_path)
+        self.dim = model.config.projection_dim
+
+    def encode_images(self, pixel_values):
+        import torch
+        with torch.no_grad():
+            features = self.model.get_image_features(pixel_values=pixel_values)
+        return features.detach().numpy().astype(np.float32)
+
+    def encode_texts(self, inputs):
+        import torch
+        with torch.no_grad():
+            features = self.model.get_text_features(**inputs)
+        return features.detach().numpy().astype(np.float32)
+
+
+class OnnxClipBackend(ClipBackend):
+    """
+    onnxruntime 推理: 第一次使用时把图像塔和文本塔分别导出到 CLIP_ONNX_DIR，之后直接加载，
+    不再需要把 PyTorch 模型读进内存
+    :param quantize: 为 True 时使用 onnxruntime 动态 int8 量化后的模型
+    """
+
+    def __init__(self, model_path=MODEL_PATH_CLIP, quantize=False, num_threads=CLIP_NUM_THREADS,
+                 onnx_dir=CLIP_ONNX_DIR):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("CLIP_BACKEND=onnx 需要先安装 onnxruntime: pip install onnxruntime")
+        from transformers import CLIPConfig
+
+        self.model_id = clip_model_id("onnx-int8" if quantize else "onnx", model_path)
+        self.dim = CLIPConfig.from_pretrained(model_path).projection_dim
+
+        model_dir = os.path.join(onnx_dir, model_path.replace("/", "__"))
+        suffix = ".int8.onnx" if quantize else ".onnx"
+        vision_path = os.path.join(model_dir, "vision" + suffix)
+        text_path = os.path.join(model_dir, "text" + suffix)
+        if not (os.path.exists(vision_path) and os.path.exists(text_path)):
+            self.export(model_path, model_dir, quantize)
+
+        options = ort.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        self.vision = ort.InferenceSession(vision_path, options, providers=providers)
+        self.text = ort.InferenceSession(text_path, options, providers=providers)
+
+    @staticmethod
+    def export(model_path, model_dir, quantize=False):
+        """导出 fp32 ONNX 模型 (quantize 时再生成 int8 版本)，已存在的文件不重复导出"""
+        import torch
+        from transformers import CLIPModel
+
+        # 只保留 get_image_features / get_text_features 两条路径，分别导出
+        class ImageTower(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, pixel_values):
+                return self.model.get_image_features(pixel_values=pixel_values)
+
+        class TextTower(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask):
+                return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+        os.makedirs(model_dir, exist_ok=True)
+        vision_path = os.path.join(model_dir, "vision.onnx")
+        text_path = os.path.join(model_dir, "text.onnx")
+
+        if not (os.path.exists(vision_path) and os.path.exists(text_path)):
+            print(f"正在导出 CLIP ONNX 模型到 {model_dir} (只需一次)...")
+            model = CLIPModel.from_pretrained(model_path).eval()
+            size = model.config.vision_config.image_size
+            with torch.no_grad():
+                torch.onnx.export(
+                    ImageTower(model).eval(), (torch.zeros(1, 3, size, size),), vision_path,
+                    input_names=["pixel_values"], output_names=["features"],
+                    dynamic_axes={"pixel_values": {0: "batch"}, "features": {0: "batch"}},
+                    opset_version=14,
+                )
+                ids = torch.ones(1, 8, dtype=torch.long)
+                torch.onnx.export(
+                    TextTower(model).eval(), (ids, torch.ones_like(ids)), text_path,
+                    input_names=["input_ids", "attention_mask"], output_names=["features"],
+                    dynamic_axes={"input_ids": {0: "batch", 1: "seq"},
+                                  "attention_mask": {0: "batch", 1: "seq"},
+                                  "features": {0: "batch"}},
+                    opset_version=14,
+                )
+            del model
+
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            for name in ("vision", "text"):
+                target = os.path.join(model_dir, f"{name}.int8.onnx")
+                if not os.path.exists(target):
+                    quantize_dynamic(os.path.join(model_dir, f"{name}.onnx"), target,
+                                     weight_type=QuantType.QInt8)
+        print("CLIP ONNX 模型就绪")
+
+    def encode_images(self, pixel_values):
+        pixels = np.ascontiguousarray(np.asarray(pixel_values, dtype=np.float32))
+        return self.vision.run(None, {"pixel_values": pixels})[0].astype(np.float32)
+
+    def encode_texts(self, inputs):
+        feed = {k: np.asarray(inputs[k], dtype=np.int64) for k in ("input_ids", "attention_mask")}
+        return self.text.run(None, feed)[0].astype(np.float32)
+
+
+def create_clip_backend(name, model_path=MODEL_PATH_CLIP):
+    """按配置名创建 CLIP 推理后端: torch / int8 / onnx / onnx-int8"""
+    if name == "torch":
+        return TorchClipBackend(model_path)
+    if name == "int8":
+        return TorchClipBackend(model_path, quantize=True)
+    if name == "onnx":
+        return OnnxClipBackend(model_path)
+    if name == "onnx-int8":
+        return OnnxClipBackend(model_path, quantize=True)
+    raise ValueError(f"未知的 CLIP_BACKEND: {name}")
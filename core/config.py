@@ -10,6 +10,112 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # 数据库和模型路径配置
 DB_PATH = "./my_knowledge_base"
 MODEL_PATH_CLIP = "openai/clip-vit-base-patch32"
+MANIFEST_PATH = os.path.join(DB_PATH, "ingest_manifest.json")  # 增量入库清单
+LEXICAL_INDEX_FILE = "lexical_index.sqlite"     # BM25 关键词索引 (位于 DB_PATH 下)
+JOURNAL_FILE = "ingest_journal.jsonl"           # 入库日志 (位于 DB_PATH 下)
+
+# 向量库后端
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")  # chroma (HNSW 近似检索) / mmap (内存映射矩阵精确检索)
+VECTOR_STORE_DTYPE = "float16"      # mmap 后端的存储精度: float16 / float32
+MMAP_QUERY_CHUNK_ROWS = 65536       # mmap 后端查询时每次参与矩阵乘法的行数
+MMAP_PARTITION_CACHE = 32           # mmap 后端缓存的过滤分区数 (过滤条件 -> 行号)，有写入后失效
+INDEXED_METADATA_FIELDS = ("category", "source", "doc_id")  # mmap 后端为这些元数据字段建表达式索引
+
+# CLIP 批量推理配置
+CLIP_BATCH_SIZE = 32        # 每次前向推理的图片数
+CLIP_PREFETCH_WORKERS = 4   # 后台解码/预处理线程数
+CLIP_BACKEND = os.getenv("CLIP_BACKEND", "torch")  # torch (fp32) / int8 / onnx / onnx-int8
+CLIP_NUM_THREADS = int(os.getenv("CLIP_NUM_THREADS", "0"))  # 推理线程数，0 表示框架默认
+
+# PDF 解析与切片配置
+PDF_WORKERS = min(4, os.cpu_count() or 1)   # 并行提取页面的进程数
+PDF_PARALLEL_MIN_PAGES = 16     # 页数少于该值时串行提取，省去进程池启动开销
+PDF_PAGE_TIMEOUT = 30           # 单页提取超时 (秒)，超时的页面跳过
+CHUNK_MAX_TOKENS = 512          # 每个切片的 token 上限
+CHUNK_OVERLAP_TOKENS = 64       # 相邻切片的重叠 token 数
+
+# 文本向量化配置
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini")  # gemini / stub (本地确定性桩)
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBED_BATCH_SIZE = 100              # 单次请求最多文本数 (Gemini 上限 100)
+EMBED_REQUESTS_PER_MINUTE = 1500    # 令牌桶限流
+EMBED_MAX_CONCURRENCY = 8           # 自适应并发上限
+EMBED_MAX_RETRIES = 5               # 429/5xx 重试次数
+EMBED_COALESCE_SECONDS = 0.05       # 入库时零散文本 (图片描述) 最多等待这么久，与其他线程的文本合成一次请求
+
+# 向量缓存配置 (内容寻址，重复入库/重复查询不再重新计算)
+CACHE_DIR = "./cache"
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite")
+EMBEDDING_CACHE_MAX_MB = 512        # 超出后按 LRU 淘汰
+EMBEDDING_CACHE_DTYPE = "float16"   # float16 / float32
+CLIP_ONNX_DIR = os.path.join(CACHE_DIR, "onnx")     # 导出的 CLIP ONNX 模型
+
+# 图片载荷配置 (上传给 Gemini 之前缩小并重新编码)
+IMAGE_MAX_EDGE = 1024           # 长边像素上限
+IMAGE_JPEG_QUALITY = 85         # 重新编码的 JPEG 质量
+IMAGE_PAYLOAD_CACHE_DIR = os.path.join(CACHE_DIR, "image_payloads")
+IMAGE_PAYLOAD_CACHE_MAX_MB = 256
+IMAGE_STRUCTURED_OUTPUT = True  # 描述、分类、OCR 合成一次 JSON 结构化请求；关闭后分别请求描述与分类
+
+# 检索配置
+SEARCH_MODE = "hybrid"      # vector / hybrid (向量 + BM25 融合) / lexical (纯本地关键词)
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60                  # 倒数排名融合的平滑常数
+HYBRID_CANDIDATES = 20      # 融合前每一路召回的候选数
+LIST_PAPERS_CANDIDATES = 50 # list_papers 初筛的切片数
+RERANK_POOLING = "topk"     # 切片得分聚合到文件的方式: max / mean / topk
+RERANK_TOP_K = 3            # topk 池化时每个文件累加的切片数
+IMAGE_SEARCH_CANDIDATES = 10                    # 图片搜索每一路召回数
+IMAGE_FUSION_WEIGHTS = {"desc": 1.0, "clip": 1.0}  # 描述语义 / CLIP 视觉两路的融合权重
+
+# 问答 (search_paper) 上下文配置
+RAG_CANDIDATES = 12             # 召回的候选切片数
+RAG_CONTEXT_TOKENS = 2000       # 参考资料的 token 预算
+RAG_DEDUP_THRESHOLD = 0.92      # 与已选切片余弦相似度不低于该值的切片视为重复，不放入上下文
+
+# 近似重复图片检测 (入库时，重复的图片不再调用 Gemini)
+DEDUP_ENABLED = True
+DEDUP_HAMMING_MAX = 10          # 感知哈希 (64 位) 预筛的最大汉明距离
+DEDUP_CLIP_THRESHOLD = 0.95     # CLIP 余弦相似度不低于该值才判定为重复
+
+# 分类配置
+CLASSIFY_MODE = os.getenv("CLASSIFY_MODE", "local")    # llm (每次问 Gemini) / local (本地分类，置信度不够再问 Gemini)
+CLASSIFY_IMAGE_MIN_CONFIDENCE = 0.6     # CLIP 零样本分类的最低置信度
+CLASSIFY_PAPER_MIN_CONFIDENCE = 0.6     # 论文最近质心分类的最低置信度
+CLASSIFY_PAPER_TEMPERATURE = 0.02       # 质心余弦相似度换算成置信度的温度，越小越果断
+CLASSIFY_MIN_SAMPLES = 20               # 每个类别至少有这么多已标注切片才启用论文本地分类
+CLASSIFY_MAX_SAMPLES = 2000             # 计算质心时每个类别最多读取的切片数
+
+# 批量入库流水线配置
+INGEST_CPU_WORKERS = 2      # PDF 解析线程数
+INGEST_IO_WORKERS = 8       # Gemini 调用线程数
+INGEST_QUEUE_SIZE = 64      # 阶段之间的队列长度 (背压)
+
+# 监视文件夹配置 (python main.py watch <folder>)
+WATCH_SETTLE_SECONDS = 2.0  # 文件大小和修改时间保持这么久不变才认为写完 (防止读到复制了一半的文件)
+WATCH_BATCH_SECONDS = 1.0   # 每隔这么久把写完的文件合成一批入库
+WATCH_POLL_SECONDS = 2.0    # 没有安装 watchdog 时，轮询目录快照的间隔
+
+# 写库配置
+WRITE_BATCH_ROWS = 2000     # 缓冲的记录数达到该值时批量写库
+WRITE_FLUSH_SECONDS = 2.0   # 缓冲最久保留的秒数
+JOURNAL_FSYNC = True        # 入库日志逐条落盘，断电也能恢复
+
+# 快照配置 (python main.py export / import)
+SNAPSHOT_CHUNK_ROWS = 5000      # 每个数据块的行数，导出和导入时内存里最多只有一块
+SNAPSHOT_DTYPE = "float16"      # 快照里向量的存储精度: float16 / float32
+
+# 向量模型记录与重新向量化 (python main.py migrate_embeddings)
+EMBEDDING_REGISTRY_FILE = "embedding_models.json"  # 存放在 DB_PATH 下
+MIGRATION_BATCH_SIZE = 500              # 每批重新计算的记录数，每批完成后记录进度
+MIGRATION_REQUESTS_PER_MINUTE = 600     # 迁移占用的嵌入请求速率上限，给同时进行的检索留出配额
+
+# 常驻服务配置 (python main.py serve)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = int(os.getenv("KB_SERVER_PORT", "8765"))
+SERVER_TOKEN_FILE = os.path.join(DB_PATH, "server_token")  # 访问令牌 (权限 0600，只有本用户可读)
 
 # 资料库路径配置 
 LIBRARY_ROOT = "./"  
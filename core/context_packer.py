@@ -0,0 +1,71 @@
+# core/context_packer.py
+import numpy as np
+
+from .config import RAG_CONTEXT_TOKENS, RAG_DEDUP_THRESHOLD
+from .text_utils import count_tokens, token_spans
+
+
+def truncate_tokens(text, max_tokens):
+    """截到前 max_tokens 个 token (按 token 边界，不切断单词)"""
+    spans = token_spans(text)
+    if len(spans) <= max_tokens:
+        return text
+    return text[:spans[max_tokens - 1][1]] if max_tokens > 0 else ""
+
+
+def pack_context(results, embeddings=None, budget=RAG_CONTEXT_TOKENS, dedup_threshold=RAG_DEDUP_THRESHOLD):
+    """
+    按相关度顺序把候选切片装进上下文，直到 token 预算用完
+    - 与已选切片的余弦相似度不低于 dedup_threshold 的切片视为近似重复，跳过
+      (同一篇论文相邻页的重叠切片、同一内容的不同版本)
+    - 放不下的切片跳过，继续尝试后面更短的；第一条就超出预算时截断后放入
+    :param results: search_papers 返回的 Chroma 格式结果
+    :param embeddings: {切片 id: 向量}，为空时不做去重
+    :return: {"chunks": [{"id", "text", "meta", "tokens"}], "tokens", "candidates",
+              "dropped_duplicates", "dropped_budget"}
+    """
+    ids = results['ids'][0]
+    docs = results['documents'][0]
+    metas = results['metadatas'][0]
+    embeddings = embeddings or {}
+
+    chosen, chosen_vecs = [], []
+    used = dropped_duplicates = dropped_budget = 0
+    for chunk_id, doc, meta in zip(ids, docs, metas):
+        vec = embeddings.get(chunk_id)
+        if vec is not None:
+            vec = np.asarray(vec, dtype=np.float32)
+            vec = vec / max(float(np.linalg.norm(vec)), 1e-12)
+            if chosen_vecs and float(np.max(np.stack(chosen_vecs) @ vec)) >= dedup_threshold:
+                dropped_duplicates += 1
+                continue
+
+        tokens = count_tokens(doc)
+        if used + tokens > budget:
+            if chosen:
+                dropped_budget += 1
+                continue
+            doc = truncate_tokens(doc, budget)
+            tokens = count_tokens(doc)
+
+        chosen.append({"id": chunk_id, "text": doc, "meta": meta, "tokens": tokens})
+        if vec is not None:
+            chosen_vecs.append(vec)
+        used += tokens
+
+    return {
+        "chunks": chosen,
+        "tokens": used,
+        "candidates": len(ids),
+        "dropped_duplicates": dropped_duplicates,
+        "dropped_budget": dropped_budget,
+    }
+
+
+def format_context(packed):
+    """把装好的切片拼成提示词里的参考资料，每段标明出处，便于回答时引用"""
+    parts = []
+    for i, chunk in enumerate(packed["chunks"]):
+        meta = chunk["meta"] or {}
+        parts.append(f"[{i + 1}] {meta.get('source', '未知')} (P.{meta.get('page', '?')})\n{chunk['text']}")
+    return "\n\n".join(parts)
@@ -1,29 +1,226 @@
-import chromadb
 import os
-from .config import DB_PATH
+import threading
+import numpy as np
+from .config import DB_PATH, HYBRID_CANDIDATES, LEXICAL_INDEX_FILE, JOURNAL_FILE, VECTOR_STORE, EMBEDDING_REGISTRY_FILE
+from .embedding_registry import EmbeddingRegistry
+from .lexical_index import LexicalIndex
+from .journal import IngestJournal
+from .batch_writer import BatchWriter
+from .dedup import NearDuplicateIndex
+from .ranking import reciprocal_rank_fusion
+from .metrics import METRICS
+
+def create_vector_client(path, backend=VECTOR_STORE):
+    """
+    按配置名创建向量库客户端: chroma / mmap
+    两者的 collection 接口相同，切换后端不会迁移已有数据，需要重新入库
+    """
+    if backend == "chroma":
+        import chromadb
+        return chromadb.PersistentClient(path=path)
+    if backend == "mmap":
+        from .vector_store import MmapVectorStore
+        return MmapVectorStore(path)
+    raise ValueError(f"未知的 VECTOR_STORE: {backend}")
 
 class DatabaseHandler:
-    def __init__(self):
-        print(f"正在连接数据库: {DB_PATH}")
-        self.client = chromadb.PersistentClient(path=DB_PATH)
+    def __init__(self, path=DB_PATH, backend=VECTOR_STORE):
+        print(f"正在连接数据库: {path}")
+        self.client = create_vector_client(path, backend)
+        # 每个逻辑库对应的 collection 与向量模型 (重新向量化迁移后 collection 会换成新的)
+        self.registry = EmbeddingRegistry(os.path.join(path, EMBEDDING_REGISTRY_FILE))
+        # 写库命令之间互斥: 常驻服务里的入库命令、监视入库、迁移最后的切换共用这把锁
+        self.write_lock = threading.RLock()
+        # 同一时间只进行一个重新向量化迁移
+        self.migration_lock = threading.Lock()
+        # 迁移期间记录当前库里被写入 / 删除 / 改过元数据的 id: collection 物理名 -> set
+        self.changed_ids = {}
+        self.changes_lock = threading.Lock()
+        self.collections = {}
+
+        # 1. 论文库 (文本向量 768维)
+        self.paper_collection = self._open(self.registry.name("paper_db"))
         
-        # 1. 论文库 (Gemini 768维)
-        self.paper_collection = self.client.get_or_create_collection(
-            name="paper_db", 
-            metadata={"hnsw:space": "cosine"}
-        )
-        
-        # 2. 图片描述库 (Gemini 768维)
-        self.image_desc_collection = self.client.get_or_create_collection(
-            name="image_desc_db", 
-            metadata={"hnsw:space": "cosine"}
-        )
+        # 2. 图片描述库 (文本向量 768维)
+        self.image_desc_collection = self._open(self.registry.name("image_desc_db"))
         
         # 3. 视觉库 (CLIP 512维)
-        self.visual_collection = self.client.get_or_create_collection(
-            name="visual_db", 
-            metadata={"hnsw:space": "cosine"}
-        )
+        self.visual_collection = self._open(self.registry.name("visual_db"))
+        self._index_collections()
+
+        # 4. 关键词索引 (BM25，覆盖论文切片和图片描述)
+        self.lexicon = LexicalIndex(os.path.join(path, LEXICAL_INDEX_FILE))
+        # 上次迁移切换后没来得及删除的旧 collection
+        self.drop_retired()
+        for collection in (self.paper_collection, self.image_desc_collection):
+            self._sync_lexicon(collection)
+
+        # 5. 入库日志与写库缓冲 (缓冲只在 begin_batch 之后启用)
+        self.journal = IngestJournal(os.path.join(path, JOURNAL_FILE))
+        self.writer = None
+        self.max_batch_size = self.client.get_max_batch_size()
+
+        # 6. 近似重复图片索引 (第一次检测时才读入感知哈希)
+        self.near_duplicates = NearDuplicateIndex(self.visual_collection)
+
+    def _open(self, name):
+        collection = self.client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+        self.collections[name] = collection
+        return collection
+
+    def _index_collections(self):
+        """逻辑库名 -> collection；self.collections 还包含迁移中的影子 collection"""
+        self.logical = {"paper_db": self.paper_collection, "image_desc_db": self.image_desc_collection,
+                        "visual_db": self.visual_collection}
+        self.collections.update({c.name: c for c in self.logical.values()})
+
+    # 向量模型与迁移
+
+    def check_models(self, configured):
+        """
+        对照配置检查各向量空间的模型，返回 {向量空间: (库中的模型, 配置的模型)} 中不一致的部分
+        库还是空的 (且没有迁移在进行) 时直接采用配置的模型；顺带补记各库的向量维度
+        """
+        mismatches = {}
+        migrating = (self.registry.migration or {}).get("space")
+        for space, model in configured.items():
+            current = self.registry.model(space)
+            if current == model:
+                continue
+            logical = self.registry.logical_in(space)
+            if space != migrating and all(self.logical[name].count() == 0 for name in logical):
+                for name in logical:
+                    self.registry.set_model(name, model)
+            else:
+                mismatches[space] = (current, model)
+        for name, collection in self.logical.items():
+            entry = self.registry.collections[name]
+            if entry["dim"] is None and collection.count():
+                self.registry.set_model(name, entry["model"], self.vector_dim(collection))
+        return mismatches
+
+    @staticmethod
+    def vector_dim(collection):
+        """collection 里向量的维度，空库返回 None"""
+        got = collection.get(limit=1, include=["embeddings"])
+        return len(got['embeddings'][0]) if got['ids'] else None
+
+    def open_collection(self, name):
+        """打开 (不存在时创建) 一个不属于任何逻辑库的 collection，例如迁移用的影子 collection"""
+        return self.collections.get(name) or self._open(name)
+
+    def track_changes(self, names):
+        """开始记录这些 collection 里被改动的 id (迁移切换前只需核对这些记录)"""
+        with self.changes_lock:
+            for name in names:
+                self.changed_ids[name] = set()
+
+    def take_changes(self, name):
+        """取出并清空某个 collection 到目前为止被改动的 id"""
+        with self.changes_lock:
+            ids, self.changed_ids[name] = self.changed_ids.get(name, set()), set()
+        return ids
+
+    def stop_tracking(self, names):
+        with self.changes_lock:
+            for name in names:
+                self.changed_ids.pop(name, None)
+
+    def _mark_changed(self, name, ids):
+        with self.changes_lock:
+            if name in self.changed_ids:
+                self.changed_ids[name].update(ids)
+
+    def drop_collection(self, name):
+        self.collections.pop(name, None)
+        try:
+            self.client.delete_collection(name)
+        except Exception:
+            # 已经不存在 (各版本 Chroma 抛出的异常类型不同)
+            pass
+        self.lexicon.clear(name)
+
+    def drop_retired(self):
+        for name in list(self.registry.retired):
+            print(f"正在删除已被替换的 collection: {name}")
+            self.drop_collection(name)
+            self.registry.forget_retired(name)
+
+    def promote_shadows(self, dims):
+        """
+        迁移完成: 逻辑库切换到影子 collection，再删除旧 collection (调用方需持有 write_lock)
+        :param dims: {逻辑库名: 新向量的维度}
+        """
+        self.registry.finish_migration(dims)
+        self.paper_collection = self.open_collection(self.registry.name("paper_db"))
+        self.image_desc_collection = self.open_collection(self.registry.name("image_desc_db"))
+        self.visual_collection = self.open_collection(self.registry.name("visual_db"))
+        self._index_collections()
+        self.near_duplicates = NearDuplicateIndex(self.visual_collection)
+        self.drop_retired()
+
+    def _sync_lexicon(self, collection, page_size=1000):
+        """关键词索引与 Chroma 条数不一致时 (旧库首次升级 / 上次写入中断)，从 Chroma 重建"""
+        total = collection.count()
+        if self.lexicon.count(collection.name) == total:
+            return
+        print(f"正在重建关键词索引: {collection.name} ({total} 条)")
+        self.lexicon.clear(collection.name)
+        for offset in range(0, total, page_size):
+            page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            self.lexicon.upsert(collection.name, page['ids'], page['documents'], page['metadatas'])
+
+    # 写库
+
+    def begin_batch(self, **kwargs):
+        """之后的 add_* 先进入缓冲，按行数 / 时间批量写库，直到 end_batch"""
+        self.writer = BatchWriter(self, **kwargs)
+        return self.writer
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def end_batch(self):
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.flush()
+
+    @METRICS.traced("chroma.upsert")
+    def write_now(self, writes):
+        """把写入计划直接 upsert 进 Chroma (按单次请求上限分段)，并同步关键词索引"""
+        for w in writes:
+            collection = self.collections[w["collection"]]
+            documents = w.get("documents")
+            step = self.max_batch_size
+            for i in range(0, len(w["ids"]), step):
+                collection.upsert(
+                    ids=w["ids"][i:i + step],
+                    embeddings=w["embeddings"][i:i + step],
+                    metadatas=w["metadatas"][i:i + step],
+                    documents=documents[i:i + step] if documents else None
+                )
+            METRICS.incr("chroma.rows_written", len(w["ids"]))
+            self._mark_changed(collection.name, w["ids"])
+            if documents:
+                self.lexicon.upsert(collection.name, w["ids"], documents, w["metadatas"])
+
+    def _submit(self, writes, txn=None, on_commit=None):
+        """
+        :param txn: 入库日志里的事务 id，给定时先把写入计划记入日志再写库
+        :param on_commit: 写库成功后的回调
+        """
+        if txn:
+            self.journal.stage(txn, writes)
+        if self.writer is not None:
+            self.writer.add(writes, txn, on_commit)
+            return
+        self.write_now(writes)
+        if on_commit:
+            on_commit()
+        if txn:
+            self.journal.commit([txn])
+            self.journal.reset()
 
     def check_paper_exists(self, filename):
         """检查论文是否已存在"""
@@ -40,67 +237,208 @@ class DatabaseHandler:
         )
         return len(existing['ids']) > 0
 
-    def add_paper_chunks(self, chunks, embeddings, moved_path=None, category="Uncategorized"):
+    def add_paper_chunks(self, chunks, embeddings, moved_path=None, category="Uncategorized", doc_id=None,
+                         txn=None, on_commit=None, extra_meta=None):
         """
         存入论文切片
         :param moved_path: 文件移动后的新路径 
         :param category: 论文分类 
+        :param doc_id: 由内容哈希得到的文档 id，为空时沿用旧的按文件名生成 id
+        :param extra_meta: 每个切片都附带的额外元数据 (例如分类方式与置信度)
         """
-        ids = [f"{c['source']}_p{c['page']}_{i}" for i, c in enumerate(chunks)]
+        prefix = doc_id if doc_id else chunks[0]['source'] if chunks else ""
+        ids = [c.get('chunk_id') or f"{prefix}_p{c['page']}_{i}" for i, c in enumerate(chunks)]
         
         metadatas = []
         for c in chunks:
             final_path = moved_path if moved_path else c['path']
             
-            metadatas.append({
+            meta = {
                 "source": c['source'], 
                 "page": c['page'], 
+                # 切片可能跨页，按页过滤时用 page ~ page_end 判断是否包含某一页
+                "page_end": c.get('page_end', c['page']),
                 "path": final_path,   
                 "category": category  
-            })
+            }
+            if doc_id:
+                meta["doc_id"] = doc_id
+            if extra_meta:
+                meta.update(extra_meta)
+            metadatas.append(meta)
 
         documents = [c['text'] for c in chunks]
         
-        self.paper_collection.upsert(
-            ids=ids, 
-            embeddings=embeddings, 
-            metadatas=metadatas, 
-            documents=documents
-        )
+        self._submit([{
+            "collection": self.paper_collection.name,
+            "ids": ids, 
+            "embeddings": np.asarray(embeddings, dtype=np.float32), 
+            "metadatas": metadatas, 
+            "documents": documents
+        }], txn, on_commit)
         print(f"已更新/存入 {len(chunks)} 个片段到论文库 (分类: {category})")
 
-    def add_image(self, image_path, clip_vec, description, gemini_vec, category="Uncategorized"):
-        """双路存入图片"""
+    def add_image(self, image_path, clip_vec, description, gemini_vec, category="Uncategorized", doc_id=None,
+                  txn=None, on_commit=None, phash=None, extra_meta=None, ocr_text=None):
+        """
+        双路存入图片，两个库的写入属于同一个事务
+        :param doc_id: 由内容哈希得到的文档 id，为空时沿用旧的按文件名生成 id
+        :param phash: 感知哈希，存入视觉库元数据供近似重复检测使用
+        :param extra_meta: 两个库都附带的额外元数据 (例如分类方式与置信度)
+        :param ocr_text: 图片中的文字，附在描述后面进入描述库的文档 (关键词检索也能命中)
+        """
         file_name = os.path.basename(image_path)
+        key = doc_id if doc_id else file_name
+        extra = {"doc_id": doc_id} if doc_id else {}
+        extra.update(extra_meta or {})
+        visual_extra = {"phash": f"{phash:016x}"} if phash is not None else {}
         
-        # 1. 存入视觉库 (CLIP)
-        self.visual_collection.upsert(
-            ids=[f"img_clip_{file_name}"], 
-            embeddings=[clip_vec], 
-            metadatas=[{
-                "path": image_path, 
-                "category": category
-            }]
-        )
-        
-        # 2. 存入图片描述库 (Gemini)
-        self.image_desc_collection.upsert(
-            ids=[f"img_desc_{file_name}"], 
-            embeddings=[gemini_vec], 
-            documents=[description], 
-            metadatas=[{
-                "path": image_path, 
-                "desc": description, 
-                "category": category
-            }] 
-        )
+        self._submit([
+            # 1. 视觉库 (CLIP)
+            {
+                "collection": self.visual_collection.name,
+                "ids": [self.image_record_id(image_path, doc_id)], 
+                "embeddings": np.asarray([clip_vec], dtype=np.float32), 
+                "metadatas": [{
+                    "path": image_path, 
+                    "category": category,
+                    **extra,
+                    **visual_extra
+                }]
+            },
+            # 2. 图片描述库 (Gemini)
+            {
+                "collection": self.image_desc_collection.name,
+                "ids": [f"img_desc_{key}"], 
+                "embeddings": np.asarray([gemini_vec], dtype=np.float32), 
+                "documents": [f"{description}\n{ocr_text}" if ocr_text else description], 
+                "metadatas": [{
+                    "path": image_path, 
+                    "desc": description, 
+                    "category": category,
+                    **extra,
+                    **({"ocr_text": ocr_text} if ocr_text else {})
+                }] 
+            },
+        ], txn, on_commit)
         print(f"图片已双路更新/存入: {file_name} (分类: {category})")
 
-    def search_paper(self, query_vec, n_results=3):
-        return self.paper_collection.query(query_embeddings=[query_vec], n_results=n_results)
+    def legacy_records(self, kind, filename):
+        """旧版本 (按文件名生成 id、没有 doc_id) 入库的同名记录的元数据"""
+        if kind == "image":
+            existing = self.visual_collection.get(ids=[f"img_clip_{filename}"], include=["metadatas"])
+            return existing['metadatas']
+        existing = self.paper_collection.get(where={"source": filename}, include=["metadatas"])
+        return [meta for meta in existing['metadatas'] if "doc_id" not in meta]
+
+    def _collections_for(self, kind):
+        if kind == "paper":
+            return [self.paper_collection]
+        return [self.visual_collection, self.image_desc_collection]
 
-    def search_image_desc(self, query_vec, n_results=3):
-        return self.image_desc_collection.query(query_embeddings=[query_vec], n_results=n_results)
+    @METRICS.traced("chroma.delete")
+    def delete_document(self, kind, doc_id):
+        """删除某个文档 (按 doc_id) 的全部记录，用于文件内容变化后重新入库"""
+        # 缓冲里可能还有这个文档的写入，先落库再删
+        self.flush()
+        for collection in self._collections_for(kind):
+            existing = collection.get(where={"doc_id": doc_id}, include=[])
+            if existing['ids']:
+                collection.delete(ids=existing['ids'])
+                self._mark_changed(collection.name, existing['ids'])
+                self.lexicon.delete(collection.name, existing['ids'])
+                if collection is self.visual_collection:
+                    self.near_duplicates.discard(existing['ids'])
+
+    def update_document_path(self, kind, doc_id, new_path):
+        """文件改名或移动后，只更新元数据里的路径，不重新向量化"""
+        self.flush()
+        updated = 0
+        for collection in self._collections_for(kind):
+            existing = collection.get(where={"doc_id": doc_id}, include=["metadatas"])
+            if not existing['ids']:
+                continue
+            metadatas = []
+            for meta in existing['metadatas']:
+                meta = dict(meta)
+                meta["path"] = new_path
+                if "source" in meta:
+                    meta["source"] = os.path.basename(new_path)
+                metadatas.append(meta)
+            collection.update(ids=existing['ids'], metadatas=metadatas)
+            self._mark_changed(collection.name, existing['ids'])
+            self.lexicon.update_metadata(collection.name, existing['ids'], metadatas)
+            updated += len(existing['ids'])
+        return updated
+
+    @METRICS.traced("chroma.query")
+    def search_paper(self, query_vec, n_results=3, where=None):
+        """:param where: 元数据过滤条件 (见 filters.metadata_where)，交给向量库在检索时过滤，而不是取回后再筛"""
+        return self.paper_collection.query(query_embeddings=[query_vec], n_results=n_results, where=where)
+
+    def get_paper_embeddings(self, ids):
+        """按 id 取论文切片的向量，返回 {id: 向量} (关键词检索的结果不带向量，打包上下文时去重要用)"""
+        if not ids:
+            return {}
+        got = self.paper_collection.get(ids=list(ids), include=["embeddings"])
+        return dict(zip(got['ids'], np.asarray(got['embeddings'], dtype=np.float32)))
+
+    def search_paper_lexical(self, query, n_results=3, where=None):
+        """纯本地 BM25 检索，不需要向量，返回格式与 Chroma query 相同"""
+        return self._lexical(self.paper_collection, query, n_results, where)
+
+    def search_paper_hybrid(self, query_vec, query, n_results=3, candidates=HYBRID_CANDIDATES, where=None):
+        """向量检索与 BM25 各召回 candidates 条，按倒数排名融合后取前 n_results"""
+        return self._hybrid(self.paper_collection, query_vec, query, n_results, candidates, where)
+
+    @METRICS.traced("lexical.query")
+    def _lexical(self, collection, query, n_results, where=None):
+        hits = self.lexicon.search(collection.name, query, n_results, where=where)
+        return {
+            "ids": [[h[0] for h in hits]],
+            "documents": [[h[2] for h in hits]],
+            "metadatas": [[h[3] for h in hits]],
+            "distances": [[None for _ in hits]],
+            "scores": [[h[1] for h in hits]],
+        }
+
+    @METRICS.traced("chroma.hybrid_query")
+    def _hybrid(self, collection, query_vec, query, n_results, candidates, where=None):
+        candidates = max(candidates, n_results)
+        dense = collection.query(query_embeddings=[query_vec], n_results=candidates, where=where)
+        sparse = self._lexical(collection, query, candidates, where)
+
+        # 两路结果按 id 合并，向量一路的距离保留下来
+        rows = {}
+        for result in (sparse, dense):
+            for i, doc_id in enumerate(result['ids'][0]):
+                rows[doc_id] = (result['documents'][0][i], result['metadatas'][0][i],
+                                result['distances'][0][i])
+        fused = reciprocal_rank_fusion([dense['ids'][0], sparse['ids'][0]])[:n_results]
+        return {
+            "ids": [[doc_id for doc_id, _ in fused]],
+            "documents": [[rows[doc_id][0] for doc_id, _ in fused]],
+            "metadatas": [[rows[doc_id][1] for doc_id, _ in fused]],
+            "distances": [[rows[doc_id][2] for doc_id, _ in fused]],
+            "scores": [[score for _, score in fused]],
+        }
+
+    @METRICS.traced("chroma.query")
+    def search_image_desc(self, query_vec, n_results=3, where=None):
+        return self.image_desc_collection.query(query_embeddings=[query_vec], n_results=n_results, where=where)
+
+    @METRICS.traced("chroma.query")
+    def search_image_clip(self, clip_vec, n_results=3, where=None):
+        return self.visual_collection.query(query_embeddings=[clip_vec], n_results=n_results, where=where)
+
+    def find_near_duplicate(self, phash, clip_vec, exclude=(), record_id=None):
+        """
+        入库前检查近似重复图片，返回 (原图路径, 相似度)，不重复时路径为 None
+        :param record_id: 这张图片自己的记录 id，不与自己比较
+        """
+        return self.near_duplicates.find(phash, clip_vec, exclude, record_id=record_id)
 
-    def search_image_clip(self, clip_vec, n_results=3):
-        return self.visual_collection.query(query_embeddings=[clip_vec], n_results=n_results)
\ No newline at end of file
+    @staticmethod
+    def image_record_id(image_path, doc_id=None):
+        """视觉库里一张图片的记录 id，与 add_image 的规则一致"""
+        return f"img_clip_{doc_id if doc_id else os.path.basename(image_path)}"
\ No newline at end of file
@@ -0,0 +1,129 @@
+# core/dedup.py
+import io
+import threading
+
+import numpy as np
+
+from .config import DEDUP_HAMMING_MAX, DEDUP_CLIP_THRESHOLD
+
+
+def perceptual_hash(data):
+    """
+    差值哈希 (dHash): 缩成 9x8 灰度图，比较每行相邻像素的明暗，得到 64 位整数
+    对缩放、重新编码 (PNG <-> JPEG) 和轻微调色不敏感；输入为图片文件的字节
+    """
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format == "JPEG":
+            # 只需要 9x8，JPEG 直接按 1/8 缩小解码
+            image.draft("L", (64, 64))
+        pixels = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming_distances(hashes, value):
+    """hashes (uint64 数组) 中每一个与 value 相差的位数"""
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class NearDuplicateIndex:
+    """
+    入库时的近似重复图片检测，两级判定:
+      1. 感知哈希预筛: 与库中每张图片的 dHash 比较汉明距离，只保留不超过 max_distance 的候选 (纯内存运算)
+      2. CLIP 复核: 候选的 CLIP 向量与新图片的余弦相似度不低于 threshold 才算重复
+    哈希存放在视觉库元数据的 phash 字段里，第一次使用时一次性读入；
+    本次运行中刚判定为新图片、还没写库的也会加入索引，同一批里的 PNG / JPEG 两个版本只处理一次。
+    """
+
+    def __init__(self, collection, max_distance=DEDUP_HAMMING_MAX, threshold=DEDUP_CLIP_THRESHOLD):
+        self.collection = collection
+        self.max_distance = max_distance
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.ids, self.paths = [], []
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.pending = {}   # 还没写库的记录 id -> CLIP 向量
+
+    def _load(self, page_size=1000):
+        ids, paths, hashes = [], [], []
+        total = self.collection.count()
+        for offset in range(0, total, page_size):
+            page = self.collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            for record_id, meta in zip(page['ids'], page['metadatas']):
+                # 早于该功能入库的图片没有哈希，不参与判定
+                if meta and meta.get("phash"):
+                    ids.append(record_id)
+                    paths.append(meta.get("path"))
+                    hashes.append(int(meta["phash"], 16))
+        self.ids, self.paths = ids, paths
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.loaded = True
+
+    def _vectors(self, ids):
+        """候选的 CLIP 向量: 未写库的取内存里的，其余从视觉库读"""
+        vectors = {i: self.pending[i] for i in ids if i in self.pending}
+        stored = [i for i in ids if i not in vectors]
+        if stored:
+            got = self.collection.get(ids=stored, include=["embeddings"])
+            vectors.update(zip(got['ids'], np.asarray(got['embeddings'], dtype=np.float32)))
+        return vectors
+
+    def find(self, phash, clip_vec, exclude=(), record_id=None):
+        """
+        返回 (重复的原图路径, 余弦相似度)，不重复时返回 (None, 最高相似度)
+        :param exclude: 不参与比较的记录 id (例如内容变化的文件自己的旧版本)
+        :param record_id: 待检测图片自己的记录 id，始终不参与比较 (上次失败时留下的登记不会让重试被判为重复)
+        """
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            if not len(self.hashes):
+                return None, 0.0
+            close = np.flatnonzero(hamming_distances(self.hashes, phash) <= self.max_distance)
+            if not len(close):
+                return None, 0.0
+            candidates = {self.ids[i]: self.paths[i] for i in close
+                          if self.ids[i] not in exclude and self.ids[i] != record_id}
+            if not candidates:
+                return None, 0.0
+            vectors = self._vectors(list(candidates))
+
+        query = np.asarray(clip_vec, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        best_id, best = None, 0.0
+        for record_id, vec in vectors.items():
+            sim = float(vec @ query) / max(float(np.linalg.norm(vec)), 1e-12)
+            if sim > best:
+                best_id, best = record_id, sim
+        if best >= self.threshold:
+            return candidates[best_id], best
+        return None, best
+
+    def add(self, record_id, phash, path, clip_vec=None):
+        """登记一张新图片；clip_vec 不为空表示还没写库，复核时直接用内存里的向量"""
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            if record_id in self.ids:
+                return
+            self.ids.append(record_id)
+            self.paths.append(path)
+            self.hashes = np.append(self.hashes, np.uint64(phash))
+            if clip_vec is not None:
+                self.pending[record_id] = np.asarray(clip_vec, dtype=np.float32)
+
+    def discard(self, record_ids):
+        """记录被删除后从索引里去掉"""
+        with self.lock:
+            drop = set(record_ids)
+            keep = [i for i, record_id in enumerate(self.ids) if record_id not in drop]
+            if len(keep) == len(self.ids):
+                return
+            self.ids = [self.ids[i] for i in keep]
+            self.paths = [self.paths[i] for i in keep]
+            self.hashes = self.hashes[keep]
+            for record_id in drop:
+                self.pending.pop(record_id, None)
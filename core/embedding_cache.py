@@ -0,0 +1,135 @@
+# core/embedding_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from .config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_MB, EMBEDDING_CACHE_DTYPE
+
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sha256_file(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    内容寻址的向量缓存 (SQLite 单文件)
+    键: (模型 id, 任务类型, 文本或图片字节的 SHA-256)
+    值: float16/float32 紧凑存储，取出时统一转回 float32
+    超过容量上限时按最近访问时间 (LRU) 淘汰
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_mb=EMBEDDING_CACHE_MAX_MB, dtype=EMBEDDING_CACHE_DTYPE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.dtype = np.dtype(dtype)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT, task TEXT, digest TEXT, dtype TEXT, vec BLOB, last_access REAL,"
+            " PRIMARY KEY (model, task, digest))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self.conn.commit()
+        row = self.conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()
+        self.total_bytes = row[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model, task, digests):
+        """批量查询，返回 {digest: float32 向量}，只包含命中的项"""
+        found = {}
+        unique = list(dict.fromkeys(digests))
+        with self.lock:
+            # SQLite 单条语句的参数个数有限，分批查询
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT digest, dtype, vec FROM embeddings WHERE model=? AND task=? AND digest IN ({marks})",
+                    [model, task] + part
+                ).fetchall()
+                for digest, dtype, blob in rows:
+                    found[digest] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_access=? WHERE model=? AND task=? AND digest=?",
+                    [(now, model, task, d) for d in found]
+                )
+                self.conn.commit()
+            self.hits += sum(1 for d in digests if d in found)
+            self.misses += sum(1 for d in digests if d not in found)
+        return found
+
+    def get(self, model, task, digest):
+        return self.get_many(model, task, [digest]).get(digest)
+
+    def put_many(self, model, task, items):
+        """批量写入 [(digest, vector), ...]"""
+        now = time.time()
+        rows = []
+        for digest, vec in items:
+            blob = np.asarray(vec, dtype=self.dtype).tobytes()
+            rows.append((model, task, digest, self.dtype.name, blob, now))
+        if not rows:
+            return
+        with self.lock:
+            for model_, task_, digest, _, blob, _ in rows:
+                old = self.conn.execute(
+                    "SELECT LENGTH(vec) FROM embeddings WHERE model=? AND task=? AND digest=?",
+                    (model_, task_, digest)
+                ).fetchone()
+                self.total_bytes += len(blob) - (old[0] if old else 0)
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def put(self, model, task, digest, vec):
+        self.put_many(model, task, [(digest, vec)])
+
+    def _evict(self):
+        """LRU 淘汰到容量上限的 90%，留出余量避免频繁淘汰"""
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute(
+            "SELECT rowid, LENGTH(vec) FROM embeddings ORDER BY last_access ASC"
+        )
+        doomed = []
+        for rowid, size in rows:
+            if self.total_bytes <= target:
+                break
+            doomed.append((rowid,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM embeddings WHERE rowid=?", doomed)
+        self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "size_mb": self.total_bytes / 1024 / 1024,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"向量缓存: 命中 {s['hits']} / 未命中 {s['misses']} (命中率 {s['hit_rate']:.0%})，"
+                f"共 {s['entries']} 条，{s['size_mb']:.1f} MB")
@@ -0,0 +1,297 @@
+# core/embedding_provider.py
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import (
+    GEMINI_API_KEY, EMBEDDING_MODEL, EMBED_BATCH_SIZE, EMBED_REQUESTS_PER_MINUTE,
+    EMBED_MAX_CONCURRENCY, EMBED_MAX_RETRIES, EMBED_COALESCE_SECONDS,
+)
+from .metrics import METRICS
+
+# 可重试的 HTTP 状态码: 限流 + 服务端错误
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+_STATUS_PREFIX = re.compile(r"\s*(\d{3})\b")
+
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def get_genai():
+    """延迟导入并配置 google.generativeai，整个进程只配置一次"""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            if not GEMINI_API_KEY or "AIza" not in GEMINI_API_KEY:
+                raise ValueError("请先在 core/config.py 中填入正确的 GEMINI_API_KEY")
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            _genai = genai
+    return _genai
+
+
+class EmbeddingProvider:
+    """文本向量化后端接口，子类只需实现 embed_batch"""
+    model_id = ""
+    dim = 0
+    max_batch_size = EMBED_BATCH_SIZE
+
+    def embed_batch(self, texts, task_type="semantic_similarity"):
+        """一次请求把多段文本变成向量列表，顺序与输入一致"""
+        raise NotImplementedError
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Gemini text-embedding: 一次请求最多 100 段文本"""
+    dim = 768
+
+    def __init__(self, model_id=EMBEDDING_MODEL):
+        self.model_id = model_id
+
+    def embed_batch(self, texts, task_type="semantic_similarity"):
+        result = get_genai().embed_content(
+            model=self.model_id,
+            content=list(texts),
+            task_type=task_type
+        )
+        return result['embedding']
+
+
+class StubEmbeddingProvider(EmbeddingProvider):
+    """
+    本地确定性桩: 用哈希技巧把词袋投影成向量，相同文本永远得到相同向量，
+    词重叠越多余弦相似度越高。用于测试和基准，不发任何网络请求。
+    :param latency: 每次请求模拟的网络延迟 (秒)
+    """
+    model_id = "stub/hash-embedding"
+
+    def __init__(self, dim=768, latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+
+    def _embed_one(self, text):
+        vec = [0.0] * self.dim
+        for token in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec))
+        if norm == 0:
+            # 没有可用词的文本: 退化为按全文哈希的随机单位向量
+            rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+            vec = [rng.gauss(0, 1) for _ in range(self.dim)]
+            norm = math.sqrt(sum(v * v for v in vec))
+        return [v / norm for v in vec]
+
+    def embed_batch(self, texts, task_type="semantic_similarity"):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed_one(t) for t in texts]
+
+
+def create_provider(name, model_id=None):
+    """
+    按配置名创建向量化后端: gemini / stub
+    :param model_id: Gemini 的向量模型，为空时用 EMBEDDING_MODEL (stub 只有一个固定模型)
+    """
+    if name == "gemini":
+        return GeminiEmbeddingProvider(model_id or EMBEDDING_MODEL)
+    if name == "stub":
+        return StubEmbeddingProvider()
+    raise ValueError(f"未知的 EMBEDDING_PROVIDER: {name}")
+
+
+def _status_code(error):
+    """从 google.api_core 等异常里取出 HTTP 状态码，取不到返回 None"""
+    code = getattr(error, "code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        pass
+    text = str(error)
+    # 没有 code 属性时只认消息开头的状态码 (google.api_core 的格式 "429 Resource has been exhausted")，
+    # 消息中间出现的数字 (例如 "input exceeds 5000 tokens") 不算
+    match = _STATUS_PREFIX.match(text)
+    if match:
+        return int(match.group(1))
+    if "Resource has been exhausted" in text:
+        return 429
+    return None
+
+
+class TokenBucket:
+    """令牌桶限流: 每秒补充 rate 个令牌，最多攒 capacity 个"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """阻塞直到拿到令牌"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD 自适应并发: 连续成功时并发上限 +1，遇到限流时减半
+    """
+
+    def __init__(self, max_limit, initial=2, min_limit=1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = min_limit
+        self.limit = max(min_limit, min(initial, self.max_limit))
+        self.in_flight = 0
+        self.successes = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, success=True, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self.successes = 0
+            elif success:
+                self.successes += 1
+                if self.successes >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self.successes = 0
+            self.cond.notify_all()
+
+
+class BatchEmbedder:
+    """
+    批量向量化: 按 provider.max_batch_size 分组，多组并发请求，
+    请求前经过令牌桶限流，429/5xx 指数退避重试。
+    """
+
+    def __init__(self, provider, requests_per_minute=EMBED_REQUESTS_PER_MINUTE,
+                 max_concurrency=EMBED_MAX_CONCURRENCY, max_retries=EMBED_MAX_RETRIES, base_delay=1.0):
+        self.provider = provider
+        self.bucket = TokenBucket(requests_per_minute / 60.0)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.pool = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+        self.retries = 0
+
+    def _call_with_retry(self, texts, task_type):
+        for attempt in range(self.max_retries + 1):
+            self.concurrency.acquire()
+            self.bucket.acquire()
+            METRICS.incr("gemini.embed.requests")
+            METRICS.incr("gemini.bytes_sent", sum(len(t.encode("utf-8")) for t in texts))
+            try:
+                with METRICS.span("gemini.embed_request"):
+                    vectors = self.provider.embed_batch(texts, task_type)
+            except Exception as e:
+                code = _status_code(e)
+                self.concurrency.release(success=False, throttled=(code == 429))
+                if code not in RETRYABLE_CODES or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                METRICS.incr("gemini.embed.retries")
+                delay = self.base_delay * (2 ** attempt) + random.uniform(0, self.base_delay)
+                print(f"   [重试] 向量化请求失败 ({code})，{delay:.1f}s 后第 {attempt + 1} 次重试")
+                time.sleep(delay)
+                continue
+            self.concurrency.release(success=True)
+            METRICS.incr("gemini.embed.texts", len(texts))
+            if len(vectors) != len(texts):
+                raise RuntimeError(f"向量数量不匹配: 期望 {len(texts)}，实际 {len(vectors)}")
+            return vectors
+
+    def embed(self, texts, task_type="semantic_similarity"):
+        """把任意数量的文本变成向量列表，顺序与输入一致"""
+        texts = list(texts)
+        if not texts:
+            return []
+        size = max(1, self.provider.max_batch_size)
+        batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+        if len(batches) == 1:
+            return self._call_with_retry(batches[0], task_type)
+
+        futures = [self.pool.submit(self._call_with_retry, b, task_type) for b in batches]
+        vectors = []
+        for future in futures:
+            vectors.extend(future.result())
+        return vectors
+
+
+class EmbedCoalescer:
+    """
+    跨线程合并零散的向量化请求: 多个线程各自只有一两段文本 (例如每张图片的描述) 时，
+    第一个到达的线程等待 max_wait 秒或凑满一批，把期间到达的文本合成一次请求，再把结果分回各线程。
+    """
+
+    def __init__(self, embedder, max_batch=EMBED_BATCH_SIZE, max_wait=EMBED_COALESCE_SECONDS):
+        self.embedder = embedder
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.cond = threading.Condition()
+        self.pending = {}   # task_type -> [slot, ...]
+
+    def embed(self, texts, task_type="semantic_similarity"):
+        texts = list(texts)
+        if not texts or len(texts) >= self.max_batch:
+            return self.embedder.embed(texts, task_type)
+
+        slot = {"texts": texts, "done": threading.Event(), "vectors": None, "error": None}
+        with self.cond:
+            queue = self.pending.setdefault(task_type, [])
+            queue.append(slot)
+            leader = len(queue) == 1
+            self.cond.notify_all()
+
+        if leader:
+            deadline = time.monotonic() + self.max_wait
+            with self.cond:
+                while sum(len(s["texts"]) for s in self.pending[task_type]) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch = self.pending.pop(task_type)
+            self._run(batch, task_type)
+
+        slot["done"].wait()
+        if slot["error"] is not None:
+            raise slot["error"]
+        return slot["vectors"]
+
+    def _run(self, batch, task_type):
+        METRICS.incr("embed.coalesced_calls", len(batch))
+        try:
+            vectors = self.embedder.embed([t for s in batch for t in s["texts"]], task_type)
+            start = 0
+            for s in batch:
+                s["vectors"] = vectors[start:start + len(s["texts"])]
+                start += len(s["texts"])
+        except Exception as e:
+            for s in batch:
+                s["error"] = e
+        finally:
+            for s in batch:
+                s["done"].set()
@@ -0,0 +1,105 @@
+# core/embedding_registry.py
+import json
+import os
+import threading
+
+from .config import EMBEDDING_MODEL, MODEL_PATH_CLIP
+
+# 逻辑库 -> 向量空间: 论文切片和图片描述用同一个文本向量模型，视觉库用 CLIP
+COLLECTION_SPACES = {"paper_db": "text", "image_desc_db": "text", "visual_db": "clip"}
+SPACES = ("text", "clip")
+
+
+def default_models():
+    """按当前配置应使用的模型"""
+    return {"text": EMBEDDING_MODEL, "clip": MODEL_PATH_CLIP}
+
+
+class EmbeddingRegistry:
+    """
+    记录每个逻辑库实际对应的 collection、生成其向量的模型和维度 (JSON 单文件，与向量库放在一起):
+
+        {"collections": {"paper_db": {"name": "paper_db_v2", "space": "text", "model": "...", "dim": 768}, ...},
+         "migration": {"space": "text", "model": "...", "shadows": {"paper_db": "paper_db_v3"}, "offsets": {...}},
+         "retired": ["paper_db"]}
+
+    - 检索和入库都按这里记录的模型计算向量，改配置不会让两种向量混进同一个库
+    - migration: 正在进行的重新向量化 (影子 collection 和已处理的行数)，中断后可以继续
+    - retired: 已被替换、等待删除的旧 collection (删除前进程退出时下次启动再删)
+    旧库没有这个文件时，按当前配置的模型建立记录。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        data = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        models = default_models()
+        self.collections = data.get("collections", {})
+        for logical, space in COLLECTION_SPACES.items():
+            self.collections.setdefault(logical, {"name": logical, "space": space, "model": models[space], "dim": None})
+        self.migration = data.get("migration")
+        self.retired = data.get("retired", [])
+        if not os.path.exists(path):
+            self.save()
+
+    def save(self):
+        """原子写入: 先写临时文件再替换，切换 collection 时不会出现只写了一半的记录"""
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "collections": self.collections,
+                           "migration": self.migration, "retired": self.retired}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+
+    def name(self, logical):
+        return self.collections[logical]["name"]
+
+    def model(self, space):
+        """某个向量空间当前使用的模型"""
+        return next(e["model"] for e in self.collections.values() if e["space"] == space)
+
+    def models(self):
+        return {space: self.model(space) for space in SPACES}
+
+    def logical_in(self, space):
+        return [logical for logical, s in COLLECTION_SPACES.items() if s == space]
+
+    def set_model(self, logical, model, dim=None):
+        self.collections[logical].update(model=model, dim=dim)
+        self.save()
+
+    # 迁移
+
+    def start_migration(self, space, model, shadows):
+        self.migration = {"space": space, "model": model, "shadows": shadows,
+                          "offsets": {logical: 0 for logical in shadows}}
+        self.save()
+
+    def record_offset(self, logical, offset):
+        self.migration["offsets"][logical] = offset
+        self.save()
+
+    def finish_migration(self, dims):
+        """影子 collection 转正: 逻辑库指向影子，旧 collection 记入待删除列表，一次原子写入完成切换"""
+        migration = self.migration
+        for logical, shadow in migration["shadows"].items():
+            entry = self.collections[logical]
+            self.retired.append(entry["name"])
+            entry.update(name=shadow, model=migration["model"], dim=dims.get(logical))
+        self.migration = None
+        self.save()
+
+    def cancel_migration(self):
+        """放弃未完成的迁移，影子 collection 记入待删除列表"""
+        if self.migration:
+            self.retired.extend(self.migration["shadows"].values())
+            self.migration = None
+            self.save()
+
+    def forget_retired(self, name):
+        self.retired = [n for n in self.retired if n != name]
+        self.save()
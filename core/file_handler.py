@@ -1,60 +1,232 @@
 # core/file_handler.py
 import os
+import multiprocessing
 import pypdf
 import shutil
-from .config import PAPERS_ROOT, IMAGES_ROOT
+import threading
+from .config import (
+    PAPERS_ROOT, IMAGES_ROOT, PDF_WORKERS, PDF_PARALLEL_MIN_PAGES, PDF_PAGE_TIMEOUT,
+    CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS,
+)
+from .text_utils import token_spans
+from .metrics import METRICS
 
-def read_pdf_chunks(pdf_path):
-    chunks = []
+# 子进程内缓存已打开的 PdfReader，同一份 PDF 的各页不必重复解析文件结构
+_worker_readers = {}
+
+
+def _extract_page(pdf_path, index):
+    """[子进程] 提取单页文本"""
+    reader = _worker_readers.get(pdf_path)
+    if reader is None:
+        _worker_readers.clear()
+        reader = _worker_readers[pdf_path] = pypdf.PdfReader(pdf_path)
+    return reader.pages[index].extract_text() or ""
+
+
+class PdfPagePool:
+    """
+    一次运行 (一次 batch_ingest / 一批监视入库 / 一条 add_paper) 共用的页面提取进程池
+    - 第一次用到时才启动，纯图片或小 PDF 的运行不付出进程启动开销
+    - 多个线程同时提取不同的 PDF 时共用这 workers 个进程，进程总数不随 CPU 线程数放大
+    - 某页超时说明有子进程可能卡死: 之后的提交改用新进程池，旧池在 close 时终止，不影响其他 PDF 正在等待的页面
+    用法: with PdfPagePool() as pool: iter_pdf_chunks(path, pool=pool)
+    """
+
+    def __init__(self, workers=PDF_WORKERS):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self._pool = None
+        self._retired = []
+
+    def submit(self, pdf_path, index):
+        """提交一页，返回 (所用的进程池, AsyncResult)"""
+        with self.lock:
+            if self._pool is None:
+                # spawn: 调用方可能是多线程的入库流水线，fork 多线程进程不安全
+                self._pool = multiprocessing.get_context("spawn").Pool(processes=self.workers)
+            return self._pool, self._pool.apply_async(_extract_page, (pdf_path, index))
+
+    def retire(self, pool):
+        with self.lock:
+            if pool is self._pool:
+                self._retired.append(pool)
+                self._pool = None
+
+    def close(self):
+        with self.lock:
+            active, retired = self._pool, self._retired
+            self._pool, self._retired = None, []
+        for pool in retired:
+            pool.terminate()
+            pool.join()
+        if active is not None:
+            active.close()
+            active.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_pdf_pages(pdf_path, pool=None, page_timeout=PDF_PAGE_TIMEOUT):
+    """
+    按页码顺序逐页产出 (页码, 文本)
+    传入 pool (PdfPagePool) 且页数较多时在进程池中并行提取，最多领先消费方 2 * workers 页；
+    否则用已经打开的 PdfReader 串行提取。单页超时或出错时跳过该页，不影响其余页面。
+    """
+    reader = pypdf.PdfReader(pdf_path)
+    num_pages = len(reader.pages)
+
+    if pool is None or pool.workers <= 1 or num_pages < PDF_PARALLEL_MIN_PAGES:
+        for i, page in enumerate(reader.pages):
+            try:
+                with METRICS.span("pdf.page"):
+                    text = page.extract_text() or ""
+            except Exception as e:
+                print(f"   [警告] 第 {i + 1} 页提取失败: {e}")
+                continue
+            METRICS.incr("pdf.pages")
+            yield i + 1, text
+        return
+
+    # 子进程自己打开文件，主进程的 reader 不再需要
+    del reader
+    window = pool.workers * 2
+    pending = {}
+    next_page = 0
+    for i in range(num_pages):
+        while next_page < num_pages and next_page - i < window:
+            pending[next_page] = pool.submit(pdf_path, next_page)
+            next_page += 1
+        used, result = pending.pop(i)
+        try:
+            text = result.get(timeout=page_timeout)
+        except multiprocessing.TimeoutError:
+            pool.retire(used)
+            print(f"   [警告] 第 {i + 1} 页提取超时 ({page_timeout}s)，已跳过")
+            continue
+        except Exception as e:
+            print(f"   [警告] 第 {i + 1} 页提取失败: {e}")
+            continue
+        METRICS.incr("pdf.pages")
+        yield i + 1, text
+
+
+def chunk_pages(pages, source, path, doc_id=None, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    把 (页码, 文本) 流切成 token 数有上限、相邻块有重叠的切片
+    - 超长页面被拆成多个切片，不会被向量模型截断
+    - 内容很少的页面与后续页面拼在一起，不再被丢弃
+    - 切片 id 由 (doc_id 或文件名, 起始页, 序号) 构成，同一文件重复切片得到相同 id
+    """
+    overlap = min(overlap, max_tokens - 1)
+    prefix = doc_id if doc_id else source
+    # 缓冲区里的每一项是 (页码, 片段)，片段为一个 token 及其后面的空白，拼起来即原文
+    buffer = []
+    fresh = 0   # 缓冲区中还没有出现在任何切片里的 token 数
+    seq = 0
+
+    def make_chunk(pieces):
+        text = "".join(p for _, p in pieces).strip()
+        return {
+            "text": text, "page": pieces[0][0], "page_end": pieces[-1][0],
+            "source": source, "path": path, "chunk_id": f"{prefix}_p{pieces[0][0]}_{seq}",
+        }
+
+    for page_no, text in pages:
+        spans = token_spans(text)
+        for k, (start, _) in enumerate(spans):
+            end = spans[k + 1][0] if k + 1 < len(spans) else len(text)
+            buffer.append((page_no, text[start:end]))
+            fresh += 1
+            if len(buffer) >= max_tokens:
+                yield make_chunk(buffer[:max_tokens])
+                seq += 1
+                buffer = buffer[max_tokens - overlap:]
+                fresh = len(buffer) - overlap
+        # 页与页之间补一个换行，避免两页首尾的单词粘连
+        if buffer:
+            last_page, last_piece = buffer[-1]
+            if not last_piece.endswith("\n"):
+                buffer[-1] = (last_page, last_piece + "\n")
+
+    if fresh > 0 and buffer:
+        yield make_chunk(buffer)
+
+
+def iter_pdf_chunks(pdf_path, doc_id=None, pool=None):
+    """
+    流式读取 PDF 并切片: 页面边提取边切片，整份文档的文本不会同时留在内存里
+    :param pool: 调用方持有的 PdfPagePool，为空时串行提取
+    """
     file_name = os.path.basename(pdf_path)
     try:
-        reader = pypdf.PdfReader(pdf_path)
-        for i, page in enumerate(reader.pages):
-            text = page.extract_text()
-            if text and len(text) > 50: # 忽略内容太少的页面
-                chunks.append({
-                    "text": text, "page": i + 1, "source": file_name, "path": pdf_path
-                })
+        yield from chunk_pages(iter_pdf_pages(pdf_path, pool=pool), file_name, pdf_path, doc_id=doc_id)
     except Exception as e:
         print(f"读取 PDF 失败: {e}")
-    return chunks
 
-def move_file_to_category(file_path, category, file_type="paper"):
+
+def read_pdf_chunks(pdf_path, doc_id=None):
+    return list(iter_pdf_chunks(pdf_path, doc_id=doc_id))
+
+def category_target(file_path, category, file_type="paper"):
+    """
+    计算文件归档后的路径 (不移动): 已经在目标位置时返回原路径，
+    目标位置已有同名的其他文件时加序号，避免覆盖 (例如不同论文里的 figure1.png)
+    """
+    # 1. 决定去哪里 (Papers 库还是 Images 库)
+    if file_type == "paper":
+        base_root = PAPERS_ROOT
+    elif file_type == "image":
+        base_root = IMAGES_ROOT
+    else:
+        # 如果未知类型，默认留在原地整理
+        base_root = os.path.dirname(file_path)
+
+    # 2. 拼接目标路径
+    target_dir = os.path.join(base_root, category)
+    file_name = os.path.basename(file_path)
+    new_path = os.path.join(target_dir, file_name)
+
+    # 3. 如果源路径和目标路径完全一样，说明文件已经在对的地方了，不用动
+    if os.path.abspath(file_path) == os.path.abspath(new_path):
+        return new_path
+
+    stem, ext = os.path.splitext(file_name)
+    k = 1
+    while os.path.exists(new_path):
+        new_path = os.path.join(target_dir, f"{stem}_{k}{ext}")
+        k += 1
+    return new_path
+
+
+def move_file_to_category(file_path, category, file_type="paper", target=None):
     """
     将文件移动到对应的统一资料库中。
     :param file_type: 'paper' 或 'image'，决定了文件去 PAPERS_ROOT 还是 IMAGES_ROOT
+    :param target: 事先用 category_target 算好的目标路径 (入库日志需要在移动前记下它)
     """
     try:
-        # 1. 决定去哪里 (Papers 库还是 Images 库)
-        if file_type == "paper":
-            base_root = PAPERS_ROOT
-        elif file_type == "image":
-            base_root = IMAGES_ROOT
-        else:
-            # 如果未知类型，默认留在原地整理
-            base_root = os.path.dirname(file_path)
-
-        # 2. 拼接目标路径
-        target_dir = os.path.join(base_root, category)
-        
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir)
-            
-        file_name = os.path.basename(file_path)
-        new_path = os.path.join(target_dir, file_name)
-        
-        # 3. 如果源路径和目标路径完全一样，说明文件已经在对的地方了，不用动
+        new_path = target or category_target(file_path, category, file_type)
         if os.path.abspath(file_path) == os.path.abspath(new_path):
             return new_path
 
+        target_dir = os.path.dirname(new_path)
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+
         # 4. 移动文件
-        shutil.move(file_path, new_path)
+        with METRICS.span("file.move"):
+            shutil.move(file_path, new_path)
         
-        rel_path = os.path.relpath(new_path, start=os.path.dirname(base_root))
+        rel_path = os.path.relpath(new_path, start=os.path.dirname(os.path.dirname(target_dir)))
         print(f"   [归档完成] -> {rel_path}")
         
         return new_path
     
     except Exception as e:
         print(f"   [文件移动错误] {e}")
-        return file_path
\ No newline at end of file
+        return file_path
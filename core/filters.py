@@ -0,0 +1,69 @@
+# core/filters.py
+
+# where 过滤支持的比较运算符 -> SQL
+_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def json_field(key, column="metadata"):
+    """
+    元数据字段的 SQL 表达式。JSON 路径直接写进语句而不是作为参数，
+    这样才能命中在同一个表达式上建的索引 (SQLite 只按表达式文本匹配索引)
+    """
+    if '"' in key or "'" in key:
+        raise ValueError(f"元数据字段名不能包含引号: {key}")
+    return f"json_extract({column}, '$.\"{key}\"')"
+
+
+def where_to_sql(where):
+    """
+    把 Chroma 风格的 where 条件翻译成 SQL (作用在 metadata JSON 列上)，返回 (语句, 参数)
+    支持 {"k": v}、{"k": {"$eq"/"$ne"/"$gt"/"$gte"/"$lt"/"$lte"/"$in"/"$nin": v}}、{"$and": [...]}、{"$or": [...]}
+    """
+    clauses, params = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(w) for w in value]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            for _, p in parts:
+                params.extend(p)
+            continue
+        field = json_field(key)
+        if not isinstance(value, dict):
+            value = {"$eq": value}
+        for op, operand in value.items():
+            if op in _OPERATORS:
+                clauses.append(f"{field} {_OPERATORS[op]} ?")
+                params.append(operand)
+            elif op in ("$in", "$nin"):
+                marks = ",".join("?" * len(operand)) or "NULL"
+                clauses.append(f"{field} {'IN' if op == '$in' else 'NOT IN'} ({marks})")
+                params.extend(operand)
+            else:
+                raise ValueError(f"不支持的 where 运算符: {op}")
+    return " AND ".join(clauses) or "1", params
+
+
+def metadata_where(category=None, source=None, page=None):
+    """
+    检索过滤条件 -> Chroma where (没有任何条件时返回 None)
+    :param category: 类别名，逗号分隔的多个类别取并集
+    :param source: 论文文件名
+    :param page: 论文页码，匹配覆盖这一页的切片 (page <= 页码 <= page_end)；
+        没有 page_end 的旧记录按起始页匹配
+    """
+    conditions = []
+    if category:
+        names = [c.strip() for c in category.split(",") if c.strip()]
+        conditions.append({"category": names[0] if len(names) == 1 else {"$in": names}})
+    if source:
+        conditions.append({"source": source})
+    if page is not None:
+        conditions.append({"$or": [
+            {"page": page},
+            {"$and": [{"page": {"$lte": page}}, {"page_end": {"$gte": page}}]},
+        ]})
+    if not conditions:
+        return None
+    # Chroma 要求多个字段的条件显式用 $and 组合
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
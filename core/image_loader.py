@@ -0,0 +1,134 @@
+# core/image_loader.py
+import io
+import os
+import threading
+
+from .config import (
+    IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY, IMAGE_PAYLOAD_CACHE_DIR, IMAGE_PAYLOAD_CACHE_MAX_MB,
+)
+from .embedding_cache import sha256_file
+from .metrics import METRICS
+
+# Gemini 能直接接收的原图格式，缩小后体积反而变大时直接发送原文件
+PASSTHROUGH_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+def decode_image(path, max_edge=IMAGE_MAX_EDGE):
+    """
+    解码一次，返回 (CLIP 用的 RGB 图片, Gemini 用的缩小图片, 原始格式, 是否缩小过)
+    - CLIP 图片与此前逐张 Image.open(...).convert("RGB") 的结果完全一致 (全分辨率，不旋转、不铺白底)，
+      视觉库与向量缓存里已有的向量仍然可比，缓存键不必变化
+    - Gemini 图片按 EXIF 方向旋正、透明背景铺白底，长边缩小到 max_edge 以减少上传量
+    """
+    from PIL import Image, ImageOps
+    with Image.open(path) as image:
+        fmt = image.format
+        image.load()
+        clip_image = image.convert("RGB")
+        view = ImageOps.exif_transpose(image)
+        if view.mode in ("RGBA", "LA", "P"):
+            # 透明背景铺白底，JPEG 不支持透明通道
+            rgba = view.convert("RGBA")
+            view = Image.new("RGB", rgba.size, (255, 255, 255))
+            view.paste(rgba, mask=rgba.split()[-1])
+        else:
+            view = view.convert("RGB")
+    original_size = view.size
+    view.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return clip_image, view, fmt, view.size != original_size
+
+
+class ImageLoader:
+    """
+    图片共享加载: 每张图片只解码一次，同时得到
+      - 原分辨率的 RGB 图片 (交给 CLIP 预处理，与单独打开图片时完全一致)
+      - 缩小后重新编码的 JPEG 载荷 (上传给 Gemini 看图说话 / 图片问答)
+    载荷按 (图片内容 SHA-256, 长边, 质量) 缓存在磁盘上，CLIP 阶段生成后，
+    Gemini 阶段直接读取，不再打开原图。缓存超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, cache_dir=IMAGE_PAYLOAD_CACHE_DIR, max_edge=IMAGE_MAX_EDGE,
+                 quality=IMAGE_JPEG_QUALITY, max_mb=IMAGE_PAYLOAD_CACHE_MAX_MB):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_edge = max_edge
+        self.quality = quality
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.total_bytes = sum(e.stat().st_size for e in os.scandir(cache_dir) if e.is_file())
+
+    def _cache_path(self, digest, mime_type):
+        ext = mime_type.split("/")[-1]
+        return os.path.join(self.cache_dir, f"{digest}_{self.max_edge}_q{self.quality}.{ext}")
+
+    def _lookup(self, digest):
+        for mime_type in ["image/jpeg"] + [m for m in PASSTHROUGH_MIME.values() if m != "image/jpeg"]:
+            path = self._cache_path(digest, mime_type)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            # 更新访问时间，淘汰时按 mtime 排序
+            os.utime(path)
+            return {"mime_type": mime_type, "data": data}
+        return None
+
+    def _store(self, digest, payload):
+        path = self._cache_path(digest, payload["mime_type"])
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(payload["data"])
+        os.replace(tmp, path)
+        with self.lock:
+            self.total_bytes += len(payload["data"])
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """删掉最久没用过的载荷，直到总大小降到上限的 80%"""
+        entries = sorted((e for e in os.scandir(self.cache_dir) if e.is_file()), key=lambda e: e.stat().st_mtime)
+        self.total_bytes = sum(e.stat().st_size for e in entries)
+        target = self.max_bytes * 0.8
+        for entry in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.total_bytes -= size
+            except OSError:
+                pass
+
+    def prepare(self, path, digest=None):
+        """
+        解码一次，返回 (CLIP 用的 RGB 图片, 载荷)，并把载荷写入缓存
+        载荷: {"mime_type", "data", "original_bytes"}，可以直接放进 generate_content 的内容列表
+        """
+        original_bytes = os.path.getsize(path)
+        digest = digest or sha256_file(path)
+        with METRICS.span("image.decode"):
+            clip_image, image, fmt, resized = decode_image(path, self.max_edge)
+
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=self.quality, optimize=True)
+        payload = {"mime_type": "image/jpeg", "data": buf.getvalue()}
+        if not resized and fmt in PASSTHROUGH_MIME and original_bytes <= len(payload["data"]):
+            # 小图重新编码反而更大，直接发原文件
+            with open(path, "rb") as f:
+                payload = {"mime_type": PASSTHROUGH_MIME[fmt], "data": f.read()}
+
+        self._store(digest, payload)
+        payload["original_bytes"] = original_bytes
+        return clip_image, payload
+
+    def payload(self, path, digest=None):
+        """取上传给 Gemini 的载荷: 先查磁盘缓存，未命中时解码生成"""
+        digest = digest or sha256_file(path)
+        cached = self._lookup(digest)
+        if cached is not None:
+            METRICS.incr("cache.image_payload.hit")
+            cached["original_bytes"] = os.path.getsize(path)
+            return cached
+        METRICS.incr("cache.image_payload.miss")
+        return self.prepare(path, digest)[1]
@@ -0,0 +1,155 @@
+# core/journal.py
+import base64
+import fcntl
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from .config import JOURNAL_FSYNC
+
+
+def encode_writes(writes):
+    """写入计划转成可存进日志的 JSON: 向量按 float32 打包成 base64，比数字列表小得多"""
+    encoded = []
+    for w in writes:
+        vectors = np.asarray(w["embeddings"], dtype=np.float32)
+        encoded.append({
+            "collection": w["collection"],
+            "ids": w["ids"],
+            "shape": list(vectors.shape),
+            "embeddings": base64.b64encode(vectors.tobytes()).decode("ascii"),
+            "documents": w.get("documents"),
+            "metadatas": w["metadatas"],
+        })
+    return encoded
+
+
+def decode_writes(encoded):
+    writes = []
+    for w in encoded:
+        vectors = np.frombuffer(base64.b64decode(w["embeddings"]), dtype=np.float32).reshape(w["shape"])
+        writes.append({
+            "collection": w["collection"],
+            "ids": w["ids"],
+            "embeddings": vectors,
+            "documents": w.get("documents"),
+            "metadatas": w["metadatas"],
+        })
+    return writes
+
+
+class IngestJournal:
+    """
+    追加写的入库日志 (JSON Lines)，每个文件的入库是一个事务:
+
+        begin   {kind, src, dst, hash, category}   移动文件之前写入
+        stage   {writes}                           要写进 Chroma 的全部记录，写库之前写入
+        commit  {txns}                             批量写库成功之后写入
+        rollback
+
+    进程中途退出后，下次启动时: 已 stage 未 commit 的事务重放写库；
+    只有 begin 的事务把文件移回原处。全部事务结束后日志清空。
+
+    写入者 (入库命令、常驻服务) 在整个运行期间用 lock_writer 独占日志文件: 同时启动的其他进程
+    拿不到锁，就不会把正在进行的入库当作中断来恢复，也不会清空日志；
+    没有拿到锁的进程不能开始事务，否则它的事务会被持锁进程清空日志时抹掉。
+    """
+
+    def __init__(self, path, fsync=JOURNAL_FSYNC):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        # 未结束的事务 id (包括上次运行遗留的)，为空时才能清空日志
+        self.open = set(self.pending())
+        self.file = open(path, "a", encoding="utf-8")
+        # 持有写入者锁的文件句柄 (与 self.file 分开，清空日志时重新打开 self.file 不会丢锁)
+        self.lock_file = None
+
+    def lock_writer(self):
+        """
+        以写入者身份独占日志 (fcntl.flock，进程退出时自动释放)，返回是否拿到
+        另一个进程正在入库时拿不到，此时不应恢复或清空日志
+        """
+        with self.lock:
+            if self.lock_file is None:
+                f = open(self.path, "a", encoding="utf-8")
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    f.close()
+                    return False
+                self.lock_file = f
+        return True
+
+    def _append(self, entry, durable=True):
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+            if durable and self.fsync:
+                os.fsync(self.file.fileno())
+
+    def begin(self, kind, src, dst, digest=None, category="Uncategorized"):
+        if not self.lock_writer():
+            raise RuntimeError("另一个进程正在入库，本进程不能写入入库日志")
+        txn = uuid.uuid4().hex[:12]
+        self.open.add(txn)
+        self._append({"op": "begin", "txn": txn, "kind": kind, "src": src, "dst": dst,
+                      "hash": digest, "category": category})
+        return txn
+
+    def stage(self, txn, writes):
+        self._append({"op": "stage", "txn": txn, "writes": encode_writes(writes)})
+
+    def commit(self, txns):
+        # commit 丢失只会导致一次幂等的重放，不需要强制落盘
+        if txns:
+            self._append({"op": "commit", "txns": list(txns)}, durable=False)
+            self.open.difference_update(txns)
+
+    def rollback(self, txn):
+        self._append({"op": "rollback", "txn": txn}, durable=False)
+        self.open.discard(txn)
+
+    def pending(self):
+        """
+        从日志文件读出所有未结束的事务: {txn: {"begin": {...}, "writes": 编码后的写入或 None}}，按开始顺序
+        写入内容用 decode_writes 还原
+        """
+        open_txns = {}
+        with self.lock:
+            if not os.path.exists(self.path):
+                return open_txns
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 最后一行可能只写了一半
+                        continue
+                    op = entry["op"]
+                    if op == "begin":
+                        open_txns[entry["txn"]] = {"begin": entry, "writes": None}
+                    elif op == "stage" and entry["txn"] in open_txns:
+                        open_txns[entry["txn"]]["writes"] = entry["writes"]
+                    elif op == "commit":
+                        for txn in entry["txns"]:
+                            open_txns.pop(txn, None)
+                    elif op == "rollback":
+                        open_txns.pop(entry["txn"], None)
+        return open_txns
+
+    def reset(self):
+        """
+        所有事务都已结束时清空日志；还有未结束的事务 (例如批量写库失败) 时保留
+        没有拿到写入者锁时不清空: 日志里可能有其他进程正在进行的事务
+        """
+        with self.lock:
+            if self.open or self.lock_file is None:
+                return False
+            self.file.close()
+            self.file = open(self.path, "w", encoding="utf-8")
+        return True
@@ -0,0 +1,155 @@
+# core/lexical_index.py
+import json
+import math
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+from .config import BM25_K1, BM25_B
+from .filters import where_to_sql
+from .text_utils import TOKEN_PATTERN
+
+
+# 词项规则的版本，规则变化后已有索引整体重建
+TERMS_VERSION = 2
+
+
+def _is_cjk(token):
+    return len(token) == 1 and "\u3040" <= token <= "\ufaff"
+
+
+def _is_math_symbol(token):
+    """∑ ∇ ≤ ∈ 这类数学符号 (Unicode Sm 类)；+ = < 这类 ASCII 运算符几乎每段都有，不收录"""
+    return len(token) == 1 and not token.isascii() and unicodedata.category(token) == "Sm"
+
+
+def index_terms(text):
+    """
+    建索引用的词项: 小写化，去掉纯标点，保留单个数学符号；中日韩文字额外加入相邻两字的二元组，
+    这样 "强化学习" 这样的词也能整体命中
+    """
+    tokens = [t.lower() for t in TOKEN_PATTERN.findall(text)]
+    terms = [t for t in tokens if t.isalnum() or _is_cjk(t) or _is_math_symbol(t)]
+    for a, b in zip(tokens, tokens[1:]):
+        if _is_cjk(a) and _is_cjk(b):
+            terms.append(a + b)
+    return terms
+
+
+class LexicalIndex:
+    """
+    本地 BM25 倒排索引 (SQLite 单文件，与 Chroma 数据放在一起)
+    每个 Chroma collection 对应一个命名空间，随 upsert 增量更新；查询完全在本地完成。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " collection TEXT, id TEXT, length INTEGER, document TEXT, metadata TEXT,"
+            " PRIMARY KEY (collection, id))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (collection TEXT, term TEXT, id TEXT, tf INTEGER)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_term ON postings(collection, term)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_doc ON postings(collection, id)")
+        # 按旧规则建的索引清空，打开 collection 时条数对不上会从 Chroma 重建
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < TERMS_VERSION:
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM docs")
+            self.conn.execute(f"PRAGMA user_version={TERMS_VERSION}")
+        self.conn.commit()
+
+    def count(self, collection):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM docs WHERE collection=?", (collection,)).fetchone()[0]
+
+    def _delete(self, collection, ids):
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            marks = ",".join("?" * len(part))
+            self.conn.execute(f"DELETE FROM postings WHERE collection=? AND id IN ({marks})", [collection] + part)
+            self.conn.execute(f"DELETE FROM docs WHERE collection=? AND id IN ({marks})", [collection] + part)
+
+    def upsert(self, collection, ids, documents, metadatas):
+        """增量写入: 同 id 的旧词项先删除再插入"""
+        ids = list(ids)
+        docs_rows, posting_rows = [], []
+        for doc_id, text, meta in zip(ids, documents, metadatas):
+            tf = Counter(index_terms(text or ""))
+            docs_rows.append((collection, doc_id, sum(tf.values()), text, json.dumps(meta, ensure_ascii=False)))
+            posting_rows.extend((collection, term, doc_id, n) for term, n in tf.items())
+        with self.lock:
+            self._delete(collection, ids)
+            self.conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?, ?)", docs_rows)
+            self.conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", posting_rows)
+            self.conn.commit()
+
+    def delete(self, collection, ids):
+        with self.lock:
+            self._delete(collection, list(ids))
+            self.conn.commit()
+
+    def update_metadata(self, collection, ids, metadatas):
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE docs SET metadata=? WHERE collection=? AND id=?",
+                [(json.dumps(m, ensure_ascii=False), collection, i) for i, m in zip(ids, metadatas)]
+            )
+            self.conn.commit()
+
+    def clear(self, collection):
+        with self.lock:
+            self.conn.execute("DELETE FROM postings WHERE collection=?", (collection,))
+            self.conn.execute("DELETE FROM docs WHERE collection=?", (collection,))
+            self.conn.commit()
+
+    def search(self, collection, query, n_results=10, where=None):
+        """
+        BM25 检索，返回按得分降序的 [(id, score, document, metadata), ...]
+        :param where: Chroma 风格的元数据过滤条件，只给满足条件的文档打分 (idf 仍按整个 collection 计算)
+        """
+        clause, where_params = where_to_sql(where) if where else ("1", [])
+        terms = Counter(index_terms(query))
+        if not terms:
+            return []
+        with self.lock:
+            n_docs, avg_len = self.conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM docs WHERE collection=?", (collection,)
+            ).fetchone()
+            if not n_docs:
+                return []
+            avg_len = avg_len or 1.0
+
+            scores = Counter()
+            for term, q_tf in terms.items():
+                rows = self.conn.execute(
+                    "SELECT p.id, p.tf, d.length FROM postings p JOIN docs d "
+                    "ON d.collection = p.collection AND d.id = p.id "
+                    f"WHERE p.collection=? AND p.term=? AND {clause}",
+                    [collection, term, *where_params]
+                ).fetchall()
+                if not rows:
+                    continue
+                df = len(rows) if not where else self.conn.execute(
+                    "SELECT COUNT(*) FROM postings WHERE collection=? AND term=?", (collection, term)
+                ).fetchone()[0]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf, length in rows:
+                    norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+                    scores[doc_id] += q_tf * idf * norm
+
+            top = scores.most_common(n_results)
+            results = []
+            for doc_id, score in top:
+                document, metadata = self.conn.execute(
+                    "SELECT document, metadata FROM docs WHERE collection=? AND id=?", (collection, doc_id)
+                ).fetchone()
+                results.append((doc_id, score, document, json.loads(metadata)))
+        return results
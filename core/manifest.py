@@ -0,0 +1,165 @@
+# core/manifest.py
+import json
+import os
+import threading
+
+from .config import MANIFEST_PATH, LIBRARY_ROOT
+from .embedding_cache import sha256_file
+
+# 文件状态
+UNCHANGED = "unchanged"   # 路径、大小、修改时间都没变，直接跳过
+NEW = "new"               # 从未入库
+MODIFIED = "modified"     # 同一路径但内容变了，需要重新向量化
+RENAMED = "renamed"       # 内容已入库，只是换了路径，改元数据即可
+DUPLICATE = "duplicate"   # 内容与另一个仍然存在的文件完全相同
+
+
+class IngestManifest:
+    """
+    本地入库清单: 绝对路径 -> {kind, size, mtime, hash, category}
+    每次运行只加载一次，文件是否需要处理都在内存里判断，不再逐个查询 Chroma。
+    大小和修改时间都没变时直接判定为未变化，连哈希都不用算。
+    被判定为近似重复而跳过的图片记为 {kind, size, mtime, hash, duplicate_of}，它们没有入库，
+    不参与按哈希查找；原图还在时再次遇到直接判定为重复，不再重新计算 CLIP 向量。
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.files = json.load(f).get("files", {})
+            except (OSError, ValueError) as e:
+                print(f"[警告] 入库清单读取失败，将重新建立: {e}")
+        self.by_hash = {entry["hash"]: p for p, entry in self.files.items()
+                        if entry.get("hash") and "duplicate_of" not in entry}
+        # 本次运行中已判定为需要入库、但还没写库的内容，防止同一内容的两个文件被重复处理
+        self.pending = {}
+        self.dirty = False
+
+    @staticmethod
+    def doc_id(digest):
+        """由内容哈希得到的文档 id，用作 Chroma 记录 id 的前缀"""
+        return digest[:16]
+
+    def check(self, path, near_duplicates=True):
+        """
+        判断文件状态，返回 (状态, 内容哈希, 相关路径)
+        相关路径: MODIFIED 时为自身，RENAMED / DUPLICATE 时为清单里内容相同的旧路径 (近似重复时为原图)
+        :param near_duplicates: 为 False 时 (关闭了近似重复检测) 忽略之前的近似重复记录
+        """
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        with self.lock:
+            entry = self.files.get(key)
+            if entry and "duplicate_of" in entry:
+                if not near_duplicates or not os.path.exists(entry["duplicate_of"]):
+                    # 原图已不在，按新文件重新判断
+                    del self.files[key]
+                    self.dirty = True
+                    entry = None
+                elif entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+                    return DUPLICATE, entry["hash"], entry["duplicate_of"]
+            if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+                return UNCHANGED, entry["hash"], key
+
+        digest = sha256_file(key)
+        with self.lock:
+            if entry and "duplicate_of" in entry:
+                if entry["hash"] == digest:
+                    entry["mtime"] = st.st_mtime
+                    self.dirty = True
+                    return DUPLICATE, digest, entry["duplicate_of"]
+                # 内容变了: 这个文件从未入库，按新文件处理
+                del self.files[key]
+                self.dirty = True
+                entry = None
+            if entry:
+                if entry["hash"] == digest:
+                    # 只是被 touch 过，内容没变
+                    entry["mtime"] = st.st_mtime
+                    self.dirty = True
+                    return UNCHANGED, digest, key
+                self.pending[digest] = key
+                return MODIFIED, digest, key
+
+            old_path = self.by_hash.get(digest)
+            if old_path and old_path != key:
+                if os.path.exists(old_path):
+                    return DUPLICATE, digest, old_path
+                return RENAMED, digest, old_path
+            if digest in self.pending:
+                return DUPLICATE, digest, self.pending[digest]
+            self.pending[digest] = key
+        return NEW, digest, key
+
+    def get(self, path):
+        with self.lock:
+            return self.files.get(os.path.abspath(path))
+
+    def record(self, path, kind, digest, category, old_path=None):
+        """文件入库 (或改名) 完成后记录最终路径；old_path 为移动前的路径"""
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        with self.lock:
+            for stale in (old_path, key):
+                if stale:
+                    entry = self.files.pop(os.path.abspath(stale), None)
+                    if entry and self.by_hash.get(entry["hash"]) == os.path.abspath(stale):
+                        self.by_hash.pop(entry["hash"], None)
+            self.files[key] = {
+                "kind": kind, "size": st.st_size, "mtime": st.st_mtime,
+                "hash": digest, "category": category,
+            }
+            self.by_hash[digest] = key
+            self.dirty = True
+
+    def record_duplicate(self, path, kind, digest, duplicate_of):
+        """近似重复而跳过的文件: 记下哈希和原图路径，之后的扫描直接跳过"""
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        with self.lock:
+            self.files[key] = {
+                "kind": kind, "size": st.st_size, "mtime": st.st_mtime,
+                "hash": digest, "duplicate_of": os.path.abspath(duplicate_of),
+            }
+            if self.pending.get(digest) == key:
+                del self.pending[digest]
+            self.dirty = True
+
+    def snapshot_entries(self, doc_ids, root=LIBRARY_ROOT):
+        """
+        导出快照用: 内容 (doc_id) 在 doc_ids 中的已入库文件的记录，路径改为相对资料库根目录，
+        新机器上资料库放在别处也能对上
+        """
+        with self.lock:
+            return {os.path.relpath(p, root): dict(entry) for p, entry in self.files.items()
+                    if "duplicate_of" not in entry and self.doc_id(entry["hash"]) in doc_ids}
+
+    def restore(self, entries, root=LIBRARY_ROOT):
+        """导入快照时合并清单记录，返回合并的条数；本机清单里已有的路径或内容不覆盖"""
+        restored = 0
+        with self.lock:
+            for rel, entry in entries.items():
+                key = os.path.abspath(os.path.join(root, rel))
+                if key in self.files or entry["hash"] in self.by_hash:
+                    continue
+                self.files[key] = entry
+                self.by_hash[entry["hash"]] = key
+                restored += 1
+            self.dirty = self.dirty or restored > 0
+        return restored
+
+    def save(self):
+        """原子写入: 先写临时文件再替换，中途崩溃不会留下半个清单"""
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "files": self.files}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self.dirty = False
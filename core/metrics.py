@@ -0,0 +1,145 @@
+# core/metrics.py
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Metrics:
+    """
+    轻量级埋点: 进程内汇总，不依赖第三方库
+    - 阶段耗时 (span): 每个阶段的调用次数、总耗时、最长一次；
+      在 file() 上下文里发生的 span 同时计入该文件，便于找出慢文件慢在哪一步
+    - 计数器 (incr): 调用次数、发送字节数、重试次数、缓存命中等
+    开销只有一次 perf_counter 和一次加锁，默认一直开启；--profile 时打印汇总表。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}    # stage -> [次数, 总秒数, 最长秒数]
+            self.counters = {}
+            self.files = {}     # 文件名 -> {stage: 秒数}
+            self.started = time.perf_counter()
+
+    @contextmanager
+    def file(self, name):
+        """之后本线程里的 span 都记在这个文件名下"""
+        previous = getattr(self.local, "file", None)
+        self.local.file = name
+        try:
+            yield
+        finally:
+            self.local.file = previous
+
+    @contextmanager
+    def span(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def traced(self, stage):
+        """装饰器版本的 span"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, stage, seconds):
+        current = getattr(self.local, "file", None)
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            if current is not None:
+                per_file = self.files.setdefault(current, {})
+                per_file[stage] = per_file.get(stage, 0.0) + seconds
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # 输出
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "wall_seconds": round(time.perf_counter() - self.started, 6),
+                "stages": {
+                    stage: {"count": n, "total_s": round(total, 6), "mean_ms": round(total / n * 1000, 3),
+                            "max_ms": round(longest * 1000, 3)}
+                    for stage, (n, total, longest) in self.stages.items()
+                },
+                "counters": dict(self.counters),
+                "files": {name: {k: round(v, 6) for k, v in stages.items()} for name, stages in self.files.items()},
+            }
+
+    def summary(self, top_files=10):
+        """--profile 打印的汇总表"""
+        snap = self.snapshot()
+        wall = snap["wall_seconds"] or 1e-9
+        lines = [f"\n--- 性能剖析 (总耗时 {wall:.2f}s)",
+                 f"{'阶段':<22} {'次数':>7} {'总耗时(s)':>10} {'平均(ms)':>10} {'最长(ms)':>10} {'占比':>6}"]
+        for stage, s in sorted(snap["stages"].items(), key=lambda kv: -kv[1]["total_s"]):
+            lines.append(f"{stage:<22} {s['count']:>7} {s['total_s']:>10.3f} {s['mean_ms']:>10.1f} "
+                         f"{s['max_ms']:>10.1f} {s['total_s'] / wall:>6.0%}")
+        if snap["counters"]:
+            lines.append(f"\n{'计数':<28} {'值':>12}")
+            for name, value in sorted(snap["counters"].items()):
+                lines.append(f"{name:<28} {value:>12}")
+        if snap["files"]:
+            # 阶段之间可能嵌套或并发，这里的合计只用于排序
+            slowest = sorted(snap["files"].items(), key=lambda kv: -sum(kv[1].values()))[:top_files]
+            lines.append(f"\n最慢的 {len(slowest)} 个文件 (耗时最多的阶段)")
+            for name, stages in slowest:
+                stage, seconds = max(stages.items(), key=lambda kv: kv[1])
+                lines.append(f"  {name:<40} {stage} {seconds:.2f}s")
+        return "\n".join(lines)
+
+    def to_prometheus(self, prefix="kb"):
+        """Prometheus textfile 格式 (node_exporter textfile collector)"""
+        snap = self.snapshot()
+
+        def esc(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total 各阶段累计耗时",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{esc(k)}"}} {v["total_s"]}' for k, v in snap["stages"].items()]
+        lines += [f"# HELP {prefix}_stage_calls_total 各阶段调用次数", f"# TYPE {prefix}_stage_calls_total counter"]
+        lines += [f'{prefix}_stage_calls_total{{stage="{esc(k)}"}} {v["count"]}' for k, v in snap["stages"].items()]
+        lines += [f"# HELP {prefix}_stage_seconds_max 各阶段最长一次耗时", f"# TYPE {prefix}_stage_seconds_max gauge"]
+        lines += [f'{prefix}_stage_seconds_max{{stage="{esc(k)}"}} {v["max_ms"] / 1000}' for k, v in snap["stages"].items()]
+        lines += [f"# HELP {prefix}_events_total 计数器", f"# TYPE {prefix}_events_total counter"]
+        lines += [f'{prefix}_events_total{{name="{esc(k)}"}} {v}' for k, v in snap["counters"].items()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """按扩展名写出: .prom 为 Prometheus textfile，其余为 JSON；先写临时文件再替换，避免采集到半个文件"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+# 进程内唯一的埋点实例
+METRICS = Metrics()
@@ -0,0 +1,216 @@
+# core/migration.py
+import os
+
+from .ai_handler import AIHandler
+from .config import EMBEDDING_PROVIDER, MIGRATION_BATCH_SIZE, MIGRATION_REQUESTS_PER_MINUTE
+from .embedding_provider import create_provider, TokenBucket
+from .metrics import METRICS
+
+
+def _shadow_name(db, logical):
+    """影子 collection 名: 逻辑库名_v序号，跳过正在使用或等待删除的名字"""
+    used = set(db.collections) | set(db.registry.retired) | {e["name"] for e in db.registry.collections.values()}
+    n = 2
+    while f"{logical}_v{n}" in used:
+        n += 1
+    return f"{logical}_v{n}"
+
+
+def _target_handler(ai, space, model):
+    """按新模型计算向量的 AIHandler，与 ai 共用向量缓存 (缓存按模型区分)"""
+    if space == "text":
+        target = AIHandler(embedding_provider=create_provider(EMBEDDING_PROVIDER, model))
+        # 迁移单独限速，给同时进行的检索留出配额
+        target.embedder.bucket = TokenBucket(MIGRATION_REQUESTS_PER_MINUTE / 60.0)
+    else:
+        target = AIHandler(clip_model_path=model)
+    target.cache = ai.cache
+    return target
+
+
+def _copy(db, target, space, shadow_name, page, skipped):
+    """
+    用新模型重新计算一页记录的向量并写入影子库，返回写入的条数
+    文本向量按库里存的文档计算；视觉向量按 metadata 里的 path 重新读图，文件已不存在或读取失败的记入 skipped
+    """
+    ids, metadatas = page['ids'], page['metadatas']
+    documents = page.get('documents') or [None] * len(ids)
+    if space == "text":
+        keep = list(range(len(ids)))
+        vectors = target.get_text_embeddings_batch([d or "" for d in documents])
+    else:
+        paths = [m.get("path") for m in metadatas]
+        found = [k for k, p in enumerate(paths) if p and os.path.exists(p)]
+        vectors = target.get_clip_embeddings_batch([paths[k] for k in found])
+        # 读取失败的图片对应行全为 0
+        ok = [j for j in range(len(found)) if vectors[j].any()]
+        keep, vectors = [found[j] for j in ok], vectors[ok]
+    skipped.update(ids[k] for k in set(range(len(ids))) - set(keep))
+    if keep:
+        db.write_now([{
+            "collection": shadow_name,
+            "ids": [ids[k] for k in keep],
+            "embeddings": vectors,
+            "metadatas": [metadatas[k] for k in keep],
+            "documents": [documents[k] for k in keep] if space == "text" else None,
+        }])
+    return len(keep)
+
+
+def _all_ids(collection, page_size):
+    ids = []
+    for offset in range(0, collection.count(), page_size):
+        ids.extend(collection.get(include=[], limit=page_size, offset=offset)['ids'])
+    return ids
+
+
+def _sync_page(db, target, space, page, shadow, skipped):
+    """
+    把当前库的一页记录同步到影子库: 影子库里没有或文档变了的重新计算向量，只有元数据变了的同步元数据。
+    返回处理的条数
+    """
+    have = shadow.get(ids=page['ids'], include=["documents", "metadatas"])
+    have_docs = have.get('documents') or [None] * len(have['ids'])
+    old = {i: (d, m) for i, d, m in zip(have['ids'], have_docs, have['metadatas'])}
+
+    documents = page.get('documents') or [None] * len(page['ids'])
+    redo, meta_ids, meta_values = [], [], []
+    for k, (i, d, m) in enumerate(zip(page['ids'], documents, page['metadatas'])):
+        if i not in old:
+            if i not in skipped:
+                redo.append(k)
+        elif old[i][0] != d:
+            redo.append(k)
+        elif old[i][1] != m:
+            meta_ids.append(i)
+            meta_values.append(m)
+    handled = 0
+    if redo:
+        subset = {"ids": [page['ids'][k] for k in redo], "documents": [documents[k] for k in redo],
+                  "metadatas": [page['metadatas'][k] for k in redo]}
+        handled += _copy(db, target, space, shadow.name, subset, skipped)
+    if meta_ids:
+        shadow.update(ids=meta_ids, metadatas=meta_values)
+        if space == "text":
+            db.lexicon.update_metadata(shadow.name, meta_ids, meta_values)
+        handled += len(meta_ids)
+    return handled
+
+
+def _delete_from_shadow(db, shadow, ids):
+    if ids:
+        shadow.delete(ids=ids)
+        db.lexicon.delete(shadow.name, ids)
+
+
+def _reconcile(db, target, space, live, shadow, skipped, batch_size):
+    """
+    全量核对 (不加锁): 让影子库追上复制阶段里当前库的增删改，返回处理的条数
+    逐页比较两边的文档和元数据，当前库里已删除的记录从影子库删除
+    """
+    handled = 0
+    live_ids = set()
+    for offset in range(0, live.count(), batch_size):
+        page = live.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if not page['ids']:
+            break
+        live_ids.update(page['ids'])
+        handled += _sync_page(db, target, space, page, shadow, skipped)
+
+    stale = [i for i in _all_ids(shadow, batch_size) if i not in live_ids]
+    _delete_from_shadow(db, shadow, stale)
+    return handled + len(stale)
+
+
+def _reconcile_changed(db, target, space, live, shadow, changed, skipped, batch_size):
+    """
+    增量核对 (切换前在写锁内): 只处理全量核对开始后被改动过的 id，耗时与改动量成正比而不是与库的大小
+    还在当前库里的按 _sync_page 同步 (被重新写入的图片再尝试一次)，已删除的从影子库删除
+    """
+    handled = 0
+    changed = list(changed)
+    for start in range(0, len(changed), batch_size):
+        ids = changed[start:start + batch_size]
+        skipped.difference_update(ids)
+        page = live.get(ids=ids, include=["documents", "metadatas"])
+        if page['ids']:
+            handled += _sync_page(db, target, space, page, shadow, skipped)
+        gone = sorted(set(ids) - set(page['ids']))
+        _delete_from_shadow(db, shadow, gone)
+        handled += len(gone)
+    return handled
+
+
+@METRICS.traced("migrate.embeddings")
+def migrate_embeddings(ai, db, space, model, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    用新模型重新计算一个向量空间的全部向量，完成后原子切换，返回 {逻辑库: 条数}
+    - text: 论文库和图片描述库；clip: 视觉库
+    - 新向量先写入影子 collection，每批完成后记录进度，中断后再次运行同一命令从断点继续
+    - 复制期间检索照常使用旧库；复制完成后补上期间的增删改，写锁内只核对最后这段时间改动过的记录，
+      再切换逻辑库并删除旧库
+    - 只能看到本进程的写入: 调用方需持有入库日志的写入者锁 (见 IngestJournal.lock_writer)，其他进程此时不能写库
+    :param ai: 当前使用的 AIHandler，切换后改用新模型
+    """
+    registry = db.registry
+    if not db.migration_lock.acquire(blocking=False):
+        raise RuntimeError("已有重新向量化在进行")
+    try:
+        pending = registry.migration
+        if pending and (pending["space"], pending["model"]) != (space, model):
+            if pending["space"] != space:
+                raise ValueError(f"{pending['space']} 向量的迁移 ({pending['model']}) 尚未完成，请先运行完它")
+            print(f"放弃未完成的迁移: {pending['model']}")
+            registry.cancel_migration()
+            db.drop_retired()
+            pending = None
+        if pending:
+            print(f"继续上次未完成的迁移: {model}")
+        else:
+            if model == registry.model(space):
+                raise ValueError(f"{space} 向量已经由 {model} 生成")
+            registry.start_migration(space, model, {
+                logical: _shadow_name(db, logical) for logical in registry.logical_in(space)
+            })
+
+        target = _target_handler(ai, space, model)
+        shadows = registry.migration["shadows"]
+        skipped = set()
+        for logical, shadow_name in shadows.items():
+            live, shadow = db.logical[logical], db.open_collection(shadow_name)
+            offset = registry.migration["offsets"].get(logical, 0)
+            total = live.count()
+            print(f"{logical}: 共 {total} 条，从第 {offset} 条开始用 {model} 重新计算向量")
+            while True:
+                with METRICS.span("migrate.batch"):
+                    page = live.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+                    if not page['ids']:
+                        break
+                    _copy(db, target, space, shadow_name, page, skipped)
+                offset += len(page['ids'])
+                registry.record_offset(logical, offset)
+                print(f"  {logical}: {min(offset, total)}/{total}")
+
+        # 复制期间的新增、修改和删除: 先不加锁全量核对，追上大部分差异；
+        # 从核对开始记录当前库被改动的 id，切换前在写锁内只核对这些 id
+        live_names = [db.logical[logical].name for logical in shadows]
+        db.track_changes(live_names)
+        try:
+            for logical, shadow_name in shadows.items():
+                _reconcile(db, target, space, db.logical[logical], db.collections[shadow_name], skipped, batch_size)
+            with db.write_lock:
+                for logical, shadow_name in shadows.items():
+                    live = db.logical[logical]
+                    _reconcile_changed(db, target, space, live, db.collections[shadow_name],
+                                       db.take_changes(live.name), skipped, batch_size)
+                dims = {logical: db.vector_dim(db.collections[name]) for logical, name in shadows.items()}
+                counts = {logical: db.collections[name].count() for logical, name in shadows.items()}
+                db.promote_shadows(dims)
+                ai.use_models(**{space: model})
+        finally:
+            db.stop_tracking(live_names)
+        if skipped:
+            print(f"[提示] {len(skipped)} 张图片的文件已不存在或无法读取，未写入新库")
+        return counts
+    finally:
+        db.migration_lock.release()
@@ -0,0 +1,584 @@
+# core/pipeline.py
+import os
+import queue
+import shutil
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .config import (
+    CLIP_BATCH_SIZE, EMBED_BATCH_SIZE, INGEST_CPU_WORKERS, INGEST_IO_WORKERS, INGEST_QUEUE_SIZE,
+    WRITE_FLUSH_SECONDS, DEDUP_ENABLED, IMAGE_STRUCTURED_OUTPUT, PAPERS_ROOT, IMAGES_ROOT,
+)
+from .dedup import perceptual_hash
+from .classifier import match_topic, parse_topics
+from .file_handler import PdfPagePool, iter_pdf_chunks, category_target, move_file_to_category
+from .journal import decode_writes
+from .manifest import UNCHANGED, NEW, MODIFIED, RENAMED, DUPLICATE
+from .metrics import METRICS
+
+PDF_EXTS = ['.pdf']
+IMG_EXTS = ['.jpg', '.jpeg', '.png', '.bmp', '.webp']
+
+# 队列结束标记
+_DONE = object()
+
+
+def new_task(kind, path):
+    """一次入库任务: kind 为 'paper' 或 'image'，后续各阶段往里填结果"""
+    return {"kind": kind, "path": path, "filename": os.path.basename(path), "category": "Uncategorized"}
+
+
+def is_legacy_ingested(db, path, kind):
+    """
+    清单出现之前按文件名入库的旧记录是否就是这个文件: 记录的 path 与文件路径相同，
+    或者是它的归档位置 (papers/类别/文件名) 而那里已经没有文件 (被移回了别处)。
+    只是同名的其他文件不算，按新文件入库。
+    """
+    here = os.path.abspath(path)
+    for meta in db.legacy_records(kind, os.path.basename(path)):
+        stored = meta.get("path")
+        if not stored:
+            continue
+        stored = os.path.abspath(stored)
+        if stored == here:
+            return True
+        root = PAPERS_ROOT if kind == "paper" else IMAGES_ROOT
+        archived = os.path.abspath(os.path.join(root, meta.get("category", ""), os.path.basename(path)))
+        if stored == archived and not os.path.exists(stored):
+            return True
+    return False
+
+
+def plan_task(db, manifest, path, kind, dedup=True):
+    """
+    入库前按清单检查文件，返回 (task, 状态)，不需要处理时 task 为 None
+    - 未变化 / 与已有文件内容重复 / 之前判定过的近似重复图片 (dedup 为 False 时不算): 跳过
+    - 改名或移动: 只更新库里的路径，不重新向量化
+    - 新文件 / 内容变化: 生成任务，记录 doc_id 与需要替换的旧文档
+    """
+    try:
+        status, digest, related = manifest.check(path, near_duplicates=dedup)
+    except OSError as e:
+        print(f"   [跳过] {os.path.basename(path)}: 无法读取 {e}")
+        return None, None
+
+    if status in (UNCHANGED, DUPLICATE):
+        return None, status
+
+    if status == RENAMED:
+        entry = manifest.get(related)
+        db.update_document_path(kind, manifest.doc_id(digest), path)
+        manifest.record(path, kind, digest, entry["category"], old_path=related)
+        print(f"   [改名] {os.path.basename(related)} -> {path}")
+        return None, status
+
+    if status == NEW and is_legacy_ingested(db, path, kind):
+        # 清单出现之前入库的就是这个文件: 跳过，但不记入清单 (清单只记录确实按内容哈希入库的文件)
+        return None, UNCHANGED
+
+    task = new_task(kind, path)
+    task["hash"] = digest
+    task["doc_id"] = manifest.doc_id(digest)
+    if status == MODIFIED:
+        task["replaces"] = manifest.doc_id(manifest.get(path)["hash"])
+    return task, status
+
+
+def classification_meta(task):
+    """分类方式与本地分类器的置信度，随记录一起存入元数据"""
+    meta = {}
+    if task.get("classified_by"):
+        meta["classified_by"] = task["classified_by"]
+    if task.get("confidence") is not None:
+        meta["category_confidence"] = round(task["confidence"], 4)
+    return meta
+
+
+def classify_locally(task, classify, kind):
+    """
+    先用本地分类器判断，返回是否已经确定类别 (确定时不再调用 LLM)
+    本地分类出错时按置信度不够处理
+    """
+    task["local_attempted"] = True
+    try:
+        category, confidence = classify()
+    except Exception as e:
+        print(f"   [警告] {task['filename']} 本地分类失败，改用 LLM: {e}")
+        category, confidence = None, None
+    task["confidence"] = confidence
+    if category:
+        task["category"], task["classified_by"] = category, kind
+        METRICS.incr("classify.local")
+        return True
+    METRICS.incr("classify.llm_fallback")
+    return False
+
+
+# 论文各阶段
+
+@METRICS.traced("paper.extract")
+def extract_paper(task, ai=None, embed_pool=None, pdf_pool=None):
+    """
+    [CPU] 流式读取 PDF 并切片
+    :param pdf_pool: 页面提取进程池 (PdfPagePool)，为空时串行提取
+    传入 embed_pool 时，每攒够一批切片就立刻提交向量化，提取后面的页面与前面切片的
+    向量化同时进行；结果在 embed_paper 中收集
+    """
+    chunks = []
+    futures = []
+    batch = []
+    for chunk in iter_pdf_chunks(task["path"], doc_id=task.get("doc_id"), pool=pdf_pool):
+        chunks.append(chunk)
+        if embed_pool is None:
+            continue
+        batch.append(chunk['text'])
+        if len(batch) >= EMBED_BATCH_SIZE:
+            futures.append(embed_pool.submit(ai.get_text_embeddings_batch, batch))
+            batch = []
+    if embed_pool is not None and batch:
+        futures.append(embed_pool.submit(ai.get_text_embeddings_batch, batch))
+
+    task["chunks"] = chunks
+    if embed_pool is not None:
+        task["embedding_futures"] = futures
+    return task
+
+
+@METRICS.traced("paper.embed")
+def embed_paper(ai, task):
+    """[I/O] 批量生成切片向量 (如果提取阶段已经提交过，则只收集结果)"""
+    futures = task.pop("embedding_futures", None)
+    if futures is not None:
+        task["embeddings"] = np.concatenate([future.result() for future in futures])
+    else:
+        task["embeddings"] = ai.get_text_embeddings_batch([c['text'] for c in task["chunks"]])
+    return task
+
+
+@METRICS.traced("paper.classify")
+def classify_paper(ai, task, topics, classifier=None):
+    """
+    [I/O] 论文分类: 传入本地分类器时先按已入库论文的类别质心判断，
+    置信度不够再让 Gemini 阅读摘要；都失败时保留 Uncategorized
+    """
+    if classifier is not None and classify_locally(
+            task, lambda: classifier.classify_paper(task["embeddings"], topics), "centroid"):
+        return task
+    first_page_text = task["chunks"][0]['text'][:1000]
+    prompt = f"请阅读以下论文摘要，并从这些类别中选择最合适的一个：[{topics}]。只返回类别名称，不要标点符号。\n\n摘要：{first_page_text}"
+    try:
+        task["category"] = match_topic(ai.chat_with_gemini(prompt), topics)
+        task["classified_by"] = "llm"
+    except Exception as e:
+        print(f"   [警告] {task['filename']} 分类失败: {e}")
+    return task
+
+
+# 图片各阶段
+
+@METRICS.traced("image.clip")
+def embed_images(ai, tasks, batch_size=CLIP_BATCH_SIZE):
+    """[CPU] 批量计算 CLIP 向量，失败的图片标记 error"""
+    matrix = ai.get_clip_embeddings_batch([t["path"] for t in tasks], batch_size=batch_size)
+    for task, row in zip(tasks, matrix):
+        if row.any():
+            task["clip_vec"] = row
+        else:
+            task["error"] = "CLIP处理失败"
+    return tasks
+
+
+@METRICS.traced("image.dedup")
+def check_duplicate(ai, db, task):
+    """
+    [CPU] 近似重复检测: 感知哈希预筛 + CLIP 复核
+    重复时在 task 里记下 duplicate_of (原图路径)，后续的 Gemini 描述与分类都不再调用；
+    不重复时登记到索引，同一批后面到达的同一张图 (换了格式或分辨率) 会被识别出来。
+    哈希从 Gemini 载荷 (已缩小的 JPEG) 计算，载荷在 CLIP 阶段已生成并缓存，描述阶段直接复用。
+    """
+    payload = ai.image_payload(task["path"], task.get("hash"))
+    task["phash"] = perceptual_hash(payload["data"])
+    record_id = db.image_record_id(task["path"], task.get("doc_id"))
+    exclude = {db.image_record_id(task["path"], task["replaces"])} if task.get("replaces") else ()
+    original, similarity = db.find_near_duplicate(task["phash"], task["clip_vec"], exclude, record_id=record_id)
+    if original:
+        task["duplicate_of"] = original
+        task["similarity"] = similarity
+    else:
+        db.near_duplicates.add(record_id, task["phash"], task["path"], task["clip_vec"])
+    return task
+
+
+def forget_pending_image(db, task):
+    """没能入库的图片从近似重复索引里去掉，之后再遇到同一张图 (例如重试) 不会被当作它的重复"""
+    if task.get("phash") is not None and "duplicate_of" not in task:
+        db.near_duplicates.discard([db.image_record_id(task["path"], task.get("doc_id"))])
+
+
+@METRICS.traced("image.describe")
+def describe_image(ai, task):
+    """[I/O] 让 Gemini 看图说话，失败直接抛出；记录原图与实际上传的字节数"""
+    payload = ai.image_payload(task["path"], task.get("hash"))
+    task["image_bytes"] = payload["original_bytes"]
+    task["payload_bytes"] = len(payload["data"])
+    task["desc"] = ai.get_image_description(task["path"], payload=payload)
+    return task
+
+
+@METRICS.traced("image.classify")
+def classify_image(ai, task, topics, classifier=None):
+    """
+    [I/O] 图片分类: 传入本地分类器时先做 CLIP 零样本分类，
+    置信度不够再让 Gemini 基于描述分类；都失败时保留 Uncategorized
+    """
+    if classifier is not None and classify_locally(
+            task, lambda: classifier.classify_image(task["clip_vec"], topics), "clip"):
+        return task
+    classify_prompt = (
+        f"基于以下图片描述，将图片归类为[{topics}]中的一项。\n"
+        f"只返回类别名称，不要标点符号。\n\n"
+        f"图片描述：{task['desc']}"
+    )
+    try:
+        task["category"] = match_topic(ai.chat_with_gemini(classify_prompt), topics)
+        task["classified_by"] = "llm"
+    except Exception as e:
+        print(f"   [警告] {task['filename']} 分类失败: {e}")
+    return task
+
+
+@METRICS.traced("image.analyze")
+def analyze_image(ai, task, topics, classifier=None):
+    """
+    [I/O] 一次结构化请求同时完成看图说话、分类和 OCR，代替 describe_image + classify_image 两次请求
+    输出不是合法 JSON 或类别不在候选中时，退回分两次请求 (此时才会用到本地分类器)；
+    其他错误 (网络、限流) 直接抛出
+    """
+    payload = ai.image_payload(task["path"], task.get("hash"))
+    task["image_bytes"] = payload["original_bytes"]
+    task["payload_bytes"] = len(payload["data"])
+    try:
+        result = ai.analyze_image(task["path"], parse_topics(topics), payload=payload)
+    except ValueError as e:
+        METRICS.incr("gemini.analyze_image.invalid")
+        print(f"   [警告] {task['filename']} 结构化输出无效，改为分别请求描述与分类: {e}")
+        task["desc"] = ai.get_image_description(task["path"], payload=payload)
+        return classify_image(ai, task, topics, classifier)
+    task["desc"] = result["description"]
+    task["ocr_text"] = result["ocr_text"]
+    task["category"] = result["category"]
+    task["classified_by"] = "llm"
+    task["structured"] = True
+    return task
+
+
+def image_document(task):
+    """图片在描述库里的文本: 描述 + OCR 文字，向量与关键词索引都基于它"""
+    if task.get("ocr_text"):
+        return f"{task['desc']}\n{task['ocr_text']}"
+    return task["desc"]
+
+
+@METRICS.traced("image.embed_desc")
+def embed_image_desc(ai, task, coalesce=True):
+    """
+    [I/O] 图片描述向量化，失败时抛出
+    :param coalesce: 与其他线程同时到达的描述合成一次请求 (流水线里使用；单张入库时没有可合并的请求)
+    """
+    task["gemini_vec"] = ai.get_gemini_embedding(image_document(task), coalesce=coalesce)
+    if len(task["gemini_vec"]) == 0:
+        raise RuntimeError("描述向量化失败")
+    return task
+
+
+# 写入阶段
+
+@METRICS.traced("commit")
+def commit_task(db, task, manifest=None):
+    """
+    [单线程] 先移动文件，再用移动后的路径入库，写库成功后更新清单
+    同一个文件的移动一定发生在写库之前，保证库里记录的是最新路径。
+    移动前在入库日志里记下源路径和目标路径，写库前记下全部写入内容，
+    进程中途退出时下次启动可以重放或回滚 (见 recover_journal)。
+    db 处于 begin_batch 状态时写库会被缓冲，清单在批量写库成功后才更新。
+    """
+    old_path = task["path"]
+    target = category_target(old_path, task["category"], file_type=task["kind"])
+    txn = db.journal.begin(task["kind"], old_path, target, task.get("hash"), task["category"])
+
+    new_path = move_file_to_category(old_path, task["category"], file_type=task["kind"], target=target)
+    if new_path != target:
+        # 移动失败，文件留在原处
+        db.journal.rollback(txn)
+        txn = None
+    task["path"] = new_path
+
+    # 内容变化的文件: 先删掉旧版本的全部记录
+    if task.get("replaces"):
+        db.delete_document(task["kind"], task["replaces"])
+
+    def on_commit():
+        if manifest is not None and task.get("hash"):
+            manifest.record(task["path"], task["kind"], task["hash"], task["category"], old_path=old_path)
+
+    if task["kind"] == "paper":
+        db.add_paper_chunks(task["chunks"], task["embeddings"], moved_path=task["path"],
+                            category=task["category"], doc_id=task.get("doc_id"),
+                            txn=txn, on_commit=on_commit, extra_meta=classification_meta(task))
+    else:
+        db.add_image(task["path"], task["clip_vec"], task["desc"], task["gemini_vec"],
+                     category=task["category"], doc_id=task.get("doc_id"),
+                     txn=txn, on_commit=on_commit, phash=task.get("phash"),
+                     extra_meta=classification_meta(task), ocr_text=task.get("ocr_text"))
+    return task
+
+
+def recover_journal(db, manifest):
+    """
+    处理上次中断的入库事务:
+    - 写入内容已记入日志但没确认写库: 重放写库并更新清单
+    - 只移动了文件、还没记下写入内容: 把文件移回原处，下次入库时重新处理
+    """
+    pending = db.journal.pending()
+    replayed, rolled_back = [], []
+    for txn, entry in pending.items():
+        begin = entry["begin"]
+        if entry["writes"] is not None:
+            db.write_now(decode_writes(entry["writes"]))
+            if begin.get("hash") and os.path.exists(begin["dst"]):
+                manifest.record(begin["dst"], begin["kind"], begin["hash"], begin["category"], old_path=begin["src"])
+            replayed.append(txn)
+        else:
+            src, dst = begin["src"], begin["dst"]
+            if os.path.abspath(src) != os.path.abspath(dst) and os.path.exists(dst) and not os.path.exists(src):
+                os.makedirs(os.path.dirname(os.path.abspath(src)), exist_ok=True)
+                shutil.move(dst, src)
+            rolled_back.append(txn)
+
+    if pending:
+        # 清单先落盘，再在日志里结束这些事务
+        manifest.save()
+        db.journal.commit(replayed)
+        for txn in rolled_back:
+            db.journal.rollback(txn)
+        print(f"[恢复] 上次入库中断: 重放写库 {len(replayed)} 个，回滚移动 {len(rolled_back)} 个")
+    db.journal.reset()
+    return len(replayed), len(rolled_back)
+
+
+class IngestPipeline:
+    """
+    分阶段并发入库流水线，阶段之间用有界队列连接:
+
+        PDF 解析 (CPU 线程池) ──┐
+                                ├─> Gemini 调用 (I/O 线程池) ──> 移动文件 + 写库 (单线程)
+        CLIP 批量推理 (CPU) ────┘
+
+    CPU 阶段和网络阶段互相重叠，写库阶段只有一个线程，DatabaseHandler 不会被并发写入。
+    CLIP 之后紧接着做近似重复检测 (dedup=True 时)，重复的图片不进入 Gemini 阶段。
+    """
+
+    def __init__(self, ai, db, paper_topics, image_topics,
+                 cpu_workers=INGEST_CPU_WORKERS, io_workers=INGEST_IO_WORKERS,
+                 clip_batch_size=CLIP_BATCH_SIZE, queue_size=INGEST_QUEUE_SIZE, manifest=None,
+                 dedup=DEDUP_ENABLED, classifier=None, structured=IMAGE_STRUCTURED_OUTPUT):
+        """
+        :param classifier: 本地分类器 (core.classifier.LocalClassifier)，为空时每个文件都用 LLM 分类
+        :param structured: 图片的描述、分类、OCR 合成一次结构化请求 (此时图片不经过本地分类器)
+        """
+        self.structured = structured
+        self.ai = ai
+        self.db = db
+        self.manifest = manifest
+        self.dedup = dedup
+        self.classifier = classifier
+        self.paper_topics = paper_topics
+        self.image_topics = image_topics
+        self.cpu_workers = max(1, cpu_workers)
+        self.io_workers = max(1, io_workers)
+        self.clip_batch_size = max(1, clip_batch_size)
+
+        self.pdf_queue = queue.Queue(maxsize=queue_size)
+        self.img_queue = queue.Queue(maxsize=queue_size)
+        self.io_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+
+        # PDF 切片边提取边向量化用的线程池
+        self.embed_pool = ThreadPoolExecutor(max_workers=self.io_workers)
+        # 所有 CPU 线程共用的页面提取进程池，第一次遇到长 PDF 时才启动
+        self.pdf_pool = PdfPagePool()
+
+        self.stats = {"paper": 0, "image": 0, "failed": 0, "duplicate": 0, "image_bytes": 0, "payload_bytes": 0,
+                      "local_attempted": 0, "local_classified": 0, "structured": 0}
+        self.stats_lock = threading.Lock()
+
+    def _count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def _fail(self, task, reason):
+        print(f"   [跳过] {task['filename']}: {reason}")
+        self._count("failed")
+        forget_pending_image(self.db, task)
+
+    # 各阶段的工作线程
+
+    def _pdf_worker(self):
+        while True:
+            task = self.pdf_queue.get()
+            if task is _DONE:
+                return
+            try:
+                with METRICS.file(task["filename"]):
+                    extract_paper(task, self.ai, self.embed_pool, self.pdf_pool)
+            except Exception as e:
+                self._fail(task, f"PDF 处理失败 {e}")
+                continue
+            if not task["chunks"]:
+                self._fail(task, "PDF 读取为空或失败")
+                continue
+            self.io_queue.put(task)
+
+    def _clip_worker(self):
+        """攒够一批 (或队列暂时取空) 就做一次 CLIP 推理"""
+        finished = False
+        while not finished:
+            batch = []
+            task = self.img_queue.get()
+            while True:
+                if task is _DONE:
+                    finished = True
+                    break
+                batch.append(task)
+                if len(batch) >= self.clip_batch_size:
+                    break
+                try:
+                    task = self.img_queue.get(timeout=0.05)
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            try:
+                embed_images(self.ai, batch, batch_size=self.clip_batch_size)
+            except Exception as e:
+                for t in batch:
+                    t["error"] = f"CLIP处理失败 {e}"
+            for t in batch:
+                if "error" not in t and self.dedup:
+                    try:
+                        with METRICS.file(t["filename"]):
+                            check_duplicate(self.ai, self.db, t)
+                    except Exception as e:
+                        t["error"] = f"近似重复检测失败 {e}"
+                if "error" in t:
+                    self._fail(t, t["error"])
+                elif "duplicate_of" in t:
+                    self._count("duplicate")
+                    if self.manifest is not None:
+                        self.manifest.record_duplicate(t["path"], t["kind"], t["hash"], t["duplicate_of"])
+                    print(f"   [重复] {t['filename']} 与 {os.path.basename(t['duplicate_of'])} "
+                          f"近似重复 (相似度 {t['similarity']:.3f})，跳过")
+                else:
+                    self.io_queue.put(t)
+
+    def _io_worker(self):
+        while True:
+            task = self.io_queue.get()
+            if task is _DONE:
+                return
+            try:
+                with METRICS.file(task["filename"]):
+                    if task["kind"] == "paper":
+                        embed_paper(self.ai, task)
+                        classify_paper(self.ai, task, self.paper_topics, self.classifier)
+                    else:
+                        if self.structured:
+                            analyze_image(self.ai, task, self.image_topics, self.classifier)
+                        else:
+                            describe_image(self.ai, task)
+                            classify_image(self.ai, task, self.image_topics, self.classifier)
+                        self._count("image_bytes", task["image_bytes"])
+                        self._count("payload_bytes", task["payload_bytes"])
+                        embed_image_desc(self.ai, task)
+                    # 只统计真正经过本地分类器的文件；结构化分析的图片类别随描述一起返回，不经过它
+                    if task.get("local_attempted"):
+                        self._count("local_attempted")
+                    if task.get("classified_by") not in (None, "llm"):
+                        # 每个本地分类成功的文件省下一次 LLM 调用
+                        self._count("local_classified")
+                    if task.get("structured"):
+                        self._count("structured")
+            except Exception as e:
+                self._fail(task, f"Gemini 处理失败 {e}")
+                continue
+            self.write_queue.put(task)
+
+    def _writer(self):
+        """唯一的写库线程: 写入先进缓冲，攒够行数或超过时间再批量写库"""
+        while True:
+            try:
+                task = self.write_queue.get(timeout=WRITE_FLUSH_SECONDS)
+            except queue.Empty:
+                task = None
+            if task is _DONE:
+                return
+            try:
+                self.db.writer.maybe_flush()
+            except Exception as e:
+                print(f"   [错误] 批量写库失败，下次启动时将按入库日志重放: {e}")
+            if task is None:
+                continue
+            try:
+                with METRICS.file(task["filename"]):
+                    commit_task(self.db, task, self.manifest)
+                self._count(task["kind"])
+                tag = "PDF" if task["kind"] == "paper" else "IMG"
+                print(f"[{tag}] 完成: {task['filename']} -> {task['category']}")
+            except Exception as e:
+                self._fail(task, f"入库失败 {e}")
+
+    def _start(self, target, n):
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(n)]
+        for t in threads:
+            t.start()
+        return threads
+
+    def run(self, tasks):
+        """执行一批任务，阻塞到全部写库完成，返回统计"""
+        # 每次批量写库后保存清单，中途退出时清单与库保持一致
+        self.db.begin_batch(on_flush=self.manifest.save if self.manifest is not None else None)
+        pdf_threads = self._start(self._pdf_worker, self.cpu_workers)
+        clip_threads = self._start(self._clip_worker, 1)
+        io_threads = self._start(self._io_worker, self.io_workers)
+        writer_threads = self._start(self._writer, 1)
+
+        # 1. 投递任务 (队列满时会阻塞，起到背压作用)
+        for task in tasks:
+            (self.pdf_queue if task["kind"] == "paper" else self.img_queue).put(task)
+
+        # 2. 逐级关闭: 上游线程全部退出后，再通知下游
+        for _ in pdf_threads:
+            self.pdf_queue.put(_DONE)
+        self.img_queue.put(_DONE)
+        for t in pdf_threads + clip_threads:
+            t.join()
+
+        for _ in io_threads:
+            self.io_queue.put(_DONE)
+        for t in io_threads:
+            t.join()
+
+        self.write_queue.put(_DONE)
+        for t in writer_threads:
+            t.join()
+        self.embed_pool.shutdown()
+        self.pdf_pool.close()
+        try:
+            self.db.end_batch()
+            self.db.journal.reset()
+        except Exception as e:
+            print(f"   [错误] 批量写库失败，下次启动时将按入库日志重放: {e}")
+        return self.stats
@@ -0,0 +1,45 @@
+# core/ranking.py
+from .config import RRF_K
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, weights=None):
+    """
+    倒数排名融合 (RRF): 每一路结果只看名次，score = sum(w / (k + rank))
+    不同检索方式的分数量纲不同 (余弦距离 / BM25)，按名次融合不需要归一化。
+    :param rankings: 多路结果，每一路是按相关度降序的 key 列表
+    :param weights: 每一路的权重，默认都为 1
+    :return: 按融合得分降序的 [(key, score), ...]
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def fuse_by_path(named_results, weights=None, k=RRF_K):
+    """
+    多路图片检索结果按图片路径去重并加权融合
+    :param named_results: {路名: Chroma query 结果}，例如 {"desc": ..., "clip": ...}
+    :param weights: {路名: 权重}，缺省为 1
+    :return: 按融合得分降序的 [{"path", "score", "ranks": {路名: 名次}, "meta"}, ...]
+        meta 取第一条带描述的元数据 (描述库的元数据比视觉库多 desc 字段)
+    """
+    weights = weights or {}
+    names = list(named_results)
+    rankings, metas, ranks = [], {}, {}
+    for name in names:
+        ranking = []
+        for meta in named_results[name]['metadatas'][0]:
+            path = meta.get('path')
+            if not path or path in ranking:
+                continue
+            ranking.append(path)
+            ranks.setdefault(path, {})[name] = len(ranking)
+            if path not in metas or ('desc' in meta and 'desc' not in metas[path]):
+                metas[path] = meta
+        rankings.append(ranking)
+
+    fused = reciprocal_rank_fusion(rankings, k=k, weights=[weights.get(n, 1.0) for n in names])
+    return [{"path": path, "score": score, "ranks": ranks[path], "meta": metas[path]} for path, score in fused]
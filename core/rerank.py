@@ -0,0 +1,97 @@
+# core/rerank.py
+import os
+import re
+
+import numpy as np
+
+from .config import RERANK_POOLING, RERANK_TOP_K
+
+POOLINGS = ("max", "mean", "topk")
+
+
+def chunk_scores(results):
+    """
+    取出一次检索里每个切片的相关度 (越大越相关)
+    混合 / 关键词检索自带 scores；纯向量检索用 1 - 余弦距离
+    """
+    if results.get("scores"):
+        return np.asarray(results["scores"][0], dtype=np.float32)
+    return 1.0 - np.asarray(results["distances"][0], dtype=np.float32)
+
+
+def rank_files(results, pooling=RERANK_POOLING, top_k=RERANK_TOP_K):
+    """
+    本地文件级重排: 把切片相关度按所属文件聚合，一次算出 max / mean / top-k 求和三种池化
+    :param results: search_paper* 返回的 Chroma 格式结果
+    :param pooling: 用哪一种池化排序 (max / mean / topk)
+    :return: 按得分降序的 [{"filename", "path", "category", "score", "max", "mean", "topk", "hits", "pages"}, ...]
+    """
+    if pooling not in POOLINGS:
+        raise ValueError(f"未知的池化方式: {pooling}")
+    metas = results["metadatas"][0]
+    if not metas:
+        return []
+
+    scores = chunk_scores(results)
+    paths = [m.get("path", m.get("source", "Unknown")) for m in metas]
+    files, inverse = np.unique(paths, return_inverse=True)
+    n = len(files)
+
+    hits = np.bincount(inverse, minlength=n)
+    total = np.bincount(inverse, weights=scores, minlength=n)
+    best = np.full(n, -np.inf)
+    np.maximum.at(best, inverse, scores)
+
+    # top-k 求和: 按 (文件, 得分降序) 排序后，每个文件只保留前 k 个切片
+    order = np.lexsort((-scores, inverse))
+    grouped = inverse[order]
+    starts = np.searchsorted(grouped, grouped, side="left")
+    in_top = (np.arange(len(order)) - starts) < top_k
+    topk = np.bincount(grouped[in_top], weights=scores[order][in_top], minlength=n)
+
+    pooled = {"max": best, "mean": total / hits, "topk": topk}
+    ranked = []
+    for i in np.argsort(-pooled[pooling], kind="stable"):
+        rows = np.flatnonzero(inverse == i)
+        first = metas[rows[0]]
+        ranked.append({
+            "filename": os.path.basename(files[i]),
+            "path": str(files[i]),
+            "category": first.get("category", "Unknown"),
+            "score": float(pooled[pooling][i]),
+            "max": float(best[i]),
+            "mean": float(total[i] / hits[i]),
+            "topk": float(topk[i]),
+            "hits": int(hits[i]),
+            # 页码按数值排序，缺页码的记录 ("?") 排在最后
+            "pages": sorted({metas[r].get("page", "?") for r in rows},
+                            key=lambda p: (not isinstance(p, int), p if isinstance(p, int) else str(p))),
+        })
+    return ranked
+
+
+def llm_rerank(ai, topic, files):
+    """让 Gemini 对候选文件重排，返回自由文本 (list_papers --llm-rerank)"""
+    candidates_text = ""
+    for i, info in enumerate(files):
+        candidates_text += f"{i+1}. 文件名: {info['filename']} (分类: {info['category']})\n"
+
+    rerank_prompt = (
+        f"用户正在寻找关于 '{topic}' 的论文。\n"
+        f"向量数据库找出了以下候选文件，请你判断哪些文件真正与主题高度相关，并按相关性从高到低排序。\n"
+        f"请排除掉明显不相关的文件（例如只是提到了关键词但核心主题不符的）。\n\n"
+        f"候选列表：\n{candidates_text}\n\n"
+        f"请输出一个简洁的列表，格式如下：\n"
+        f"1. [相关度: 高/中/低] 文件名 - 一句话解释为什么相关\n"
+    )
+    return ai.chat_with_gemini(rerank_prompt)
+
+
+def parse_llm_ranking(text, filenames):
+    """从 LLM 重排的自由文本中按出现顺序找回文件名，用于和本地重排比较"""
+    found = []
+    for line in text.splitlines():
+        for name in filenames:
+            if name not in found and re.search(re.escape(name), line):
+                found.append(name)
+    return found
@@ -0,0 +1,278 @@
+# core/server.py
+import codecs
+import hmac
+import io
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .config import SERVER_HOST, SERVER_PORT, SERVER_TOKEN_FILE
+
+# 会写库或移动文件的命令: 在服务端串行执行，检索类命令可以并发
+WRITE_COMMANDS = {"add_paper", "add_image", "batch_ingest", "import"}
+
+TOKEN_HEADER = "X-KB-Token"
+
+
+def load_token(path=SERVER_TOKEN_FILE, create=False):
+    """
+    读取服务访问令牌；create=True 时不存在就生成一个 (文件权限 0600，只有当前用户能读)
+    读取失败返回 None
+    """
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class _ThreadLocalStream:
+    """
+    按线程重定向输出: 正在处理请求的线程把 print 写进自己的缓冲区，
+    其他线程 (包括服务本身的日志) 照常输出到终端。
+    """
+
+    def __init__(self, original):
+        self.original = original
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, "buffer", None) or self.original
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+
+class _SocketStream:
+    """把命令输出边产生边写回客户端 (流式响应)，客户端断开后丢弃剩余输出"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.closed = False
+
+    def write(self, text):
+        if not self.closed:
+            try:
+                self.wfile.write(text.encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class KnowledgeBaseServer:
+    """
+    常驻服务: 进程内只持有一个 AIHandler 和一个 DatabaseHandler，
+    通过本机 HTTP 接收命令行参数并返回命令输出。
+
+        GET  /health   存活检查
+        POST /run      {"argv": [...]} -> {"output": "...", "seconds": 0.12}
+                       {"argv": [...], "stream": true} -> 输出以纯文本边产生边返回 (例如问答的流式回答)
+
+    /run 只接受带令牌 (X-KB-Token，与 SERVER_TOKEN_FILE 中的一致) 的 application/json 请求，
+    带 Origin 头的请求一律拒绝: 浏览器里的网页无法读取令牌文件，也发不出不带 Origin 的跨域 JSON 请求。
+
+    注意: batch_ingest 流水线的工作线程不属于请求线程，它们的逐文件日志打印在服务端终端，
+    客户端只收到汇总信息。
+    """
+
+    def __init__(self, parser, run, host=SERVER_HOST, port=SERVER_PORT, write_lock=None,
+                 token_file=SERVER_TOKEN_FILE):
+        """
+        :param parser: main.build_parser() 构造的参数解析器
+        :param run: 执行一条已解析命令的函数
+        :param write_lock: 写库命令之间互斥用的锁，为空时新建
+        :param token_file: 访问令牌文件，不存在时生成
+        """
+        self.parser = parser
+        self.run = run
+        self.token = load_token(token_file, create=True)
+        if self.token is None:
+            raise RuntimeError(f"无法读取服务令牌: {token_file}")
+        self.write_lock = write_lock or threading.Lock()
+        self.stdout = _ThreadLocalStream(sys.stdout)
+        self.stderr = _ThreadLocalStream(sys.stderr)
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def execute(self, argv, out=None):
+        """
+        执行一条命令，返回它打印的全部输出
+        :param out: 传入时输出直接写到这里 (流式)，返回值为空字符串
+        """
+        buffer = out if out is not None else io.StringIO()
+        self.stdout.local.buffer = buffer
+        self.stderr.local.buffer = buffer
+        try:
+            args = self.parser.parse_args(argv)
+            if args.command in (None, "serve", "watch"):
+                print("[错误] 服务端不支持该命令")
+            elif args.command in WRITE_COMMANDS:
+                with self.write_lock:
+                    self.run(args)
+            else:
+                self.run(args)
+        except SystemExit:
+            # argparse 解析失败时会调用 sys.exit，错误信息已经写进缓冲区
+            pass
+        except Exception:
+            print(f"[错误] 服务端执行失败:\n{traceback.format_exc()}")
+        finally:
+            self.stdout.local.buffer = None
+            self.stderr.local.buffer = None
+        return buffer.getvalue() if out is None else ""
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    self._reply(200, {"status": "ok", "pid": os.getpid()})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def _read_request(self):
+                """检查来源、令牌和请求体，返回 argv 与是否流式；不合法时回复错误并返回 None"""
+                if self.headers.get("Origin") is not None:
+                    self._reply(403, {"error": "cross-origin requests are not allowed"})
+                    return None
+                content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                if content_type != "application/json":
+                    self._reply(415, {"error": "Content-Type must be application/json"})
+                    return None
+                if not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), server.token):
+                    self._reply(401, {"error": "invalid token"})
+                    return None
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length))
+                    argv = body["argv"]
+                    if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+                        raise TypeError("argv must be a list of strings")
+                    return argv, bool(body.get("stream"))
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    self._reply(400, {"error": f"bad request: {e}"})
+                    return None
+
+            def do_POST(self):
+                if self.path != "/run":
+                    self._reply(404, {"error": "not found"})
+                    return
+                request = self._read_request()
+                if request is None:
+                    return
+                argv, stream = request
+                t0 = time.perf_counter()
+                if stream:
+                    # 不带 Content-Length，输出写完后关闭连接即结束
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; charset=utf-8")
+                    self.end_headers()
+                    server.execute(argv, out=_SocketStream(self.wfile))
+                    print(f"[服务] {' '.join(argv[:1])} 完成，用时 {time.perf_counter() - t0:.2f}s")
+                    return
+                output = server.execute(argv)
+                seconds = time.perf_counter() - t0
+                print(f"[服务] {' '.join(argv[:1])} 完成，用时 {seconds:.2f}s")
+                self._reply(200, {"output": output, "seconds": seconds})
+
+            def log_message(self, format, *args):
+                # 请求日志由 do_POST 自己打印
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        host, port = self.httpd.server_address[:2]
+        # 之后所有 print 都经过线程级重定向
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        print(f"常驻服务已启动: http://{host}:{port} (Ctrl+C 退出)")
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\n常驻服务已停止")
+        finally:
+            self.httpd.server_close()
+            sys.stdout, sys.stderr = self.stdout.original, self.stderr.original
+
+
+def _opener():
+    # 访问本机服务不能走 HTTP_PROXY
+    return urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+
+def server_alive(host=SERVER_HOST, port=SERVER_PORT, timeout=0.3):
+    try:
+        with _opener().open(f"http://{host}:{port}/health", timeout=timeout) as resp:
+            return resp.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def run_remote(argv, host=SERVER_HOST, port=SERVER_PORT, token_file=SERVER_TOKEN_FILE):
+    """
+    常驻服务在运行时，把命令转发过去并打印输出，返回 True；
+    服务不可用 (包括检查存活之后、开始输出之前退出) 时返回 False，由调用方在本进程执行。
+    服务拒绝请求或输出中途断开时只打印错误、返回 True: 服务仍可能在写库，不能在本进程再执行一遍。
+    """
+    if not server_alive(host, port):
+        return False
+    request = urllib.request.Request(
+        f"http://{host}:{port}/run",
+        data=json.dumps({"argv": argv, "stream": True}).encode("utf-8"),
+        headers={"Content-Type": "application/json", TOKEN_HEADER: load_token(token_file) or ""}
+    )
+    # 输出边到边打印，多字节字符可能被切在两次读取之间，用增量解码
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    started = False
+    try:
+        with _opener().open(request) as resp:
+            while True:
+                data = resp.read1(4096)
+                if not data:
+                    break
+                started = True
+                print(decoder.decode(data), end="", flush=True)
+    except urllib.error.HTTPError as e:
+        print(f"[错误] 常驻服务拒绝了请求 ({e.code})，请检查令牌文件 {token_file} 是否可读")
+        return True
+    except (urllib.error.URLError, OSError) as e:
+        if not started:
+            return False
+        print(f"\n[错误] 与常驻服务的连接中断: {e}")
+    print(decoder.decode(b"", final=True), end="")
+    return True
@@ -0,0 +1,186 @@
+# core/snapshot.py
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from .config import SNAPSHOT_CHUNK_ROWS, SNAPSHOT_DTYPE
+from .dedup import NearDuplicateIndex
+from .metrics import METRICS
+
+SNAPSHOT_MAGIC = b"KBSNAP1\n"
+SNAPSHOT_VERSION = 2
+# 版本 1 没有入库清单块，仍可导入
+SNAPSHOT_READABLE = (1, 2)
+
+# 每个数据块里的列，按这个顺序依次写出
+_COLUMNS = ("ids", "documents", "metadatas", "vectors")
+
+
+def _write_block(f, header, payloads=()):
+    """块 = 4 字节头长度 + JSON 头 + 各列数据；头里记录每列的字节数和整块的 CRC32"""
+    header = dict(header, sizes=[len(p) for p in payloads])
+    crc = 0
+    for p in payloads:
+        crc = zlib.crc32(p, crc)
+    header["crc"] = crc
+    raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    f.write(struct.pack("<I", len(raw)))
+    f.write(raw)
+    for p in payloads:
+        f.write(p)
+
+
+def _read_block(f):
+    """返回 (头, 各列数据)；文件在块中间结束时抛出 ValueError"""
+    raw = f.read(4)
+    if len(raw) < 4:
+        raise ValueError("快照不完整: 缺少结束标记")
+    header = json.loads(f.read(struct.unpack("<I", raw)[0]).decode("utf-8"))
+    payloads = [f.read(n) for n in header["sizes"]]
+    if any(len(p) != n for p, n in zip(payloads, header["sizes"])):
+        raise ValueError("快照不完整: 数据块被截断")
+    crc = 0
+    for p in payloads:
+        crc = zlib.crc32(p, crc)
+    if crc != header["crc"]:
+        raise ValueError(f"快照校验失败: {header.get('collection', '')} 的数据块已损坏")
+    return header, payloads
+
+
+def _pack_json(values):
+    return zlib.compress(json.dumps(values, ensure_ascii=False).encode("utf-8"))
+
+
+def _unpack_json(data):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+@METRICS.traced("snapshot.export")
+def export_snapshot(db, path, chunk_rows=SNAPSHOT_CHUNK_ROWS, dtype=SNAPSHOT_DTYPE, manifest=None):
+    """
+    把三个库导出为一个快照文件，返回 {逻辑库名: 行数}
+    快照按逻辑库名 (paper_db 等) 记录数据，并记下生成向量的模型，导入时据此检查两边的模型是否一致。
+    文件按列分块: 每块最多 chunk_rows 行，id / 文档 / 元数据各自 zlib 压缩，向量按 dtype 原样存放。
+    边读边写，内存占用只与 chunk_rows 有关；先写临时文件，完成后再替换，中途失败不会留下半个快照。
+    :param manifest: 入库清单，给定时把快照里各文档对应的清单记录写在最后一块，
+                     新机器导入后再扫描资料库时这些文件判定为未变化，不会重新调用 Gemini
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    tmp = path + ".tmp"
+    counts = {}
+    doc_ids = set()
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        _write_block(f, {
+            "version": SNAPSHOT_VERSION, "created": time.time(), "dtype": dtype.name,
+            "collections": {name: c.count() for name, c in db.logical.items()},
+            "models": db.registry.models(),
+        })
+        for name, collection in db.logical.items():
+            total = collection.count()
+            counts[name] = 0
+            for offset in range(0, total, chunk_rows):
+                page = collection.get(include=["embeddings", "documents", "metadatas"],
+                                      limit=chunk_rows, offset=offset)
+                if not page['ids']:
+                    break
+                vectors = np.asarray(page['embeddings'], dtype=dtype)
+                documents = page.get('documents')
+                # 视觉库没有文档，整列记为空
+                if documents is not None and all(d is None for d in documents):
+                    documents = None
+                _write_block(f, {"collection": name, "rows": len(page['ids']), "dim": int(vectors.shape[1])}, [
+                    _pack_json(page['ids']),
+                    _pack_json(list(documents) if documents is not None else None),
+                    _pack_json(page['metadatas']),
+                    vectors.tobytes(),
+                ])
+                counts[name] += len(page['ids'])
+                doc_ids.update(m["doc_id"] for m in page['metadatas'] if m and m.get("doc_id"))
+        if manifest is not None:
+            entries = manifest.snapshot_entries(doc_ids)
+            _write_block(f, {"manifest": True, "rows": len(entries)}, [_pack_json(entries)])
+        _write_block(f, {"end": True, "rows": counts})
+    os.replace(tmp, path)
+    return counts
+
+
+def _read_header(f, path):
+    if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        raise ValueError(f"不是知识库快照文件: {path}")
+    header, _ = _read_block(f)
+    if header.get("version") not in SNAPSHOT_READABLE:
+        raise ValueError(f"不支持的快照版本: {header.get('version')}")
+    return header
+
+
+def snapshot_header(path):
+    """快照的文件头: 版本、向量精度、各库行数、向量模型"""
+    with open(path, "rb") as f:
+        return _read_header(f, path)
+
+
+def read_snapshot(path, on_manifest=None):
+    """
+    逐块读取快照，依次产出 (逻辑库名, ids, 向量 float32, 文档, 元数据)
+    读完最后一块后检查结束标记，文件被截断或损坏时抛出 ValueError
+    :param on_manifest: 读到入库清单块时用清单记录 {相对路径: 记录} 调用
+    """
+    with open(path, "rb") as f:
+        header = _read_header(f, path)
+        dtype = np.dtype(header["dtype"]).newbyteorder("<")
+        while True:
+            block, payloads = _read_block(f)
+            if block.get("end"):
+                return
+            if block.get("manifest"):
+                if on_manifest is not None:
+                    on_manifest(_unpack_json(payloads[0]))
+                continue
+            data = dict(zip(_COLUMNS, payloads))
+            vectors = np.frombuffer(data["vectors"], dtype=dtype).reshape(block["rows"], block["dim"])
+            yield (block["collection"], _unpack_json(data["ids"]), vectors.astype(np.float32),
+                   _unpack_json(data["documents"]), _unpack_json(data["metadatas"]))
+
+
+@METRICS.traced("snapshot.import")
+def import_snapshot(db, path, manifest=None):
+    """
+    把快照批量写入当前库，返回 {逻辑库名: 行数}
+    快照的向量模型与当前库不同时: 目标库为空则改用快照的模型，已有数据则拒绝导入 (两种向量不能混在一个库里)。
+    按 id upsert，导入到已有数据的库时同 id 的记录被覆盖、其余保留；关键词索引随写入一起更新。
+    每次只解码一块，内存占用与导出时的 chunk_rows 有关，与快照总大小无关。
+    :param manifest: 入库清单，快照里带有清单记录时合并进去 (调用方负责保存)
+    """
+    registry = db.registry
+    # 早于模型记录的快照没有 models，按与当前库一致处理
+    for space, model in snapshot_header(path).get("models", {}).items():
+        if model == registry.model(space):
+            continue
+        logical = registry.logical_in(space)
+        if any(db.logical[name].count() for name in logical) or (registry.migration or {}).get("space") == space:
+            raise ValueError(f"快照的 {space} 向量由 {model} 生成，当前库使用 {registry.model(space)}，"
+                             f"请导入到空库，或先用 migrate_embeddings 切换到同一模型")
+        for name in logical:
+            registry.set_model(name, model)
+
+    counts = {}
+    on_manifest = manifest.restore if manifest is not None else None
+    for name, ids, vectors, documents, metadatas in read_snapshot(path, on_manifest):
+        if name not in db.logical:
+            raise ValueError(f"快照中的 collection 在当前库中不存在: {name}")
+        db.write_now([{
+            "collection": db.logical[name].name,
+            "ids": ids,
+            "embeddings": vectors,
+            "metadatas": metadatas,
+            "documents": documents,
+        }])
+        counts[name] = counts.get(name, 0) + len(ids)
+    # 视觉库变了，近似重复索引下次检测时重新读入
+    db.near_duplicates = NearDuplicateIndex(db.visual_collection)
+    return counts
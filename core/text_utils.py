@@ -0,0 +1,15 @@
+# core/text_utils.py
+import re
+
+# 近似分词: 中日韩字符逐字算一个 token，其余按单词/标点切分，
+# 与多数子词分词器的长度量级接近，用于切片和上下文预算
+TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]|\w+|[^\w\s]")
+
+
+def token_spans(text):
+    """返回每个 token 在原文中的 (起, 止) 位置"""
+    return [m.span() for m in TOKEN_PATTERN.finditer(text)]
+
+
+def count_tokens(text):
+    return sum(1 for _ in TOKEN_PATTERN.finditer(text))
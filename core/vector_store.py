@@ -0,0 +1,332 @@
+# core/vector_store.py
+import json
+import os
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+
+from .config import VECTOR_STORE_DTYPE, MMAP_QUERY_CHUNK_ROWS, MMAP_PARTITION_CACHE, INDEXED_METADATA_FIELDS
+from .filters import where_to_sql, json_field
+
+# 每次扩容至少增加的行数，避免逐批追加时频繁重新映射文件
+_GROW_ROWS = 4096
+
+
+class MmapCollection:
+    """
+    内存映射的精确检索向量库，接口与 DatabaseHandler 用到的 Chroma collection 子集一致:
+    count / upsert / get / update / delete / query
+
+    - vectors.bin: (行数, dim) 的 float16/float32 矩阵，写入前归一化，余弦相似度即内积
+    - meta.sqlite: 每行的 id、文档、元数据 (JSON) 和行号；删除只删元数据，行号不复用
+    查询时对整张矩阵做一次分块矩阵乘法，再用 argpartition 取 top-k，结果是精确的。
+    打开时只映射文件、不读数据，几乎瞬间完成；多个进程可以同时打开同一个库，
+    每次查询前检查版本号，发现其他进程写入过就重新映射。同一时间只应有一个进程写入。
+    """
+
+    def __init__(self, directory, name, dtype=VECTOR_STORE_DTYPE, chunk_rows=MMAP_QUERY_CHUNK_ROWS):
+        os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self.vectors_path = os.path.join(directory, "vectors.bin")
+        self.chunk_rows = chunk_rows
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(os.path.join(directory, "meta.sqlite"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            " idx INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        # 常用过滤字段的表达式索引: 按类别等条件选行时不必逐行解析 JSON
+        for key in INDEXED_METADATA_FIELDS:
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_meta_{key} ON rows({json_field(key)})")
+        self.conn.commit()
+
+        info = self._info()
+        # 库一旦建立，存储精度以文件为准
+        self.dtype = np.dtype(info.get("dtype", dtype))
+        self.dim = int(info["dim"]) if "dim" in info else None
+        self.matrix = None      # 当前映射的矩阵 (容量可能大于已用行数)
+        self.alive = None       # 已用行中哪些没有被删除
+        self.rows = 0
+        self.version = None
+        self.partitions = {}    # 过滤条件 -> 满足条件的行号 (按行号升序)，版本变化时清空
+
+    # 内部状态
+
+    def _info(self):
+        return dict(self.conn.execute("SELECT key, value FROM info").fetchall())
+
+    def _refresh(self):
+        """与磁盘上的版本对齐: 重新映射矩阵并加载存活行掩码 (只在其他写入发生后才会真正执行)"""
+        info = self._info()
+        version = info.get("version", "0")
+        if version == self.version:
+            return
+        self.rows = int(info.get("rows", 0))
+        self.dim = int(info["dim"]) if "dim" in info else None
+        self._map()
+        alive = np.zeros(self.rows, dtype=bool)
+        idx = np.fromiter((r[0] for r in self.conn.execute("SELECT idx FROM rows")), dtype=np.int64)
+        alive[idx] = True
+        self.alive = alive
+        self.partitions = {}
+        self.version = version
+
+    def _map(self, mode="r"):
+        self.matrix = None
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return
+        capacity = os.path.getsize(self.vectors_path) // (self.dim * self.dtype.itemsize)
+        if capacity:
+            self.matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode=mode, shape=(capacity, self.dim))
+
+    def _ensure_capacity(self, rows):
+        """把向量文件扩到至少 rows 行，返回可写的映射"""
+        row_bytes = self.dim * self.dtype.itemsize
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if size < rows * row_bytes:
+            capacity = max(rows, size // row_bytes * 2, _GROW_ROWS)
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        capacity = os.path.getsize(self.vectors_path) // row_bytes
+        return np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+
+    def _bump(self, rows):
+        version = int(self._info().get("version", "0")) + 1
+        self.conn.executemany("INSERT OR REPLACE INTO info VALUES (?, ?)", [
+            ("rows", str(rows)), ("dim", str(self.dim)), ("dtype", self.dtype.name), ("version", str(version)),
+        ])
+
+    @staticmethod
+    def _normalize(embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    # Chroma collection 接口
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        vectors = self._normalize(embeddings)
+        if len(ids) != len(vectors):
+            raise ValueError(f"ids 与向量数量不一致: {len(ids)} != {len(vectors)}")
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不匹配: 期望 {self.dim}，实际 {vectors.shape[1]}")
+
+            # 同一批里重复的 id 只保留最后一次
+            latest = {row_id: i for i, row_id in enumerate(ids)}
+            order = list(latest.values())
+            ids = [ids[i] for i in order]
+            vectors = vectors[order]
+
+            existing = self._lookup(ids)
+            rows = int(self._info().get("rows", 0))
+            slots = []
+            for row_id in ids:
+                if row_id in existing:
+                    slots.append(existing[row_id])
+                else:
+                    slots.append(rows)
+                    rows += 1
+
+            matrix = self._ensure_capacity(rows)
+            matrix[slots] = vectors.astype(self.dtype)
+            matrix.flush()
+            del matrix
+
+            self.conn.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)", [
+                (slot, row_id,
+                 documents[i] if documents is not None else None,
+                 json.dumps(metadatas[i] if metadatas is not None else None, ensure_ascii=False))
+                for i, (slot, row_id) in enumerate(zip(slots, ids))
+            ])
+            self._bump(rows)
+            self.conn.commit()
+
+    def _lookup(self, ids):
+        """id -> 行号，只包含已存在的 id"""
+        found = {}
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            marks = ",".join("?" * len(part))
+            found.update(self.conn.execute(f"SELECT id, idx FROM rows WHERE id IN ({marks})", part).fetchall())
+        return found
+
+    def _select(self, ids=None, where=None, limit=None, offset=None):
+        """按 id / where 条件选出 (idx, id, document, metadata) 行"""
+        sql, params = "SELECT idx, id, document, metadata FROM rows", []
+        conditions = []
+        if ids is not None:
+            conditions.append(f"id IN ({','.join('?' * len(ids)) or 'NULL'})")
+            params.extend(ids)
+        if where:
+            clause, where_params = where_to_sql(where)
+            conditions.append(clause)
+            params.extend(where_params)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY idx"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset or 0])
+        return self.conn.execute(sql, params).fetchall()
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=None):
+        with self.lock:
+            rows = self._select(ids, where, limit, offset)
+            result = {"ids": [r[1] for r in rows]}
+            if "documents" in include:
+                result["documents"] = [r[2] for r in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [json.loads(r[3]) if r[3] else None for r in rows]
+            if "embeddings" in include:
+                self._refresh()
+                idx = [r[0] for r in rows]
+                result["embeddings"] = (np.asarray(self.matrix[idx], dtype=np.float32) if idx
+                                        else np.zeros((0, self.dim or 0), dtype=np.float32))
+            return result
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        with self.lock:
+            existing = self._lookup(list(ids))
+            if embeddings is not None:
+                vectors = self._normalize(embeddings)
+                keep = [i for i, row_id in enumerate(ids) if row_id in existing]
+                matrix = self._ensure_capacity(int(self._info().get("rows", 0)))
+                matrix[[existing[ids[i]] for i in keep]] = vectors[keep].astype(self.dtype)
+                matrix.flush()
+                del matrix
+            for i, row_id in enumerate(ids):
+                if row_id not in existing:
+                    continue
+                if metadatas is not None:
+                    self.conn.execute("UPDATE rows SET metadata=? WHERE id=?",
+                                      (json.dumps(metadatas[i], ensure_ascii=False), row_id))
+                if documents is not None:
+                    self.conn.execute("UPDATE rows SET document=? WHERE id=?", (documents[i], row_id))
+            self._bump(int(self._info().get("rows", 0)))
+            self.conn.commit()
+
+    def delete(self, ids=None, where=None):
+        with self.lock:
+            rows = self._select(ids, where)
+            self.conn.executemany("DELETE FROM rows WHERE idx=?", [(r[0],) for r in rows])
+            self._bump(int(self._info().get("rows", 0)))
+            self.conn.commit()
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        """精确余弦检索: 分块矩阵乘法 + argpartition，返回 Chroma 格式 (每个查询一组)"""
+        queries = self._normalize(query_embeddings)
+        with self.lock:
+            self._refresh()
+            result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            if self.matrix is None or not self.rows:
+                for _ in queries:
+                    for key in result:
+                        result[key].append([])
+                return result
+
+            # 有过滤条件时只取出满足条件的行参与计算，不扫描整张矩阵
+            subset = self._partition(where) if where else None
+            scores = self._scores(queries, subset)
+            available = int(self.alive.sum()) if subset is None else len(subset)
+
+            for q in range(len(queries)):
+                row = scores[q]
+                k = min(n_results, available)
+                if k <= 0:
+                    top = np.zeros(0, dtype=np.int64)
+                else:
+                    top = np.argpartition(-row, k - 1)[:k]
+                    top = top[np.argsort(-row[top])]
+                idx = top if subset is None else subset[top]
+                meta = {r[0]: r for r in self._select_idx(idx.tolist())}
+                result["ids"].append([meta[i][1] for i in idx.tolist()])
+                result["documents"].append([meta[i][2] for i in idx.tolist()])
+                result["metadatas"].append([json.loads(meta[i][3]) if meta[i][3] else None for i in idx.tolist()])
+                result["distances"].append([float(1.0 - row[i]) for i in top])
+            return result
+
+    def _partition(self, where):
+        """
+        满足 where 条件的存活行号 (升序)，按条件缓存，直到下一次写入
+        同一个类别反复检索时相当于一个常驻的分类子索引，只需读取这部分行
+        """
+        key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        if key not in self.partitions:
+            clause, params = where_to_sql(where)
+            rows = self.conn.execute(f"SELECT idx FROM rows WHERE {clause} ORDER BY idx", params)
+            idx = np.fromiter((r[0] for r in rows), dtype=np.int64)
+            idx = idx[idx < self.rows]
+            if len(self.partitions) >= MMAP_PARTITION_CACHE:
+                self.partitions.pop(next(iter(self.partitions)))
+            self.partitions[key] = idx
+        return self.partitions[key]
+
+    def _scores(self, queries, subset=None):
+        """
+        余弦相似度矩阵: subset 为空时是 (查询数, 已用行数)，已删除的行为 -inf；
+        否则是 (查询数, len(subset))，只读取 subset 中的行
+        """
+        n = self.rows if subset is None else len(subset)
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        q = queries.T.astype(np.float32)
+        for start in range(0, n, self.chunk_rows):
+            end = min(n, start + self.chunk_rows)
+            # 按升序行号取行，读盘尽量顺序
+            block = self.matrix[start:end] if subset is None else self.matrix[subset[start:end]]
+            if block.dtype != np.float32:
+                # float16 没有 BLAS 支持，分块转成 float32 再乘，内存占用受 chunk_rows 限制
+                block = block.astype(np.float32)
+            scores[:, start:end] = (block @ q).T
+        if subset is None:
+            scores[:, ~self.alive] = -np.inf
+        return scores
+
+    def _select_idx(self, idx):
+        if not idx:
+            return []
+        marks = ",".join("?" * len(idx))
+        return self.conn.execute(f"SELECT idx, id, document, metadata FROM rows WHERE idx IN ({marks})", idx).fetchall()
+
+
+class MmapVectorStore:
+    """与 chromadb.PersistentClient 同样用法的客户端，每个 collection 一个子目录"""
+
+    def __init__(self, path, dtype=VECTOR_STORE_DTYPE):
+        self.root = os.path.join(path, "mmap")
+        self.dtype = dtype
+        self.collections = {}
+
+    def get_or_create_collection(self, name, metadata=None):
+        """metadata 只为兼容 Chroma 的调用方式，距离固定为余弦"""
+        if name not in self.collections:
+            self.collections[name] = MmapCollection(os.path.join(self.root, name), name, dtype=self.dtype)
+        return self.collections[name]
+
+    def delete_collection(self, name):
+        """删除整个 collection 目录；不存在时与 Chroma 一样抛出 ValueError"""
+        directory = os.path.join(self.root, name)
+        collection = self.collections.pop(name, None)
+        if collection is not None:
+            with collection.lock:
+                collection.matrix = None
+                collection.conn.close()
+        if not os.path.isdir(directory):
+            raise ValueError(f"collection 不存在: {name}")
+        shutil.rmtree(directory)
+
+    def get_max_batch_size(self):
+        # 单次写入没有上限，按这个大小分段只是为了限制一次性转换的内存
+        return 50000
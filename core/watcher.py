@@ -0,0 +1,176 @@
+# core/watcher.py
+import os
+import threading
+import time
+
+from .config import PAPERS_ROOT, IMAGES_ROOT, WATCH_SETTLE_SECONDS, WATCH_BATCH_SECONDS, WATCH_POLL_SECONDS
+
+# 下载工具、编辑器写到一半的临时文件
+PARTIAL_SUFFIXES = (".part", ".crdownload", ".download", ".tmp", ".swp")
+
+
+class FolderWatcher:
+    """
+    监视文件夹里新增和修改的文件，文件写完后成批交给 on_batch(paths)
+
+    - 事件来源: 装了 watchdog 时用系统通知 (Linux 上是 inotify)，否则每 poll_interval 秒
+      对比一次目录快照 (只看大小和修改时间，不读内容)
+    - 防抖: 文件的大小和修改时间连续 settle 秒不变才认为写完，正在复制的大文件不会被读到一半
+    - 合并: 每 batch_interval 秒把期间写完的文件一起交出去，一次拷进来的上百个文件只跑一次流水线
+    - 忽略: PAPERS_ROOT / IMAGES_ROOT 下的分类文件夹 (入库时文件会被移到那里)、隐藏文件和下载中的临时文件
+    """
+
+    def __init__(self, folder, on_batch, accept=None, settle=WATCH_SETTLE_SECONDS,
+                 batch_interval=WATCH_BATCH_SECONDS, poll_interval=WATCH_POLL_SECONDS, use_native=True):
+        """
+        :param accept: 判断路径是否需要处理的函数 (例如按扩展名)，为空时全部接受
+        :param use_native: False 时强制使用轮询
+        """
+        self.folder = os.path.abspath(folder)
+        self.on_batch = on_batch
+        self.accept = accept or (lambda path: True)
+        self.settle = settle
+        self.batch_interval = batch_interval
+        self.poll_interval = poll_interval
+        self.use_native = use_native
+        self.ignored_roots = [os.path.abspath(PAPERS_ROOT), os.path.abspath(IMAGES_ROOT)]
+        self.lock = threading.Lock()
+        self.pending = {}       # 路径 -> (大小, 修改时间, 最后一次变化的时刻)
+        self.snapshot = {}      # 轮询模式下上一次看到的 路径 -> (大小, 修改时间)
+        self.stopped = threading.Event()
+        self.observer = None
+
+    # 事件
+
+    def in_category_folder(self, path):
+        """是否位于分类文件夹下 (监视的就是分类文件夹本身时不算)"""
+        path = os.path.abspath(path)
+        return any(root != self.folder and os.path.commonpath([path, root]) == root
+                   for root in self.ignored_roots)
+
+    def ignored(self, path):
+        name = os.path.basename(path)
+        if name.startswith(".") or name.endswith(PARTIAL_SUFFIXES):
+            return True
+        return self.in_category_folder(path) or not self.accept(path)
+
+    def notify(self, path):
+        """有文件新增或被修改 (事件回调和轮询都走这里)"""
+        if self.ignored(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            # 文件已被删除或移走
+            with self.lock:
+                self.pending.pop(os.path.abspath(path), None)
+            return
+        with self.lock:
+            key = os.path.abspath(path)
+            previous = self.pending.get(key)
+            if previous is None or previous[:2] != (st.st_size, st.st_mtime):
+                self.pending[key] = (st.st_size, st.st_mtime, time.monotonic())
+
+    def take_ready(self):
+        """取出已经写完的文件: 距离上次变化超过 settle 秒，且大小和修改时间确实没再变"""
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            for path, (size, mtime, changed) in list(self.pending.items()):
+                if now - changed < self.settle:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del self.pending[path]
+                    continue
+                if (st.st_size, st.st_mtime) != (size, mtime):
+                    # 期间又被写过但没收到事件 (部分网络文件系统)
+                    self.pending[path] = (st.st_size, st.st_mtime, now)
+                    continue
+                del self.pending[path]
+                ready.append(path)
+        return sorted(ready)
+
+    # 事件来源
+
+    def scan(self):
+        """遍历监视的文件夹 (跳过分类文件夹)，把新出现或变化过的文件交给 notify"""
+        current = {}
+        for root, dirs, files in os.walk(self.folder):
+            dirs[:] = [d for d in dirs
+                       if not d.startswith(".") and not self.in_category_folder(os.path.join(root, d))]
+            for name in files:
+                path = os.path.abspath(os.path.join(root, name))
+                if self.ignored(path):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                current[path] = (st.st_size, st.st_mtime)
+                if self.snapshot.get(path) != current[path]:
+                    self.notify(path)
+        self.snapshot = current
+
+    def _start_native(self):
+        """用 watchdog 订阅系统文件事件，没装时返回 False"""
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher.notify(event.src_path)
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watcher.notify(event.src_path)
+
+            def on_moved(self, event):
+                # 移进监视目录 (包括下载完成后由 .part 改名) 按新文件处理
+                if not event.is_directory:
+                    watcher.notify(event.dest_path)
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), self.folder, recursive=True)
+        self.observer.start()
+        return True
+
+    def run(self, initial_scan=True):
+        """阻塞运行，直到 stop() 或 Ctrl+C"""
+        # 先订阅事件再扫描，扫描期间新建的文件不会漏掉
+        native = self.use_native and self._start_native()
+        if initial_scan:
+            # 监视开始前已经在文件夹里的文件也处理一遍 (清单会跳过未变化的)，不必等 settle
+            self.scan()
+            with self.lock:
+                for path, (size, mtime, _) in self.pending.items():
+                    self.pending[path] = (size, mtime, 0.0)
+        print(f"正在监视: {self.folder} ({'系统文件事件' if native else f'每 {self.poll_interval:g}s 轮询'})")
+
+        last_poll = time.monotonic()
+        try:
+            while not self.stopped.wait(self.batch_interval):
+                if not native and time.monotonic() - last_poll >= self.poll_interval:
+                    self.scan()
+                    last_poll = time.monotonic()
+                ready = self.take_ready()
+                if ready:
+                    try:
+                        self.on_batch(ready)
+                    except Exception as e:
+                        # 一批出错不影响后续监视，这批文件等下次变化时再处理
+                        print(f"[错误] 监视入库失败: {e}")
+        finally:
+            if self.observer is not None:
+                self.observer.stop()
+                self.observer.join()
+
+    def stop(self):
+        self.stopped.set()
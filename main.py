@@ -1,184 +1,492 @@
 import argparse
+import contextlib
 import os
 import sys
-
-# 引入核心模块
-from core.ai_handler import AIHandler
-from core.db_handler import DatabaseHandler
-from core.file_handler import read_pdf_chunks, move_file_to_category
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 引入核心模块 (AIHandler / DatabaseHandler 依赖较重，在 init_handlers 中按需导入)
+from core.pipeline import (
+    IngestPipeline, plan_task, recover_journal, PDF_EXTS, IMG_EXTS,
+    extract_paper, embed_paper, classify_paper,
+    check_duplicate, forget_pending_image, analyze_image, describe_image, classify_image, embed_image_desc,
+    commit_task,
+)
+
+from core.classifier import CLASSIFIER_MODES, create_classifier
+from core.file_handler import PdfPagePool
+from core.manifest import IngestManifest, UNCHANGED, NEW, MODIFIED, RENAMED, DUPLICATE
+from core.rerank import POOLINGS, rank_files, llm_rerank
+from core.context_packer import pack_context, format_context
+from core.filters import metadata_where
+from core.snapshot import export_snapshot, import_snapshot
+from core.embedding_registry import default_models
+from core.text_utils import count_tokens
+from core.ranking import fuse_by_path
+from core.metrics import METRICS
 
 from dotenv import load_dotenv
 load_dotenv()  
 
-from core.config import GEMINI_API_KEY
-
-def process_paper(ai, db, file_path, topics):
+from core.config import (
+    GEMINI_API_KEY, CLIP_BATCH_SIZE, INGEST_CPU_WORKERS, INGEST_IO_WORKERS,
+    SERVER_HOST, SERVER_PORT, SEARCH_MODE, LIST_PAPERS_CANDIDATES, RERANK_POOLING,
+    IMAGE_SEARCH_CANDIDATES, IMAGE_FUSION_WEIGHTS, DEDUP_ENABLED, CLASSIFY_MODE, IMAGE_STRUCTURED_OUTPUT,
+    RAG_CANDIDATES, RAG_CONTEXT_TOKENS, SNAPSHOT_CHUNK_ROWS, SNAPSHOT_DTYPE, MIGRATION_BATCH_SIZE,
+)
+
+# 每个子命令启动时需要预加载的模型，其余模型在第一次用到时再加载
+# batch_ingest 不预加载 CLIP: 纯 PDF 文件夹完全用不到它
+COMMAND_CAPABILITIES = {
+    "add_paper": ("gemini",),
+    "add_image": ("gemini", "clip"),
+    "batch_ingest": ("gemini",),
+    "watch": ("gemini",),
+    "export": (),
+    "import": (),
+    "migrate_embeddings": (),
+    "search_paper": ("gemini",),
+    "list_papers": ("gemini",),
+    "search_image": ("gemini", "clip"),
+    "search_similar_image": ("clip",),
+    "ask_image": ("gemini", "clip"),
+    "serve": ("gemini", "clip"),
+}
+
+
+# 会写库的命令 (常驻服务会执行其中的入库命令)，运行期间独占入库日志；
+# 迁移也在其中: 切换时会删除旧库，另一个进程此时还在往旧库写入的记录会丢失
+JOURNAL_WRITERS = {"add_paper", "add_image", "batch_ingest", "import", "watch", "migrate_embeddings", "serve"}
+
+
+def init_handlers(command, capabilities=None):
+    """按子命令初始化 AI 与数据库，只加载该命令用得到的模型"""
+    from core.ai_handler import AIHandler
+    from core.db_handler import DatabaseHandler
+
+    ai = AIHandler()
+    ai.preload(COMMAND_CAPABILITIES.get(command, ()) if capabilities is None else capabilities)
+    db = DatabaseHandler()
+    # 检索和入库一律用库里记录的模型，配置改了也不会把两种向量混进同一个库
+    for space, (current, configured) in db.check_models(default_models()).items():
+        print(f"[提示] {space} 向量由 {current} 生成，与配置的 {configured} 不同，仍按 {current} 检索；"
+              f"运行 python main.py migrate_embeddings {space} 重新计算")
+    ai.use_models(**db.registry.models())
+    if command in JOURNAL_WRITERS:
+        # 同一时间只有一个写库进程: 拿不到日志锁就不运行，
+        # 否则两个进程的事务写进同一个日志，持锁进程清空日志时会抹掉另一个进程的事务
+        if not db.journal.lock_writer():
+            raise RuntimeError("另一个进程正在写库，请等它结束，或启动常驻服务 (python main.py serve) 统一执行写库命令")
+        # 上次入库中途退出时，按入库日志重放或回滚
+        recover_journal(db, IngestManifest())
+    return ai, db
+
+
+def capabilities_for(args):
+    """lexical 模式的检索完全在本地完成，不需要预加载 Gemini"""
+    if getattr(args, "mode", None) == "lexical":
+        return ()
+    return COMMAND_CAPABILITIES.get(args.command, ())
+
+
+def search_papers(ai, db, query, n_results, mode=SEARCH_MODE, where=None):
+    """
+    按检索模式查询论文库，返回格式与 Chroma query 相同
+    - vector: 只用向量
+    - hybrid: 向量 + BM25 倒数排名融合，专有名词、公式符号、作者名更容易命中
+    - lexical: 只用本地 BM25，不发任何网络请求
+    :param where: 类别 / 文件 / 页码过滤条件，在检索时下推到向量库和 BM25 索引
+    """
+    if mode == "lexical":
+        return db.search_paper_lexical(query, n_results=n_results, where=where)
+    query_vec = ai.get_gemini_embedding(query)
+    if mode == "hybrid":
+        return db.search_paper_hybrid(query_vec, query, n_results=n_results, where=where)
+    return db.search_paper(query_vec, n_results=n_results, where=where)
+
+
+def describe_classification(task):
+    """分类结果的来源说明"""
+    if task.get("classified_by") in (None, "llm"):
+        return "LLM"
+    return f"本地 {task['classified_by']}，置信度 {task['confidence']:.2f}"
+
+
+def process_paper(ai, db, manifest, file_path, topics, classifier=None):
     """处理单篇 PDF 论文的逻辑"""
     filename = os.path.basename(file_path)
     print(f"\n[PDF] 正在处理: {filename}")
     
-    # 1. 去重检查
-    if db.check_paper_exists(filename):
-        print(f"   [跳过]: 数据库中已存在该论文")
+    # 1. 增量检查 (未变化的跳过，改名的只更新路径)
+    task, status = plan_task(db, manifest, file_path, "paper")
+    if task is None:
+        print(f"   [跳过]: 数据库中已存在该论文 ({status})")
         return
 
     # 2. 读取并分块
-    chunks = read_pdf_chunks(file_path)
-    if not chunks: 
+    with PdfPagePool() as pdf_pool:
+        extract_paper(task, pdf_pool=pdf_pool)
+    if not task["chunks"]: 
         print("   [跳过]: PDF 读取为空或失败")
         return
 
     # 3. 生成向量
     print("   正在生成文本向量...")
     try:
-        embeddings = [ai.get_gemini_embedding(c['text']) for c in chunks]
+        embed_paper(ai, task)
     except Exception as e:
         print(f"   [错误] 向量生成失败: {e}")
         return
     
-    # 4. 智能分类 & 移动文件
-    print("   Gemini 正在阅读摘要并分类...")
-    first_page_text = chunks[0]['text'][:1000]
-    prompt = f"请阅读以下论文摘要，并从这些类别中选择最合适的一个：[{topics}]。只返回类别名称，不要标点符号。\n\n摘要：{first_page_text}"
-    
-    category = "Uncategorized"
-    try:
-        category = ai.chat_with_gemini(prompt).strip()
-        category = category.replace("'", "").replace('"', "").replace(".", "")
-        print(f"   分类结果: {category}")
-        
-        new_path = move_file_to_category(file_path, category, file_type="paper")
-        if new_path:
-            file_path = new_path 
-            
-    except Exception as e:
-        print(f"   [警告] 分类或移动失败: {e}")
+    # 4. 智能分类 (本地分类置信度足够时不调用 Gemini)
+    print("   正在分类...")
+    classify_paper(ai, task, topics, classifier)
+    print(f"   分类结果: {task['category']} ({describe_classification(task)})")
 
-    # 5. 入库 必须在移动文件之后，确保路径是最新的
-    db.add_paper_chunks(chunks, embeddings, moved_path=file_path, category=category)
+    # 5. 移动文件 & 入库 (入库必须在移动文件之后，确保路径是最新的)
+    commit_task(db, task, manifest)
     print("   论文处理完成。")
 
 
-def process_image(ai, db, file_path, topics="Screenshot,Diagram,Photo,Art,Infographic,Other"):
+def process_image(ai, db, manifest, file_path, topics="Screenshot,Diagram,Photo,Art,Infographic,Other",
+                  dedup=DEDUP_ENABLED, classifier=None, structured=IMAGE_STRUCTURED_OUTPUT):
     """处理单张图片的逻辑"""
     filename = os.path.basename(file_path)
     print(f"\n[IMG] 正在处理: {filename}")
     
-    # 1. 去重检查
-    if db.check_image_exists(filename):
-        print(f"   [跳过]: 数据库中已存在该图片")
+    # 1. 增量检查 (未变化的跳过，改名的只更新路径)
+    task, status = plan_task(db, manifest, file_path, "image", dedup=dedup)
+    if task is None:
+        print(f"   [跳过]: 数据库中已存在该图片 ({status})")
         return
 
     # 2. CLIP 向量
     try:
-        clip_vec = ai.get_clip_embedding(file_path)
+        task["clip_vec"] = ai.get_clip_embedding(file_path)
     except Exception as e:
         print(f"   [跳过]: CLIP处理失败 {e}")
         return
+    if len(task["clip_vec"]) == 0:
+        print("   [跳过]: CLIP处理失败")
+        return
+
+    # 3. 近似重复检测 (同一张图的其他格式 / 分辨率已在库中时，不再调用 Gemini)
+    if dedup:
+        check_duplicate(ai, db, task)
+        if "duplicate_of" in task:
+            print(f"   [跳过]: 与已入库的 {task['duplicate_of']} 近似重复 (相似度 {task['similarity']:.3f})")
+            # 记入清单，下次扫描直接跳过，不再计算 CLIP 向量
+            manifest.record_duplicate(file_path, "image", task["hash"], task["duplicate_of"])
+            return
 
-    # 3. Gemini 描述
+    # 4. Gemini 描述 + 分类 (结构化输出时合成一次请求)
     print("   Gemini 正在观察图片...")
     try:
-        desc = ai.get_image_description(file_path)
-        print(f"   描述: {desc[:30]}...")
+        if structured:
+            analyze_image(ai, task, topics, classifier)
+        else:
+            describe_image(ai, task)
+        print(f"   描述: {task['desc'][:30]}...")
     except Exception as e:
         print(f"   [跳过]: Gemini描述生成失败 {e}")
+        forget_pending_image(db, task)
         return
 
-    # 4. 智能分类 & 移动文件
-    print(f"   正在智能分类 (选项: {topics})...")
-    category = "Uncategorized"
+    # 5. 智能分类
+    if not structured:
+        print(f"   正在智能分类 (选项: {topics})...")
+        classify_image(ai, task, topics, classifier)
+    print(f"   分类结果: {task['category']} ({describe_classification(task)})")
+    
+    # 6. 描述向量化
     try:
-        classify_prompt = (
-            f"基于以下图片描述，将图片归类为[{topics}]中的一项。\n"
-            f"只返回类别名称，不要标点符号。\n\n"
-            f"图片描述：{desc}"
-        )
-        category = ai.chat_with_gemini(classify_prompt).strip()
-        category = category.replace("'", "").replace('"', "").replace(".", "")
-        print(f"   分类结果: {category}")
-        
-        new_path = move_file_to_category(file_path, category, file_type="image")
-        if new_path:
-            file_path = new_path
-            
+        embed_image_desc(ai, task, coalesce=False)
     except Exception as e:
-        print(f"   [警告] 分类或移动失败: {e}")
-    
-    # 5. 描述向量化
-    gemini_vec = ai.get_gemini_embedding(desc)
+        print(f"   [跳过]: {e}")
+        forget_pending_image(db, task)
+        return
 
-    # 6. 入库
-    db.add_image(file_path, clip_vec, desc, gemini_vec, category=category)
+    # 7. 移动文件 & 入库
+    try:
+        commit_task(db, task, manifest)
+    except Exception:
+        forget_pending_image(db, task)
+        raise
     print("   图片处理完成。")
 
 
+def file_kind(path):
+    """按扩展名判断文件类型: paper / image，其他文件返回 None"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in PDF_EXTS:
+        return "paper"
+    if ext in IMG_EXTS:
+        return "image"
+    return None
+
+
+def plan_tasks(db, manifest, paths, dedup=True):
+    """对照清单为每个文件生成入库任务，返回 (任务列表, 各状态的文件数)"""
+    tasks = []
+    status_count = {}
+    for path in paths:
+        kind = file_kind(path)
+        if kind is None:
+            continue
+        task, status = plan_task(db, manifest, path, kind, dedup=dedup)
+        status_count[status] = status_count.get(status, 0) + 1
+        if task is not None:
+            tasks.append(task)
+    return tasks, status_count
+
+
+def watch_folder(args, ai, db, write_lock=None):
+    """
+    监视文件夹，新增或修改的文件写完后成批入库 (只处理这一批，不重新扫描整个资料库)
+    :param write_lock: 常驻服务里与其他写库命令共用的锁
+    """
+    from core.watcher import FolderWatcher
+
+    classifier = create_classifier(args.classifier, ai, db)
+
+    def on_batch(paths):
+        with write_lock or contextlib.nullcontext():
+            t0 = time.perf_counter()
+            with METRICS.span("watch.batch"):
+                manifest = IngestManifest()
+                tasks, _ = plan_tasks(db, manifest, paths, dedup=not args.no_dedup)
+                manifest.save()
+                if not tasks:
+                    return
+                pipeline = IngestPipeline(
+                    ai, db, args.topics, args.img_topics,
+                    cpu_workers=args.cpu_workers, io_workers=args.workers,
+                    manifest=manifest, dedup=not args.no_dedup, classifier=classifier
+                )
+                stats = pipeline.run(tasks)
+                manifest.save()
+        print(f"[监视] {time.strftime('%H:%M:%S')} 入库 PDF {stats['paper']}，IMG {stats['image']}，"
+              f"失败 {stats['failed']}，近似重复 {stats['duplicate']} ({time.perf_counter() - t0:.1f}s)")
+
+    watcher = FolderWatcher(args.folder, on_batch, accept=lambda path: file_kind(path) is not None,
+                            use_native=not args.poll)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print("\n已停止监视")
+
+
+def search_images(ai, db, query, n_results=IMAGE_SEARCH_CANDIDATES, weights=IMAGE_FUSION_WEIGHTS, where=None):
+    """
+    图片双路检索: Gemini 描述向量 (网络) 与 CLIP 文本向量 (本地) 同时计算、同时查询，
+    再按图片路径去重，用加权倒数排名融合成一个列表。任一路失败时只用另一路。
+    :param where: 类别过滤条件，两路检索都在向量库里过滤
+    """
+    def desc_path():
+        query_vec = ai.get_gemini_embedding(query)
+        if len(query_vec) == 0:
+            return None
+        return db.search_image_desc(query_vec, n_results=n_results, where=where)
+
+    def clip_path():
+        return db.search_image_clip(ai.get_clip_text_embedding(query), n_results=n_results, where=where)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = {"desc": pool.submit(desc_path), "clip": pool.submit(clip_path)}
+    results = {}
+    for name, future in futures.items():
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"[警告] {name} 检索失败: {e}")
+            continue
+        if result is not None:
+            results[name] = result
+    return fuse_by_path(results, weights=weights)
+
+
+def search_similar_images(ai, db, image_path, n_results=5, where=None):
+    """以图搜图: 查询图片的 CLIP 向量直接在视觉库里找近邻，返回 [(路径, 相似度, 元数据), ...]，不含查询图片本身"""
+    query_vec = ai.get_clip_embedding(image_path)
+    if len(query_vec) == 0:
+        return []
+    # 查询图片本身可能已入库，多取一条
+    results = db.search_image_clip(query_vec, n_results=n_results + 1, where=where)
+    query_path = os.path.abspath(image_path)
+    hits = []
+    for meta, distance in zip(results['metadatas'][0], results['distances'][0]):
+        path = meta.get('path', '')
+        if os.path.abspath(path) == query_path:
+            continue
+        hits.append((path, 1 - distance, meta))
+    return hits[:n_results]
+
+
 # 主程序
 
-def main():
+def add_filter_arguments(parser, papers=True):
+    """检索过滤选项: 图片只有类别，论文还可以按文件名和页码过滤"""
+    parser.add_argument("--category", help="只在这些类别中检索 (逗号分隔)")
+    if papers:
+        parser.add_argument("--source", help="只在这篇论文中检索 (文件名)")
+        parser.add_argument("--page", type=int, help="只检索包含这一页的切片 (与 --source 一起使用)")
+
+
+def where_from_args(args):
+    return metadata_where(getattr(args, "category", None), getattr(args, "source", None), getattr(args, "page", None))
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Gemini 本地多模态助手")
+    parser.add_argument("--local", action="store_true", help="不使用常驻服务，直接在本进程中执行")
+    parser.add_argument("--profile", action="store_true", help="结束后打印各阶段耗时、调用次数与缓存命中的汇总表")
+    parser.add_argument("--metrics-out", help="把性能数据写入文件: .prom 为 Prometheus textfile 格式，其余为 JSON")
     subparsers = parser.add_subparsers(dest="command", help="可用命令")
 
     # 1. 添加论文
     add_p = subparsers.add_parser("add_paper", help="添加单篇论文")
     add_p.add_argument("path", help="PDF文件路径")
     add_p.add_argument("--topics", default="Reinforcement_Learning,Spatio-Temporal_Mining,Multimodal_Learning", help="分类选项")
+    add_p.add_argument("--classifier", choices=CLASSIFIER_MODES, default=CLASSIFY_MODE, help="分类方式: llm / local (本地优先)")
 
     # 2. 搜论文 (QA模式)
     search_p = subparsers.add_parser("search_paper", help="搜论文 (问答模式)")
     search_p.add_argument("query", help="问题")
+    search_p.add_argument("--mode", choices=["vector", "hybrid", "lexical"], default=SEARCH_MODE, help="检索模式")
+    search_p.add_argument("--retrieve-only", action="store_true", help="只列出参考片段，不调用 Gemini 回答")
+    search_p.add_argument("--candidates", type=int, default=RAG_CANDIDATES, help="召回的候选切片数")
+    search_p.add_argument("--budget", type=int, default=RAG_CONTEXT_TOKENS, help="参考资料的 token 预算")
+    search_p.add_argument("--no-stream", action="store_true", help="等完整回答生成后一次性输出")
+    add_filter_arguments(search_p)
 
     # 3. 文件索引 (列表模式)
     list_p = subparsers.add_parser("list_papers", help="根据主题列出相关论文文件")
     list_p.add_argument("topic", help="主题或关键词")
+    list_p.add_argument("--mode", choices=["vector", "hybrid", "lexical"], default=SEARCH_MODE, help="检索模式")
+    list_p.add_argument("--pooling", choices=list(POOLINGS), default=RERANK_POOLING, help="切片得分聚合到文件的方式")
+    list_p.add_argument("--candidates", type=int, default=LIST_PAPERS_CANDIDATES, help="初筛的切片数")
+    list_p.add_argument("--top", type=int, default=10, help="展示的论文数")
+    list_p.add_argument("--llm-rerank", action="store_true", help="本地重排后再让 Gemini 筛选一次 (多一次请求)")
+    add_filter_arguments(list_p)
 
     # 4. 添加图片
     add_i = subparsers.add_parser("add_image", help="添加单张图片")
     add_i.add_argument("path", help="图片路径")
     add_i.add_argument("--topics", default="Model_Architecture,Performance_Plot,Table,Qualitative_Visualization,Algorithm_Math", help="分类选项")
+    add_i.add_argument("--no-dedup", action="store_true", help="不做近似重复检测")
+    add_i.add_argument("--classifier", choices=CLASSIFIER_MODES, default=CLASSIFY_MODE, help="分类方式: llm / local (本地优先)")
 
     # 5. 搜图片
     search_i = subparsers.add_parser("search_image", help="搜图片")
     search_i.add_argument("query", help="描述")
+    search_i.add_argument("--top", type=int, default=3, help="展示的图片数")
+    add_filter_arguments(search_i, papers=False)
 
-    # 6. 搜图并提问
+    # 6. 以图搜图
+    similar_i = subparsers.add_parser("search_similar_image", help="以图搜图 (CLIP 视觉近邻)")
+    similar_i.add_argument("path", help="查询图片路径")
+    similar_i.add_argument("--top", type=int, default=5, help="展示的图片数")
+    add_filter_arguments(similar_i, papers=False)
+
+    # 7. 搜图并提问
     ask_i = subparsers.add_parser("ask_image", help="搜图并提问")
     ask_i.add_argument("desc", help="用于定位图片的描述")
     ask_i.add_argument("question", help="基于图片想问的具体问题")
+    add_filter_arguments(ask_i, papers=False)
 
-    # 7. 批量整理
+    # 8. 批量整理
     batch_p = subparsers.add_parser("batch_ingest", help="批量扫描文件夹处理所有文件")
     batch_p.add_argument("folder", help="文件夹路径")
     batch_p.add_argument("--topics", default="Reinforcement_Learning,Spatio-Temporal_Mining,Multimodal_Learning", help="论文分类选项")
     batch_p.add_argument("--img_topics", default="Model_Architecture,Performance_Plot,Table,Qualitative_Visualization,Algorithm_Math", help="图片分类选项")
-
-    args = parser.parse_args()
-
-    if not args.command:
-        parser.print_help()
-        return
-
-    # 初始化
-    try:
-        ai = AIHandler()
-        db = DatabaseHandler()
-    except Exception as e:
-        print(f"[错误] 初始化失败: {e}")
-        return
-
-    # 逻辑分支
+    batch_p.add_argument("--clip-batch-size", type=int, default=CLIP_BATCH_SIZE, help="CLIP 批量推理的图片数")
+    batch_p.add_argument("--workers", type=int, default=INGEST_IO_WORKERS, help="I/O 线程数 (Gemini 调用)")
+    batch_p.add_argument("--cpu-workers", type=int, default=INGEST_CPU_WORKERS, help="CPU 线程数 (PDF 解析)")
+    batch_p.add_argument("--no-dedup", action="store_true", help="不做近似重复图片检测")
+    batch_p.add_argument("--classifier", choices=CLASSIFIER_MODES, default=CLASSIFY_MODE, help="分类方式: llm / local (本地优先)")
+
+    # 9. 监视文件夹
+    watch_p = subparsers.add_parser("watch", help="监视文件夹，新增或修改的文件自动入库")
+    watch_p.add_argument("folder", help="文件夹路径")
+    watch_p.add_argument("--topics", default="Reinforcement_Learning,Spatio-Temporal_Mining,Multimodal_Learning", help="论文分类选项")
+    watch_p.add_argument("--img_topics", default="Model_Architecture,Performance_Plot,Table,Qualitative_Visualization,Algorithm_Math", help="图片分类选项")
+    watch_p.add_argument("--workers", type=int, default=INGEST_IO_WORKERS, help="I/O 线程数 (Gemini 调用)")
+    watch_p.add_argument("--cpu-workers", type=int, default=INGEST_CPU_WORKERS, help="CPU 线程数 (PDF 解析)")
+    watch_p.add_argument("--no-dedup", action="store_true", help="不做近似重复图片检测")
+    watch_p.add_argument("--classifier", choices=CLASSIFIER_MODES, default=CLASSIFY_MODE, help="分类方式: llm / local (本地优先)")
+    watch_p.add_argument("--poll", action="store_true", help="不使用系统文件事件 (watchdog)，定时轮询目录")
+
+    # 10. 快照导出 / 导入
+    export_p = subparsers.add_parser("export", help="把整个知识库导出为一个快照文件")
+    export_p.add_argument("path", help="快照文件路径，例如 kb.snap")
+    export_p.add_argument("--chunk-rows", type=int, default=SNAPSHOT_CHUNK_ROWS, help="每个数据块的行数")
+    export_p.add_argument("--dtype", choices=["float16", "float32"], default=SNAPSHOT_DTYPE, help="向量的存储精度")
+    import_p = subparsers.add_parser("import", help="从快照文件批量导入知识库 (按 id 覆盖)")
+    import_p.add_argument("path", help="快照文件路径")
+
+    # 11. 换向量模型后重新向量化 (检索不中断，中断后可续跑)
+    migrate_p = subparsers.add_parser("migrate_embeddings", help="用新模型重新计算向量，完成后原子切换")
+    migrate_p.add_argument("space", choices=["text", "clip"], help="text: 论文库和图片描述库；clip: 视觉库")
+    migrate_p.add_argument("--model", help="新模型，默认为配置里的 EMBEDDING_MODEL / MODEL_PATH_CLIP")
+    migrate_p.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE, help="每批重新计算的记录数")
+
+    # 12. 常驻服务
+    serve_p = subparsers.add_parser("serve", help="启动常驻服务，模型和数据库保持在内存中")
+    serve_p.add_argument("--host", default=SERVER_HOST, help="监听地址 (仅限本机)")
+    serve_p.add_argument("--port", type=int, default=SERVER_PORT, help="监听端口")
+    serve_p.add_argument("--watch", metavar="FOLDER", help="同时在服务内监视该文件夹 (分类等选项取 watch 命令的默认值)")
+
+    return parser
+
+
+def remote_argv(argv, args):
+    """把命令行里的文件/文件夹参数换成绝对路径，服务端的工作目录可能不同"""
+    argv = list(argv)
+    for attr in ("path", "folder", "metrics_out"):
+        value = getattr(args, attr, None)
+        if value and value in argv:
+            argv[argv.index(value)] = os.path.abspath(value)
+    return argv
+
+
+def run_command(args, ai, db):
+    """执行一条子命令，本地 CLI 与常驻服务共用；--profile / --metrics-out 时输出各阶段耗时"""
+    profile = getattr(args, "profile", False)
+    metrics_out = getattr(args, "metrics_out", None)
+    if profile or metrics_out:
+        # 常驻服务里并发执行的其他命令也会计入这一次的统计
+        METRICS.reset()
+    with METRICS.span(f"command.{args.command}"):
+        _run_command(args, ai, db)
+    if profile:
+        print(METRICS.summary())
+    if metrics_out:
+        METRICS.write(metrics_out)
+        print(f"性能数据已写入: {metrics_out}")
+
+
+def _run_command(args, ai, db):
 
     # 1. 单个处理论文
     if args.command == "add_paper":
         if os.path.exists(args.path):
-            process_paper(ai, db, args.path, args.topics)
+            manifest = IngestManifest()
+            with METRICS.file(os.path.basename(args.path)):
+                process_paper(ai, db, manifest, args.path, args.topics,
+                              classifier=create_classifier(args.classifier, ai, db))
+            manifest.save()
         else:
             print("[错误] 文件不存在")
 
     # 2. 单个处理图片
     elif args.command == "add_image":
         if os.path.exists(args.path):
-            process_image(ai, db, args.path, topics=args.topics)
+            manifest = IngestManifest()
+            with METRICS.file(os.path.basename(args.path)):
+                process_image(ai, db, manifest, args.path, topics=args.topics, dedup=not args.no_dedup,
+                              classifier=create_classifier(args.classifier, ai, db))
+            manifest.save()
         else:
             print("[错误] 文件不存在")
 
@@ -191,160 +499,280 @@ def main():
         
         print(f"开始扫描文件夹: {folder_path} ...")
         
-        count_pdf = 0
-        count_img = 0
-        
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                if file.startswith('.'): continue
-
-                full_path = os.path.join(root, file)
-                ext = os.path.splitext(file)[1].lower()
-
-                if ext == '.pdf':
-                    process_paper(ai, db, full_path, args.topics)
-                    count_pdf += 1
-                elif ext in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']:
-                    process_image(ai, db, full_path, topics=args.img_topics)
-                    count_img += 1
+        # 清单只加载一次，未变化的文件在内存里判断后直接跳过，不查询 Chroma
+        manifest = IngestManifest()
+        paths = [os.path.join(root, file) for root, dirs, files in os.walk(folder_path)
+                 for file in files if not file.startswith('.')]
+        tasks, status_count = plan_tasks(db, manifest, paths, dedup=not args.no_dedup)
+        # 改名记录在扫描阶段就已写库，先落盘一次
+        manifest.save()
+
+        skipped = status_count.get(UNCHANGED, 0) + status_count.get(DUPLICATE, 0)
+        print(f"扫描结果: 新文件 {status_count.get(NEW, 0)}，内容变化 {status_count.get(MODIFIED, 0)}，"
+              f"改名 {status_count.get(RENAMED, 0)}，未变化 {status_count.get(UNCHANGED, 0)}，"
+              f"重复 {status_count.get(DUPLICATE, 0)}")
+        print(f"待处理 {len(tasks)} 个文件 "
+              f"(CPU 线程: {args.cpu_workers}, I/O 线程: {args.workers}, CLIP batch: {args.clip_batch_size})")
+
+        pipeline = IngestPipeline(
+            ai, db, args.topics, args.img_topics,
+            cpu_workers=args.cpu_workers, io_workers=args.workers,
+            clip_batch_size=args.clip_batch_size, manifest=manifest, dedup=not args.no_dedup,
+            classifier=create_classifier(args.classifier, ai, db)
+        )
+        stats = pipeline.run(tasks)
+        manifest.save()
         
-        print(f"\n批量处理完成！PDF: {count_pdf}, IMG: {count_img}")
+        print(f"\n批量处理完成！PDF: {stats['paper']}, IMG: {stats['image']}, 失败: {stats['failed']}, "
+              f"跳过: {skipped}, 近似重复: {stats['duplicate']}")
+        if args.classifier == "local":
+            fallback = stats['local_attempted'] - stats['local_classified']
+            print(f"本地分类: {stats['local_classified']} 个文件，节省 LLM 调用 {stats['local_classified']} 次 "
+                  f"(经过本地分类器 {stats['local_attempted']} 个，其中 {fallback} 个置信度不足，由 LLM 分类)")
+        if stats['structured']:
+            print(f"结构化分析: {stats['structured']} 张图片的描述、分类和 OCR 一次请求完成 (不经过本地分类器)")
+        if stats['image_bytes']:
+            saved = 1 - stats['payload_bytes'] / stats['image_bytes']
+            print(f"图片上传: 原图 {stats['image_bytes'] / 1e6:.1f}MB -> {stats['payload_bytes'] / 1e6:.1f}MB (减少 {saved:.0%})")
+        if ai.cache is not None:
+            print(ai.cache.summary())
+
+    # 监视文件夹 (一直运行到 Ctrl+C)
+    elif args.command == "watch":
+        if not os.path.isdir(args.folder):
+            print(f"[错误] '{args.folder}' 不是一个有效的文件夹")
+            return
+        watch_folder(args, ai, db)
+
+    # 快照导出 / 导入
+    elif args.command == "export":
+        print(f"正在导出知识库: {args.path} ...")
+        t0 = time.perf_counter()
+        counts = export_snapshot(db, args.path, chunk_rows=args.chunk_rows, dtype=args.dtype,
+                                 manifest=IngestManifest())
+        size = os.path.getsize(args.path)
+        print(f"导出完成: {', '.join(f'{name} {n} 条' for name, n in counts.items())}，"
+              f"{size / 1e6:.1f}MB，{time.perf_counter() - t0:.1f}s")
+
+    elif args.command == "import":
+        if not os.path.exists(args.path):
+            print("[错误] 文件不存在")
+            return
+        print(f"正在导入快照: {args.path} ...")
+        t0 = time.perf_counter()
+        manifest = IngestManifest()
+        try:
+            counts = import_snapshot(db, args.path, manifest=manifest)
+        except ValueError as e:
+            print(f"[错误] {e}")
+            return
+        # 恢复的清单记录让之后的 batch_ingest / watch 把这些文件判定为未变化
+        manifest.save()
+        # 空库导入后改用快照的向量模型
+        ai.use_models(**db.registry.models())
+        print(f"导入完成: {', '.join(f'{name} {n} 条' for name, n in counts.items())}，"
+              f"{time.perf_counter() - t0:.1f}s")
+
+    elif args.command == "migrate_embeddings":
+        from core.migration import migrate_embeddings
+        model = args.model or default_models()[args.space]
+        t0 = time.perf_counter()
+        try:
+            counts = migrate_embeddings(ai, db, args.space, model, batch_size=args.batch_size)
+        except (ValueError, RuntimeError) as e:
+            print(f"[错误] {e}")
+            return
+        print(f"迁移完成，已切换到 {model}: {', '.join(f'{name} {n} 条' for name, n in counts.items())}，"
+              f"{time.perf_counter() - t0:.1f}s")
 
     # 4. 搜论文 (QA)
     elif args.command == "search_paper":
-        print(f"正在检索: {args.query}")
-        query_vec = ai.get_gemini_embedding(args.query)
-        results = db.search_paper(query_vec, n_results=3)
-        
-        docs = results['documents'][0]
-        metas = results['metadatas'][0]
-
-        if not docs:
+        where = where_from_args(args)
+        print(f"正在检索: {args.query} (模式: {args.mode}{f'，过滤: {where}' if where else ''})")
+        results = search_papers(ai, db, args.query, n_results=args.candidates, mode=args.mode, where=where)
+        if not results['documents'][0]:
             print("[提示] 无相关信息。")
             return
 
+        # 候选切片去重后按相关度装进 token 预算
+        packed = pack_context(results, db.get_paper_embeddings(results['ids'][0]), budget=args.budget)
+        METRICS.incr("rag.prompt_context_tokens", packed["tokens"])
+        METRICS.incr("rag.dropped_duplicates", packed["dropped_duplicates"])
+
         print("\n--- 参考片段")
-        for i, meta in enumerate(metas):
+        for i, chunk in enumerate(packed["chunks"]):
             # 防止旧数据报错
-            src = meta.get('source', '未知')
-            page = meta.get('page', '?')
-            print(f"[{i+1}] {src} (P.{page})")
+            src = chunk["meta"].get('source', '未知')
+            page = chunk["meta"].get('page', '?')
+            print(f"[{i+1}] {src} (P.{page}) {chunk['tokens']} tokens")
+        print(f"候选 {packed['candidates']} 段，去重 {packed['dropped_duplicates']} 段，"
+              f"超出预算 {packed['dropped_budget']} 段，上下文 {packed['tokens']}/{args.budget} tokens")
+
+        if args.retrieve_only:
+            for i, chunk in enumerate(packed["chunks"]):
+                print(f"\n[{i+1}] {chunk['text'][:300]}")
+            return
 
         print("\nGemini 回答:")
-        context = "\n\n".join(docs)
-        prompt = f"你是一个学术助手。基于以下参考资料回答用户问题：{args.query}\n\n参考资料：\n{context}"
-        answer = ai.chat_with_gemini(prompt)
-        print(answer)
+        prompt = (f"你是一个学术助手。基于以下参考资料回答用户问题：{args.query}\n"
+                  f"引用资料时标注编号，例如 [1]。\n\n参考资料：\n{format_context(packed)}")
+        prompt_tokens = count_tokens(prompt)
+        if args.no_stream:
+            t0 = time.perf_counter()
+            print(ai.chat_with_gemini(prompt))
+            print(f"\n[统计] 完整回答 {time.perf_counter() - t0:.2f}s，提示词约 {prompt_tokens} tokens")
+            return
+        stats = {}
+        for text in ai.stream_gemini(prompt, stats):
+            print(text, end="", flush=True)
+        print()
+        if stats.get("stop_reason"):
+            print(f"[提示] 回答可能不完整: {stats['stop_reason']}")
+        reported = f" (API 计 {stats['prompt_tokens']})" if stats.get("prompt_tokens") else ""
+        first = stats.get("first_token_s")
+        timing = f"首字延迟 {first:.2f}s，" if first is not None else ""
+        print(f"\n[统计] {timing}完整回答 {stats['total_s']:.2f}s，提示词约 {prompt_tokens} tokens{reported}")
 
     elif args.command == "list_papers":
         print(f"正在索引主题: '{args.topic}' ...")
         
-        # 1. 向量搜索 
-        query_vec = ai.get_gemini_embedding(args.topic)
-        results = db.search_paper(query_vec, n_results=15)
-        
-        metas = results['metadatas'][0]
-        if not metas:
+        # 1. 初筛 (向量 / 混合 / 关键词)，候选池比最终展示的多得多
+        results = search_papers(ai, db, args.topic, n_results=args.candidates, mode=args.mode,
+                                where=where_from_args(args))
+        if not results['metadatas'][0]:
             print("[提示] 未找到相关论文。")
             return
 
-        # 2. 聚合候选文件
-        candidate_files = {}
-        for meta in metas:
-            path = meta.get('path', meta.get('source', 'Unknown'))
-            filename = os.path.basename(path)
-            category = meta.get('category', 'Unknown')
-            
-            # 记录下来，稍后发给 Gemini
-            if filename not in candidate_files:
-                candidate_files[filename] = {
-                    "category": category,
-                    "source_path": path
-                }
-
-        print(f"向量库初筛找到 {len(candidate_files)} 篇候选论文，正在进行 AI 重排序...")
-
-        # 3. 构造 Prompt 进行重排序 
-        # 将候选列表转为文本
-        candidates_text = ""
-        for i, (fname, info) in enumerate(candidate_files.items()):
-            candidates_text += f"{i+1}. 文件名: {fname} (分类: {info['category']})\n"
-
-        rerank_prompt = (
-            f"用户正在寻找关于 '{args.topic}' 的论文。\n"
-            f"向量数据库找出了以下候选文件，请你判断哪些文件真正与主题高度相关，并按相关性从高到低排序。\n"
-            f"请排除掉明显不相关的文件（例如只是提到了关键词但核心主题不符的）。\n\n"
-            f"候选列表：\n{candidates_text}\n\n"
-            f"请输出一个简洁的列表，格式如下：\n"
-            f"1. [相关度: 高/中/低] 文件名 - 一句话解释为什么相关\n"
-        )
+        # 2. 本地重排: 切片得分按文件聚合
+        ranked = rank_files(results, pooling=args.pooling)[:args.top]
+        print(f"初筛 {len(results['ids'][0])} 个片段，聚合为 {len(ranked)} 篇论文 (池化: {args.pooling})")
 
-        # 4. 让 Gemini 进行最终裁决
-        try:
-            ranking_result = ai.chat_with_gemini(rerank_prompt)
-            print("\n" + "="*30)
-            print(f"Gemini 智能筛选结果 (主题: {args.topic})")
-            print("="*30)
-            print(ranking_result)
-            print("="*30)
-        except Exception as e:
-            print(f"[错误] 重排序失败: {e}")
-            # 如果 AI 失败，回退到简单的列表展示
-            for fname in candidate_files:
-                print(f"- {fname}")
+        print("\n" + "="*30)
+        print(f"相关论文 (主题: {args.topic})")
+        print("="*30)
+        for i, info in enumerate(ranked):
+            pages = ",".join(str(p) for p in info['pages'])
+            print(f"{i+1}. [{info['score']:.3f}] {info['filename']} ({info['category']}) 命中 {info['hits']} 段 P.{pages}")
+        print("="*30)
+
+        # 3. 可选: 让 Gemini 再做一次裁决
+        if args.llm_rerank:
+            try:
+                ranking_result = llm_rerank(ai, args.topic, ranked)
+                print(f"\nGemini 智能筛选结果:")
+                print(ranking_result)
+            except Exception as e:
+                print(f"[错误] 重排序失败: {e}")
 
     # 6. 搜图片
     elif args.command == "search_image":
         print(f"正在进行双模搜索: '{args.query}'\n")
-        
-        # A. Gemini
-        gemini_query_vec = ai.get_gemini_embedding(args.query)
-        gemini_results = db.search_image_desc(gemini_query_vec, n_results=3)
-        if gemini_results['metadatas'][0]:
-            print("[语义匹配]")
-            for i, meta in enumerate(gemini_results['metadatas'][0]):
-                desc = meta.get('desc', '')[:30].replace('\n', ' ')
-                cat = meta.get('category', '')
-                print(f"  {i+1}. [{cat}] {os.path.basename(meta['path'])} | {desc}...")
-        
-        # B. CLIP
-        try:
-            clip_query_vec = ai.get_clip_text_embedding(args.query)
-            clip_results = db.search_image_clip(clip_query_vec, n_results=3)
-            if clip_results['metadatas'][0]:
-                print("\n[视觉匹配]")
-                for i, meta in enumerate(clip_results['metadatas'][0]):
-                    print(f"  {i+1}. {os.path.basename(meta['path'])}")
-        except:
-            pass
+        fused = search_images(ai, db, args.query, where=where_from_args(args))
+        if not fused:
+            print("[提示] 未找到相关图片。")
+            return
 
-    # 7. 搜图并提问
+        labels = {"desc": "语义", "clip": "视觉"}
+        for i, hit in enumerate(fused[:args.top]):
+            meta = hit['meta']
+            desc = meta.get('desc', '')[:30].replace('\n', ' ')
+            cat = meta.get('category', '')
+            via = " ".join(f"{labels[name]}#{rank}" for name, rank in hit['ranks'].items())
+            print(f"  {i+1}. [{cat}] {os.path.basename(hit['path'])} ({via}) | {desc}...")
+
+    # 7. 以图搜图
+    elif args.command == "search_similar_image":
+        if not os.path.exists(args.path):
+            print("[错误] 文件不存在")
+            return
+        print(f"正在以图搜图: {os.path.basename(args.path)}\n")
+        hits = search_similar_images(ai, db, args.path, n_results=args.top, where=where_from_args(args))
+        if not hits:
+            print("[提示] 未找到相似图片。")
+            return
+        for i, (path, similarity, meta) in enumerate(hits):
+            print(f"  {i+1}. [{similarity:.3f}] [{meta.get('category', '')}] {path}")
+
+    # 8. 搜图并提问
     elif args.command == "ask_image":
         print(f"正在定位图片: '{args.desc}'...")
         best_path = None
-        
-        # 1. Gemini
-        g_vec = ai.get_gemini_embedding(args.desc)
-        res_g = db.search_image_desc(g_vec, n_results=1)
-        if res_g['metadatas'][0]:
-            best_path = res_g['metadatas'][0][0]['path']
-            print(f"[Gemini] 锁定: {os.path.basename(best_path)}")
-        
-        # 2. CLIP 
-        if not best_path:
-            try:
-                c_vec = ai.get_clip_text_embedding(args.desc)
-                res_c = db.search_image_clip(c_vec, n_results=1)
-                if res_c['metadatas'][0]:
-                    best_path = res_c['metadatas'][0][0]['path']
-                    print(f"[CLIP] 锁定: {os.path.basename(best_path)}")
-            except: pass
+
+        for hit in search_images(ai, db, args.desc, where=where_from_args(args)):
+            if os.path.exists(hit['path']):
+                best_path = hit['path']
+                print(f"锁定: {os.path.basename(best_path)} (融合得分 {hit['score']:.4f})")
+                break
             
-        if best_path and os.path.exists(best_path):
+        if best_path:
             print(f"Gemini 正在回答: {args.question}")
             print(ai.chat_with_image(best_path, args.question))
         else:
             print("[错误] 未找到图片。")
 
+
+def serve(args):
+    """常驻服务: 只初始化一次 AI 与数据库，之后所有请求复用"""
+    from core.server import KnowledgeBaseServer
+
+    # 先检查参数，再占用端口、写令牌文件
+    if args.watch and not os.path.isdir(args.watch):
+        print(f"[错误] '{args.watch}' 不是一个有效的文件夹")
+        return
+    try:
+        ai, db = init_handlers("serve")
+    except Exception as e:
+        print(f"[错误] 初始化失败: {e}")
+        return
+
+    parser = build_parser()
+    # 服务的写锁就是数据库的写锁，迁移最后的切换与入库命令互斥
+    try:
+        server = KnowledgeBaseServer(parser, lambda a: run_command(a, ai, db), host=args.host, port=args.port,
+                                     write_lock=db.write_lock)
+    except (RuntimeError, OSError) as e:
+        print(f"[错误] 常驻服务启动失败: {e}")
+        return
+    if args.watch:
+        # 监视线程与其他写库命令共用服务的写锁，入库日志打印在服务端终端
+        watch_args = parser.parse_args(["watch", os.path.abspath(args.watch)])
+        threading.Thread(target=watch_folder, args=(watch_args, ai, db, server.write_lock), daemon=True).start()
+    server.serve_forever()
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if not args.command:
+        parser.print_help()
+        return
+
+    if args.command == "serve":
+        serve(args)
+        return
+
+    # watch 会一直运行，不转发给常驻服务；服务在运行时不另开进程写库
+    if args.command == "watch":
+        from core.server import server_alive
+        if server_alive():
+            print("[提示] 常驻服务正在运行，请改用 python main.py serve --watch <folder>，由服务负责监视入库")
+            return
+
+    # 常驻服务在运行时，本进程只作为瘦客户端转发命令
+    elif not args.local:
+        from core.server import run_remote
+        if run_remote(remote_argv(sys.argv[1:], args)):
+            return
+
+    # 初始化
+    try:
+        ai, db = init_handlers(args.command, capabilities_for(args))
+    except Exception as e:
+        print(f"[错误] 初始化失败: {e}")
+        return
+
+    run_command(args, ai, db)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
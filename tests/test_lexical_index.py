@@ -0,0 +1,20 @@
+# tests/test_lexical_index.py
+from core.lexical_index import LexicalIndex, index_terms
+
+
+def test_index_terms_keep_math_symbols():
+    terms = index_terms("∑_i x_i ≤ ∇f(x) + 1")
+    assert "∑" in terms and "≤" in terms and "∇" in terms
+    # ASCII 运算符和标点不收录
+    assert "+" not in terms and "(" not in terms
+
+
+def test_search_math_symbol(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexicon.sqlite"))
+    index.upsert("paper_db", ["a", "b"], [
+        "梯度 ∇L 沿负方向更新参数",
+        "the loss is averaged over the batch",
+    ], [{"source": "a.pdf"}, {"source": "b.pdf"}])
+
+    hits = index.search("paper_db", "∇", n_results=5)
+    assert [h[0] for h in hits] == ["a"]
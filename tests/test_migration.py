@@ -0,0 +1,76 @@
+# tests/test_migration.py
+import functools
+
+import numpy as np
+import pytest
+
+import main
+from core import db_handler, migration
+from core.db_handler import DatabaseHandler
+
+
+class _StubTarget:
+    """新模型的替身: 按文本内容生成确定的 768 维向量，不联网"""
+
+    def get_text_embeddings_batch(self, texts):
+        return np.stack([np.random.default_rng(abs(hash(t)) % 2 ** 32).standard_normal(768) for t in texts])
+
+
+def _write_paper(db, record_id, text):
+    db.write_now([{
+        "collection": db.logical["paper_db"].name,
+        "ids": [record_id],
+        "embeddings": np.random.default_rng(0).standard_normal((1, 768)),
+        "metadatas": [{"source": f"{record_id}.pdf", "page": 1, "path": f"papers/AI/{record_id}.pdf",
+                       "category": "AI", "doc_id": record_id}],
+        "documents": [text],
+    }])
+
+
+@pytest.fixture
+def handlers(tmp_path, monkeypatch):
+    """init_handlers 用 mmap 后端、在临时目录里建库"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db_handler, "DatabaseHandler", functools.partial(DatabaseHandler, backend="mmap"))
+    return main.init_handlers
+
+
+def test_writer_in_another_process_is_refused_during_migration(handlers):
+    ai, db = handlers("migrate_embeddings")
+    # 另一个进程 (同一个库上的第二个 handler) 这时启动入库: 拿不到日志锁，直接拒绝
+    with pytest.raises(RuntimeError):
+        handlers("batch_ingest", ())
+    other = db_handler.DatabaseHandler()
+    with pytest.raises(RuntimeError):
+        other.journal.begin("paper", "a.pdf", "papers/AI/a.pdf")
+
+
+def test_migration_refused_while_another_process_ingests(handlers):
+    ai, db = handlers("batch_ingest", ())  # 保持引用，进程退出前一直持有日志锁
+    with pytest.raises(RuntimeError):
+        handlers("migrate_embeddings")
+
+
+def test_writes_during_reconcile_reach_new_collection(handlers, monkeypatch):
+    ai, db = handlers("migrate_embeddings")
+    _write_paper(db, "old", "paper before migration")
+    _write_paper(db, "gone", "paper deleted during migration")
+    monkeypatch.setattr(migration, "_target_handler", lambda ai, space, model: _StubTarget())
+
+    # 全量核对之后、切换之前的写入与删除 (例如常驻服务里同时进行的入库)
+    reconcile = migration._reconcile
+
+    def reconcile_then_write(db, target, space, live, shadow, skipped, batch_size):
+        handled = reconcile(db, target, space, live, shadow, skipped, batch_size)
+        if live is db.logical["paper_db"]:
+            _write_paper(db, "new", "paper added during migration")
+            db.delete_document("paper", "gone")
+        return handled
+
+    monkeypatch.setattr(migration, "_reconcile", reconcile_then_write)
+    migration.migrate_embeddings(ai, db, "text", "models/stub-v2")
+
+    live = db.logical["paper_db"]
+    assert live.name != "paper_db"
+    assert sorted(live.get(include=[])['ids']) == ["new", "old"]
+    assert db.registry.model("text") == "models/stub-v2"
@@ -0,0 +1,58 @@
+# tests/test_snapshot.py
+import os
+import shutil
+
+import numpy as np
+
+import main
+from core.db_handler import DatabaseHandler
+from core.embedding_cache import sha256_file
+from core.manifest import IngestManifest, UNCHANGED
+from core.snapshot import export_snapshot, import_snapshot
+
+
+def _library(root):
+    """资料库: 一篇已归档的论文和一张已归档的图片"""
+    paper = os.path.join(root, "papers", "AI", "attention.pdf")
+    image = os.path.join(root, "images", "Diagram", "arch.png")
+    for path, data in ((paper, b"%PDF-1.4 attention"), (image, b"\x89PNG arch")):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    return [paper, image]
+
+
+def test_ingest_after_import_sees_files_unchanged(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    source_root, target_root = tmp_path / "source", tmp_path / "target"
+    source_root.mkdir()
+    target_root.mkdir()
+    monkeypatch.chdir(source_root)
+    paper, image = _library(".")
+
+    db = DatabaseHandler(path=str(tmp_path / "source_db"), backend="mmap")
+    manifest = IngestManifest(str(tmp_path / "source_db" / "manifest.json"))
+    paper_hash, image_hash = sha256_file(paper), sha256_file(image)
+    db.add_paper_chunks([{"source": "attention.pdf", "page": 1, "text": "attention is all you need", "path": paper}],
+                        rng.standard_normal((1, 768)), moved_path=paper, category="AI",
+                        doc_id=manifest.doc_id(paper_hash))
+    db.add_image(image, rng.standard_normal(512), "模型结构图", rng.standard_normal(768),
+                 category="Diagram", doc_id=manifest.doc_id(image_hash))
+    manifest.record(paper, "paper", paper_hash, "AI")
+    manifest.record(image, "image", image_hash, "Diagram")
+    snapshot = str(tmp_path / "kb.snap")
+    export_snapshot(db, snapshot, manifest=manifest)
+
+    # 新机器: 资料库放在另一个目录，文件是重新拷贝的 (修改时间不同)
+    monkeypatch.chdir(target_root)
+    for path in (paper, image):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copy(os.path.join(source_root, path), path)
+    target = DatabaseHandler(path=str(tmp_path / "target_db"), backend="mmap")
+    target_manifest = IngestManifest(str(tmp_path / "target_db" / "manifest.json"))
+    import_snapshot(target, snapshot, manifest=target_manifest)
+    target_manifest.save()
+
+    tasks, status_count = main.plan_tasks(target, IngestManifest(target_manifest.path), [paper, image])
+    assert tasks == []
+    assert status_count == {UNCHANGED: 2}